@@ -0,0 +1,132 @@
+"""
+The asset pack: the game's files in a single file.
+
+The game reads well over a hundred files at startup: every frame of both
+characters, the maps and their tileset images, and the sounds. An asset
+pack (built by build_assets.py) holds all of them. It is opened once and
+memory-mapped, and files are read from their slice of it in place.
+
+    magic (8 bytes), index offset and size (two little-endian uint64)
+    the files' bytes, one after the other
+    index: JSON {file name: [offset, size]}
+
+File names are relative paths with forward slashes, like in the repository.
+Besides the files themselves the pack holds every map already parsed, and
+pickled like the server shares them, under the map's name + ".pickle".
+
+Without open_pack(), or for files not in the pack, files are read from the
+loose files, which is how the game runs during development. The loaders
+that make arcade textures, maps and sounds out of them are in assets.py,
+this module needs no arcade.
+"""
+import io
+import json
+import mmap
+import struct
+from pathlib import Path
+
+ASSET_PACK = "assets.pack"
+MAGIC = b"FKWPACK1"
+HEADER = struct.Struct("<8sQQ")
+
+
+class SliceFile(io.RawIOBase):
+    """A read-only file over a memoryview, for the decoders that want a file."""
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), len(self.view) - self.position)
+        buffer[:count] = self.view[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = (0, self.position, len(self.view))[whence]
+        self.position = max(base + offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+class AssetPack:
+    """A memory-mapped asset pack."""
+
+    def __init__(self, file_name=ASSET_PACK):
+        self.file_name = file_name
+        with open(file_name, "rb") as file:
+            # The map stays valid after the file is closed
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, offset, size = HEADER.unpack_from(self.view)
+        if magic != MAGIC:
+            raise ValueError(f"{file_name} is not an asset pack")
+        self.index = json.loads(bytes(self.view[offset:offset + size]))
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def slice(self, name):
+        """The bytes of a file, as a view into the pack. Raises KeyError for a file that is not in it."""
+        offset, size = self.index[name]
+        return self.view[offset:offset + size]
+
+    def open(self, name):
+        """A file object reading a file of the pack."""
+        return io.BufferedReader(SliceFile(self.slice(name)))
+
+
+def write_pack(file_name, files):
+    """Write an asset pack of `files`, an iterable of (name, bytes)."""
+    index = {}
+    with open(file_name, "wb") as pack:
+        pack.write(bytes(HEADER.size))
+        for name, data in files:
+            index[name] = [pack.tell(), len(data)]
+            pack.write(data)
+        offset = pack.tell()
+        data = json.dumps(index, separators=(",", ":")).encode("utf-8")
+        pack.write(data)
+        pack.seek(0)
+        pack.write(HEADER.pack(MAGIC, offset, len(data)))
+    return index
+
+
+# The pack files are read from, None to read the loose files
+pack = None
+
+
+def asset_name(file_name):
+    """The name of a file in the pack."""
+    return Path(file_name).as_posix()
+
+
+def open_pack(file_name=ASSET_PACK):
+    """Read files from the asset pack from now on. Returns the pack."""
+    global pack
+    pack = AssetPack(file_name)
+    return pack
+
+
+def in_pack(file_name):
+    """Whether a file is read from the pack."""
+    return pack is not None and asset_name(file_name) in pack
+
+
+def open_file(file_name):
+    """Open a file for reading bytes."""
+    if in_pack(file_name):
+        return pack.open(asset_name(file_name))
+    return open(file_name, "rb")
@@ -0,0 +1,84 @@
+"""
+Loading arcade textures, Tiled maps and sounds, from the asset pack when
+one is open (see assetpack.py) and from the loose files otherwise.
+"""
+import pickle
+from pathlib import Path
+
+import arcade
+import arcade.tilemap.tilemap
+import pyglet
+import pytiled_parser
+from PIL import Image
+
+import assetpack
+from assetpack import ASSET_PACK, asset_name, in_pack
+
+# Name suffix of the parsed maps in the pack
+PARSED_MAP = ".pickle"
+
+
+def open_pack(file_name=ASSET_PACK):
+    """Load from the asset pack from now on. Returns the pack."""
+    pack = assetpack.open_pack(file_name)
+    # arcade's tile maps look for tileset images on disk before loading them
+    if not hasattr(arcade.tilemap.tilemap._get_image_source, "loose"):
+        arcade.tilemap.tilemap._get_image_source = _image_source(arcade.tilemap.tilemap._get_image_source)
+    return pack
+
+
+def load_image(file_name):
+    """
+    Put a packed image in arcade's texture cache, under the name arcade
+    loads the whole image file by. Every arcade function loading a texture
+    from it, or from a part of it, then uses that instead of the file.
+    """
+    if in_pack(file_name) and str(file_name) not in arcade.load_texture.texture_cache:
+        with assetpack.pack.open(asset_name(file_name)) as file:
+            image = Image.open(file).convert("RGBA")
+        arcade.load_texture.texture_cache[str(file_name)] = arcade.Texture(str(file_name), image, hit_box_algorithm="None")
+
+
+def load_texture_pair(file_name):
+    """arcade.load_texture_pair, reading the image from the pack if it has it."""
+    load_image(file_name)
+    return arcade.load_texture_pair(file_name)
+
+
+def load_map(map_name):
+    """The parsed Tiled map."""
+    name = asset_name(map_name) + PARSED_MAP
+    if in_pack(name):
+        return pickle.loads(assetpack.pack.slice(name))
+    return pytiled_parser.parse_map(Path(map_name))
+
+
+class PackedSound(arcade.Sound):
+    """An arcade Sound decoded from the asset pack."""
+
+    def __init__(self, file_name):
+        self.file_name = str(file_name)
+        self.source = pyglet.media.load(self.file_name, file=assetpack.pack.open(asset_name(file_name)), streaming=False)
+        # What arcade.Sound sets for panning
+        self.min_distance = 100000000
+
+
+def load_sound(file_name):
+    """arcade.load_sound, reading the sound from the pack if it has it."""
+    if in_pack(file_name):
+        return PackedSound(file_name)
+    return arcade.load_sound(file_name)
+
+
+def _image_source(get_image_source):
+    """arcade's lookup of a tile's image file, finding packed images first."""
+
+    def image_source(tile, map_directory):
+        image = tile.image or tile.tileset.image
+        if image is not None and in_pack(image):
+            load_image(image)
+            return image
+        return get_image_source(tile, map_directory)
+
+    image_source.loose = get_image_source
+    return image_source
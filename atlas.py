@@ -0,0 +1,169 @@
+"""
+Keeping the texture atlas from growing during play.
+
+arcade keeps every texture the sprite lists and tile meshes draw in one
+atlas texture on the GPU, and adds a texture the first time something
+draws it. A new texture is uploaded in the middle of the frame showing it,
+like the attack frames the first time a character attacks. When the atlas
+is full, arcade doubles its size and copies everything over first (a
+resize). A rebuild does the same without growing.
+
+AtlasWatch prepares the atlas for a level while its chapter screen is up.
+texture_manifest() lists every texture the level can show, and
+tilemesh.TileSource the textures its tile meshes draw. preload() gives the
+atlas room for all of them in one resize, and uploads them, before the
+level's LevelRenderer is built. The World adds the textures of the players
+and of the Level's sprites itself as it creates them, so the atlas can have
+grown before that too. The watch also counts resizes, rebuilds and uploads, and
+logs those that still happen during play as hitches. release() takes the
+textures of levels that were unloaded back out.
+"""
+import time
+from contextlib import contextmanager
+
+import arcade
+from arcade.texture_atlas import TextureAtlas
+
+from enemies import sprout_textures
+
+# Atlas methods whose calls are counted
+EVENTS = ("resize", "rebuild", "upload")
+
+# The arcade versions whose TextureAtlas internals AtlasContents knows
+ATLAS_INTERNALS = ("2.6.",)
+
+
+def texture_manifest(world):
+    """The textures of the World's level, both characters' frames, the enemies' and the projectiles'."""
+    textures = {}
+    for player in (world.player_sprite_1, world.player_sprite_2):
+        for frames in player.animations.frames + player.animations.mirrored:
+            textures.update((texture.name, texture) for texture in frames)
+    if len(world.level.enemies):
+        textures.update((texture.name, texture) for texture in sprout_textures())
+    textures.update((texture.name, texture) for texture in world.projectiles.textures)
+    textures.update((sprite.texture.name, sprite.texture) for sprite in world.level.sprites)
+    return list(textures.values())
+
+
+def _height(texture):
+    return texture.image.height
+
+
+class AtlasContents:
+    """
+    What a TextureAtlas holds, read from its private fields: arcade has no
+    public way to list its textures or to take many out at once. Only the
+    versions in ATLAS_INTERNALS are known to keep them that way.
+    """
+
+    def __init__(self, atlas):
+        if not arcade.version.VERSION.startswith(ATLAS_INTERNALS):
+            raise RuntimeError(f"the texture atlas internals of arcade {arcade.version.VERSION} are unknown,"
+                               f" atlas.py supports arcade {', '.join(ATLAS_INTERNALS)}x")
+        self.atlas = atlas
+
+    def textures(self):
+        """The textures in the atlas, in the order they were added."""
+        return list(self.atlas._textures)
+
+    def remove(self, names):
+        """
+        Take the textures with these names out of the atlas, going through its
+        textures once: TextureAtlas.remove searches them for each texture.
+        Their room is only reclaimed by a rebuild.
+        """
+        atlas = self.atlas
+        dropped = [texture for texture in atlas._textures if texture.name in names]
+        atlas._textures = [texture for texture in atlas._textures if texture.name not in names]
+        for texture in dropped:
+            del atlas._atlas_regions[texture.name]
+            atlas._uv_slots_free.appendleft(atlas._uv_slots.pop(texture.name))
+        return dropped
+
+
+class AtlasWatch:
+    """Counts what happens to a texture atlas, and fills it ahead of play."""
+
+    def __init__(self, atlas, loading=None, log=print):
+        self.atlas = atlas
+        self.contents = AtlasContents(atlas)
+        self.log = log
+        # Tells if the game is loading outside of a loading() block, like while a chapter screen is up
+        self.loading_now = loading or (lambda: False)
+        # Events while loading and during play, by name
+        self.loading_counts = dict.fromkeys(EVENTS, 0)
+        self.play_counts = dict.fromkeys(EVENTS, 0)
+        # (event, seconds, atlas size) of every event during play
+        self.hitches = []
+        self.is_loading = False
+        # The atlas calls these on itself, so counting versions on the instance see every call
+        atlas.resize = self._counted("resize", atlas.resize)
+        atlas.rebuild = self._counted("rebuild", atlas.rebuild)
+        atlas.write_texture = self._counted("upload", atlas.write_texture)
+
+    def _counted(self, event, method):
+        def counted(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            if self.is_loading or self.loading_now():
+                self.loading_counts[event] += 1
+            else:
+                elapsed = time.perf_counter() - start
+                self.play_counts[event] += 1
+                self.hitches.append((event, elapsed, self.atlas.size))
+                self.log(f"hitch: atlas {event} during play took {elapsed * 1e3:.1f} ms, atlas {self.atlas.width}x{self.atlas.height}")
+            return result
+
+        return counted
+
+    @contextmanager
+    def loading(self):
+        """Events inside this block happen while loading, they are not hitches."""
+        was_loading = self.is_loading
+        self.is_loading = True
+        try:
+            yield self
+        finally:
+            self.is_loading = was_loading
+
+    def preload(self, textures):
+        """
+        Resize the atlas once to fit the textures it doesn't have yet, laid
+        out like a resize lays them out, to the next power of two like its
+        own resizes, and upload them. Returns how many textures were added.
+        """
+        atlas = self.atlas
+        new = sorted((texture for texture in textures if not atlas.has_texture(texture)), key=_height)
+        if not new:
+            return 0
+        needed = max(TextureAtlas.calculate_minimum_size(sorted(self.contents.textures(), key=_height) + new))
+        # Doubling like arcade does leaves room for the next level's tiles
+        size = atlas.width
+        while size < needed:
+            size *= 2
+        with self.loading():
+            if size > atlas.width:
+                atlas.resize((size, size))
+            for texture in new:
+                atlas.add(texture)
+        return len(new)
+
+    def release(self, keep):
+        """
+        Take every texture but those in `keep` out of the atlas, and pack the
+        rest again to reclaim their room. Their atlas slots don't change.
+        Returns how many textures were taken out.
+        """
+        keep = {texture.name for texture in keep}
+        dropped = self.contents.remove({texture.name for texture in self.contents.textures()} - keep)
+        if dropped:
+            with self.loading():
+                self.atlas.rebuild()
+        return len(dropped)
+
+    def report(self):
+        """The atlas's size and how many of each event happened while loading and during play."""
+        loading = ", ".join(f"{count} {event}s" for event, count in self.loading_counts.items())
+        play = ", ".join(f"{count} {event}s" for event, count in self.play_counts.items())
+        return f"atlas {self.atlas.width}x{self.atlas.height}: loading {loading}; during play {play}"
@@ -0,0 +1,218 @@
+"""
+Benchmarks for the game logic. They run headless, without opening a window.
+
+    python bench.py snapshot [--ticks N] [--ring N]
+    python bench.py enemies [--count N] [--ticks N]
+    python bench.py load [--starts N] [--pack FILE]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import arcade
+
+import attr
+from pytiled_parser import ObjectLayer, OrderedPair
+from pytiled_parser.tiled_object import Point
+
+import assets
+import hitboxes
+import player
+from constants import BUTTON_ATTACK, BUTTON_JUMP, BUTTON_LEFT, BUTTON_RIGHT, SPRITE_PIXEL_SIZE
+from enemies import ENEMY_LAYER, SPROUT_BOX
+from snapshot import SnapshotRing
+from world import World
+
+# Time one frame may take at 60 frames per second
+FRAME_BUDGET = 1 / 60
+
+
+def scripted_buttons(ticks, seed=1):
+    """Return a reproducible list of (buttons_1, buttons_2) that mostly walks right, and attacks now and then."""
+    rnd = random.Random(seed)
+    inputs = []
+    buttons = [BUTTON_RIGHT, BUTTON_RIGHT]
+    for _ in range(ticks):
+        for player in (0, 1):
+            if rnd.random() < 0.05:
+                buttons[player] = rnd.choice((BUTTON_RIGHT, BUTTON_RIGHT, BUTTON_LEFT, 0))
+            if rnd.random() < 0.03:
+                buttons[player] ^= BUTTON_JUMP
+            if rnd.random() < 0.02:
+                buttons[player] ^= BUTTON_ATTACK
+        inputs.append(tuple(buttons))
+    return inputs
+
+
+def new_world(level=1, tiled_maps=None):
+    world = World(tiled_maps)
+    world.setup()
+    if level != world.current_level:
+        world.current_level = level
+        world.setup_level(level)
+    world.between_levels = False
+    return world
+
+
+def world_state(world):
+    """A comparable summary of the world, to check restored states."""
+    players = [
+        (p.center_x, p.center_y, p.change_x, p.change_y, p.state, p.current_frame, p.texture_change_tick)
+        for p in (world.player_sprite_1, world.player_sprite_2)
+    ]
+    layers = {name: len(world.scene[name]) for name in world.level.layer_names}
+    level = world.level
+    return (world.tick, world.score, players, layers, bytes(level.membership), bytes(level.alpha), bytes(level.visible),
+            level.enemies.state_bytes(), world.projectiles.state_bytes())
+
+
+def bench_snapshot(args):
+    for level in (1, 2):
+        world = new_world(level)
+        ring = SnapshotRing(args.ring)
+        inputs = scripted_buttons(args.ticks)
+
+        # Capture every tick, like rollback netcode does
+        capture_time = 0.0
+        for buttons in inputs:
+            world.update(*buttons)
+            start = time.perf_counter()
+            ring.capture(world)
+            capture_time += time.perf_counter() - start
+        expected = world_state(world)
+
+        # Roll back to random ticks still in the ring
+        restore_times = []
+        rnd = random.Random(2)
+        for _ in range(args.restores):
+            tick = world.tick - rnd.randrange(args.ring)
+            start = time.perf_counter()
+            ring.restore(world, tick)
+            restore_times.append(time.perf_counter() - start)
+            ring.restore(world, expected[0])
+            assert world_state(world) == expected, "restoring the latest snapshot did not give back the same state"
+
+        # Re-simulating from an old snapshot has to end in the same state
+        oldest = world.tick - args.ring + 1
+        ring.restore(world, oldest)
+        for buttons in inputs[oldest:]:
+            world.update(*buttons)
+        assert world_state(world) == expected, "re-simulation after a rollback diverged"
+
+        restore_times.sort()
+        print(f"level {level}: {len(world.level.sprites)} tile sprites, {args.ticks} ticks, score {world.score}")
+        print(f"  capture  mean {capture_time / args.ticks * 1e6:8.1f} us")
+        print(f"  restore  mean {sum(restore_times) / len(restore_times) * 1e6:8.1f} us"
+              f"  p99 {restore_times[int(len(restore_times) * 0.99)] * 1e6:8.1f} us"
+              f"  max {restore_times[-1] * 1e6:8.1f} us")
+
+
+def sprout_map(level, count, seed=3):
+    """The level's map with `count` Sprouts standing on random wall tiles that have room above them."""
+    world = new_world(level)
+    walls = world.level.cell_grid(world.wall_layers())
+    rows, cols = walls.shape
+    free = 1 + (SPROUT_BOX[3] - SPROUT_BOX[2]) // world.level.cell_size
+    spots = [
+        (col - 1, row - 1) for row in range(1, rows - 1 - free) for col in range(1, cols - 1)
+        if walls[row, col] and not walls[row + 1:row + 1 + free, col].any()
+    ]
+
+    tiled_map = world.level.tiled_map
+    map_height = tiled_map.map_size.height * tiled_map.tile_size.height
+    rnd = random.Random(seed)
+    sprouts = []
+    for object_id in range(count):
+        col, row = rnd.choice(spots)
+        # In Tiled pixels, from the top of the map, standing on the tile
+        x = (col + rnd.random()) * SPRITE_PIXEL_SIZE
+        sprouts.append(Point(id=object_id + 1, coordinates=OrderedPair(x, map_height - (row + 1) * SPRITE_PIXEL_SIZE), class_="Sprout"))
+    layers = [layer for layer in tiled_map.layers if layer.name != ENEMY_LAYER]
+    return attr.evolve(tiled_map, layers=layers + [ObjectLayer(name=ENEMY_LAYER, tiled_objects=sprouts)])
+
+
+def bench_enemies(args):
+    level = 2
+    inputs = scripted_buttons(args.ticks)
+    for count in (0, args.count):
+        start = time.perf_counter()
+        world = new_world(level, {level: sprout_map(level, count)})
+        enemies = world.level.enemies
+        print(f"level {level} with {len(enemies)} Sprouts built in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        tick_times = []
+        sync_times = []
+        for buttons in inputs:
+            start = time.perf_counter()
+            world.update(*buttons)
+            tick_times.append(time.perf_counter() - start)
+            # What drawing a frame costs on the CPU besides the draw calls: syncing the sprites
+            start = time.perf_counter()
+            enemies.sync()
+            sync_times.append(time.perf_counter() - start)
+
+        print(f"  {args.ticks} ticks, {int((enemies.change_x != 0).sum())} Sprouts walking at the end")
+        for name, times in (("tick", tick_times), ("sprite sync", sync_times)):
+            times = sorted(times)
+            print(f"  {name:11s} mean {sum(times) / len(times) * 1e3:6.3f} ms  p99 {times[int(len(times) * 0.99)] * 1e3:6.3f} ms")
+        frame = (sum(tick_times) + sum(sync_times)) / len(inputs)
+        print(f"  tick + sync mean {frame * 1e3:6.3f} ms, {frame / FRAME_BUDGET:.0%} of a 60 fps frame")
+
+
+def bench_load(args):
+    if args.pack:
+        assets.open_pack(args.pack)
+    # Files opened while loading, counted by an audit hook
+    opened = []
+    sys.addaudithook(lambda event, event_args: event == "open" and opened.append(event_args[0]))
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache_file = os.path.join(directory, "hitboxes.json")
+        for start in range(args.starts):
+            # Forget what a previous start loaded, like a new process would
+            arcade.cleanup_texture_cache()
+            player._animations.clear()
+            cache = hitboxes.install(cache_file)
+
+            opened.clear()
+            started = time.perf_counter()
+            world = new_world(1)
+            world.load_level(world.rules["next"])
+            elapsed = time.perf_counter() - started
+            files = len({name for name in opened if name != cache_file})
+            hit_box_time = cache.compute_time + cache.lookup_time
+            print(f"{'cold' if start == 0 else 'warm'} start: players and both levels loaded in {elapsed * 1e3:4.0f} ms,"
+                  f" {hit_box_time * 1e3:4.0f} ms of it on hit boxes, {files} files opened")
+            print(f"  {cache.report()}")
+        print(f"cache file: {os.path.getsize(cache_file)} bytes, {len(cache.points)} hit boxes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    snapshot = subparsers.add_parser("snapshot", help="capture and restore World snapshots")
+    snapshot.add_argument("--ticks", type=int, default=1200)
+    snapshot.add_argument("--ring", type=int, default=120)
+    snapshot.add_argument("--restores", type=int, default=500)
+    snapshot.set_defaults(run=bench_snapshot)
+
+    enemies = subparsers.add_parser("enemies", help="a level full of Sprouts")
+    enemies.add_argument("--count", type=int, default=500)
+    enemies.add_argument("--ticks", type=int, default=1200)
+    enemies.set_defaults(run=bench_enemies)
+
+    load = subparsers.add_parser("load", help="loading the players and levels with a cold and a warm hit box cache")
+    load.add_argument("--starts", type=int, default=3)
+    load.add_argument("--pack", help="load from this asset pack instead of the loose files")
+    load.set_defaults(run=bench_load)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
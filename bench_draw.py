@@ -0,0 +1,410 @@
+"""
+Benchmarks for drawing. They open a hidden window with headless OpenGL
+(EGL), so they also run on a machine without a display, where the drawing
+is done by a software renderer like llvmpipe.
+
+    python bench_draw.py native [--frames N]
+    python bench_draw.py cull [--frames N] [--copies N]
+    python bench_draw.py split [--frames N]
+    python bench_draw.py zoom [--frames N] [--max-zoom Z]
+    python bench_draw.py atlas [--frames N]
+    python bench_draw.py soak [--switches N] [--ticks N] [--rss-slack MB]
+    python bench_draw.py enemies [--count N] [--frames N]
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+
+import attr
+import pyglet
+from pytiled_parser import LayerGroup, Size, TileLayer
+
+# Has to be set before arcade opens its window
+pyglet.options["headless"] = True
+
+import arcade  # noqa: E402
+
+from atlas import AtlasWatch, texture_manifest  # noqa: E402
+from bench import FRAME_BUDGET, new_world, scripted_buttons, sprout_map  # noqa: E402
+from camera import MAX_ZOOM, FollowCamera  # noqa: E402
+from constants import SCREEN_HEIGHT, SCREEN_WIDTH  # noqa: E402
+from native import NativeTarget  # noqa: E402
+from tilemesh import LevelRenderer, TileSource  # noqa: E402
+
+
+def open_window():
+    window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, visible=False)
+    print(f"OpenGL renderer: {window.ctx.info.RENDERER}")
+    return window
+
+
+def time_frames(window, world, draw, frames):
+    """Play the world and draw `frames` frames with draw(), waiting for the GPU each time."""
+    times = []
+    for buttons in scripted_buttons(frames):
+        world.update(*buttons)
+        start = time.perf_counter()
+        window.clear()
+        draw()
+        window.ctx.finish()
+        times.append(time.perf_counter() - start)
+    return sorted(times)
+
+
+def wide_map(level, copies):
+    """The level's map with its tiles repeated `copies` times to the right."""
+    tiled_map = new_world(level).level.tiled_map
+
+    def widen(layers):
+        for layer in layers:
+            if isinstance(layer, TileLayer):
+                yield attr.evolve(layer, data=[row * copies for row in layer.data], size=Size(layer.size.width * copies, layer.size.height))
+            elif isinstance(layer, LayerGroup):
+                yield attr.evolve(layer, layers=list(widen(layer.layers)))
+            else:
+                yield layer
+
+    size = tiled_map.map_size
+    return attr.evolve(tiled_map, layers=list(widen(tiled_map.layers)), map_size=Size(size.width * copies, size.height))
+
+
+def bench_cull(args):
+    window = open_window()
+    camera = arcade.Camera(window.width, window.height)
+    maps = [(f"level {level}", level, None) for level in (1, 2)]
+    maps.append((f"level 2 x{args.copies}", 2, {2: wide_map(2, args.copies)}))
+
+    for name, level, tiled_maps in maps:
+        for culled in (False, True):
+            world = new_world(level, tiled_maps)
+            renderer = LevelRenderer(world.level, world.rules)
+            counts = []
+
+            def draw():
+                camera.move_to((world.camera_x, 0))
+                camera.use()
+                view = (world.camera_x, 0, window.width, window.height) if culled else None
+                renderer.draw(world.scene, now=world.tick / 60, view=view)
+                counts.append((renderer.drawn, renderer.culled))
+
+            time_frames(window, world, draw, 10)
+            counts.clear()
+            times = time_frames(window, world, draw, args.frames)
+            drawn = sum(count for count, _ in counts) / len(counts)
+            left_out = sum(count for _, count in counts) / len(counts)
+            print(f"{name:12s} {'culled' if culled else 'all':6s} mean {sum(times) / len(times) * 1e3:7.3f} ms"
+                  f"  p99 {times[int(len(times) * 0.99)] * 1e3:7.3f} ms  {drawn:6.0f} tiles drawn, {left_out:6.0f} culled")
+
+
+def frame_views(window, world, max_zoom=1):
+    """
+    The views of a frame like MyGame has them, as (left edge on the window, camera):
+    one camera framing both players, or one per player on a split screen.
+    """
+    players = sorted((world.player_sprite_1, world.player_sprite_2), key=lambda player: player.center_x)
+    if world.split:
+        half = window.width // 2
+        cameras = [(0, FollowCamera(half, window.height, 1), players[:1]),
+                   (half, FollowCamera(window.width - half, window.height, 1), players[1:])]
+    else:
+        cameras = [(0, FollowCamera(window.width, window.height, max_zoom), players)]
+    for _, camera, followed in cameras:
+        camera.jump([(player.center_x, player.center_y) for player in followed], world.end_of_map, world.top_of_map)
+    return [(x, camera) for x, camera, _ in cameras]
+
+
+def draw_views(window, world, renderer, views, frame, lod=True):
+    """Draw a frame of the world the way MyGame.on_draw does."""
+    renderer.update(now=frame / 60)
+    for x, camera in views:
+        window.ctx.viewport = (x, 0, camera.width, camera.height)
+        window.ctx.projection_2d_matrix = camera.matrix
+        renderer.draw_view(world.scene, view=camera.view, zoom=camera.zoom if lod else 1.0)
+
+
+def time_views(window, world, renderer, views, frames, lod=True):
+    """Draw `frames` frames of a still world, after some warm up frames."""
+    times = []
+    for frame in range(frames + 10):
+        start = time.perf_counter()
+        window.clear()
+        draw_views(window, world, renderer, views, frame, lod)
+        window.ctx.finish()
+        times.append(time.perf_counter() - start)
+    return sorted(times[10:])
+
+
+def bench_split(args):
+    window = open_window()
+    for level in (1, 2):
+        world = new_world(level)
+        world.split_screen = True
+        renderer = LevelRenderer(world.level, world.rules)
+        results = {}
+        for mode in ("single", "split"):
+            if mode == "split":
+                # Player 2 at the other end of the map
+                world.player_sprite_2.center_x = world.end_of_map - 200
+                world.center_camera_to_player()
+            views = frame_views(window, world)
+            results[mode] = times = time_views(window, world, renderer, views, args.frames)
+            print(f"level {level} {mode:6s} {len(views)} view(s)  mean {sum(times) / len(times) * 1e3:7.3f} ms"
+                  f"  p99 {times[int(len(times) * 0.99)] * 1e3:7.3f} ms  {renderer.drawn} tiles drawn")
+        print(f"  split screen frames take {sum(results['split']) / sum(results['single']):.2f}x as long")
+
+
+def bench_zoom(args):
+    window = open_window()
+    for level in (1, 2):
+        world = new_world(level)
+        renderer = LevelRenderer(world.level, world.rules)
+        print(f"level {level}: {len(renderer.lods)} decoration layers have a texture for zooming out")
+        for mode in ("zoom 1", "zoomed out", "no LOD"):
+            if mode == "zoomed out":
+                # Far enough apart for the camera to zoom out all the way
+                world.player_sprite_2.center_x = world.player_sprite_1.center_x + window.width * args.max_zoom
+            views = frame_views(window, world, args.max_zoom)
+            times = time_views(window, world, renderer, views, args.frames, lod=mode != "no LOD")
+            print(f"  {mode:10s} x{views[0][1].zoom:.2f}  mean {sum(times) / len(times) * 1e3:7.3f} ms"
+                  f"  p99 {times[int(len(times) * 0.99)] * 1e3:7.3f} ms  {renderer.drawn} tiles drawn")
+
+    # A camera following still players recomputes its projection only until it settles
+    camera = FollowCamera(window.width, window.height, args.max_zoom)
+    points = [(300, 200), (300 + window.width, 200)]
+    camera.jump(points[:1], 4000, 768)
+    for frame in range(2):
+        updates = camera.projection_updates
+        for _ in range(args.frames):
+            camera.update(points, 4000, 768, 1 / 60)
+        print(f"camera: {camera.projection_updates - updates} projection updates in {args.frames} frames"
+              f" {'still' if frame else 'zooming out'}, at x{camera.zoom:.2f}")
+
+
+def bench_native(args):
+    window = open_window()
+    camera = arcade.Camera(window.width, window.height)
+    target = NativeTarget(window.ctx, window.width, window.height)
+    print(f"native framebuffer {target.framebuffer.size[0]}x{target.framebuffer.size[1]} for a {window.width}x{window.height} window")
+
+    for level in (1, 2):
+        results = {}
+        for mode in ("full", "native"):
+            world = new_world(level)
+            renderer = LevelRenderer(world.level, world.rules)
+
+            def draw():
+                world.projectiles.sync()
+                if mode == "full":
+                    camera.move_to((world.camera_x, 0))
+                    camera.use()
+                    renderer.draw(world.scene, now=world.tick / 60, view=(world.camera_x, 0, window.width, window.height))
+                else:
+                    with target.activate():
+                        renderer.draw(world.scene, now=world.tick / 60, view=target.use_view(world.camera_x))
+                    target.draw()
+
+            # Warm up: the first frames compile shaders and fill the atlas
+            time_frames(window, world, draw, 10)
+            results[mode] = times = time_frames(window, world, draw, args.frames)
+            mean = sum(times) / len(times)
+            print(f"level {level} {mode:6s} mean {mean * 1e3:7.3f} ms  p99 {times[int(len(times) * 0.99)] * 1e3:7.3f} ms"
+                  f"  {mean / FRAME_BUDGET:5.0%} of a 60 fps frame")
+        full, native = (sum(results[mode]) for mode in ("full", "native"))
+        print(f"  native resolution is {full / native:.1f}x faster")
+
+
+def bench_atlas(args):
+    window = open_window()
+    for mode in ("lazy", "preload"):
+        # A new atlas, empty like the one of a game just started
+        window.ctx._atlas = None
+        hitches = []
+        watch = AtlasWatch(window.ctx.default_atlas, log=hitches.append)
+        print(f"{mode}: atlas starts at {watch.atlas.width}x{watch.atlas.height}")
+        world = None
+        for level in (1, 2):
+            # Loading the level and its tile meshes, like MyGame does under its chapter screen
+            with watch.loading():
+                if world is None:
+                    world = new_world(level)
+                else:
+                    world.current_level = level
+                    world.setup_level(level)
+                    world.between_levels = False
+                if mode == "preload":
+                    watch.preload(texture_manifest(world) + TileSource(world.level.tiled_map).textures())
+                renderer = LevelRenderer(world.level, world.rules)
+            before = len(watch.hitches)
+
+            def draw():
+                world.projectiles.sync()
+                draw_views(window, world, renderer, frame_views(window, world), world.tick)
+
+            times = time_frames(window, world, draw, args.frames)
+            stalls = watch.hitches[before:]
+            print(f"  level {level}: worst frame {times[-1] * 1e3:6.2f} ms, {len(stalls)} atlas events during play"
+                  f" taking {sum(elapsed for _, elapsed, _ in stalls) * 1e3:.1f} ms")
+        for line in hitches[:5]:
+            print(f"    {line}")
+        if len(hitches) > 5:
+            print(f"    ... and {len(hitches) - 5} more")
+        print(f"  {watch.report()}")
+
+
+def bench_enemies(args):
+    window = open_window()
+    level = 2
+    results = {}
+    for count in (0, args.count):
+        world = new_world(level, {level: sprout_map(level, count)})
+        renderer = LevelRenderer(world.level, world.rules)
+        print(f"level {level} with {len(world.level.enemies)} Sprouts")
+
+        # A whole frame of the game: the tick, then the draw, waiting for the GPU
+        tick_times = []
+        draw_times = []
+        for frame, buttons in enumerate(scripted_buttons(args.frames + 10)):
+            start = time.perf_counter()
+            world.update(*buttons)
+            tick_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            window.clear()
+            world.projectiles.sync()
+            views = frame_views(window, world)
+            draw_views(window, world, renderer, views, frame)
+            window.ctx.finish()
+            draw_times.append(time.perf_counter() - start)
+        # The first frames fill the atlas and compile the shaders
+        tick_times, draw_times = tick_times[10:], draw_times[10:]
+        frame_times = sorted(tick + draw for tick, draw in zip(tick_times, draw_times))
+        for name, times in (("tick", tick_times), ("draw", draw_times), ("frame", frame_times)):
+            times = sorted(times)
+            print(f"  {name:5s} mean {sum(times) / len(times) * 1e3:7.3f} ms  p99 {times[int(len(times) * 0.99)] * 1e3:7.3f} ms")
+        results[count] = mean = sum(frame_times) / len(frame_times)
+        _, camera = views[0]
+        left, bottom, width, height = camera.view
+        shown = sum(1 for sprite in world.level.enemies.sprite_list
+                    if sprite.right > left and sprite.left < left + width and sprite.top > bottom and sprite.bottom < bottom + height)
+        print(f"  frame mean is {mean / FRAME_BUDGET:.0%} of a 60 fps frame, {shown} Sprouts in view at the end")
+    extra = results[args.count] - results[0]
+    print(f"{args.count} Sprouts add {extra * 1e3:.3f} ms to a frame, {extra / FRAME_BUDGET:.0%} of a 60 fps frame")
+
+
+def rss():
+    """Resident memory of this process in bytes, from Linux's /proc."""
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def bench_soak(args):
+    window = open_window()
+    failures = []
+    for mode in ("cached", "unload"):
+        # "cached" switches levels like the game, "unload" tears the last level down and builds the next one again
+        window.ctx._atlas = None
+        watch = AtlasWatch(window.ctx.default_atlas, log=lambda line: None)
+        with watch.loading():
+            world = new_world(1)
+        renderers = {}
+        baseline = None
+        switch_time = 0.0
+        for switch in range(1, args.switches + 1):
+            previous = world.level
+            start = time.perf_counter()
+            with watch.loading():
+                world.current_level = 2 if world.current_level == 1 else 1
+                world.setup_level(world.current_level)
+                if mode == "unload":
+                    world.unload_level(previous.number)
+                    renderers.pop(previous, None)
+                manifest = texture_manifest(world)
+                if world.level not in renderers:
+                    tiles = TileSource(world.level.tiled_map).textures()
+                    if mode == "unload":
+                        watch.release(manifest + tiles)
+                    watch.preload(manifest + tiles)
+                    renderers[world.level] = LevelRenderer(world.level, world.rules)
+                renderer = renderers[world.level]
+                watch.preload(manifest)
+            world.between_levels = False
+            switch_time += time.perf_counter() - start
+
+            # Play a little of the level and draw it
+            for buttons in scripted_buttons(args.ticks, seed=switch):
+                world.update(*buttons)
+            window.clear()
+            world.projectiles.sync()
+            draw_views(window, world, renderer, frame_views(window, world), world.tick)
+            window.ctx.finish()
+            # Deletes the OpenGL objects nothing refers to anymore, the game's window does it every frame as it flips
+            window.ctx.gc()
+
+            if switch == args.warmup or switch % 100 == 0 or switch == args.switches:
+                gc.collect()
+                usage = (rss(), watch.atlas.size, len(watch.contents.textures()))
+                if switch == args.warmup:
+                    baseline = usage
+                print(f"{mode} switch {switch:4d}: rss {usage[0] / 2 ** 20:6.1f} MB, atlas {usage[1][0]}x{usage[1][1]}"
+                      f" with {usage[2]} textures, {switch_time / switch * 1e3:.0f} ms per switch")
+
+        if baseline is None:
+            continue
+        growth = (usage[0] - baseline[0]) / 2 ** 20
+        if growth > args.rss_slack:
+            failures.append(f"{mode}: rss grew by {growth:.1f} MB after switch {args.warmup}")
+        if usage[1:] != baseline[1:]:
+            failures.append(f"{mode}: atlas went from {baseline[1]} with {baseline[2]} textures to {usage[1]} with {usage[2]}")
+        print(f"  {watch.report()}")
+        world.unload()
+
+    if failures:
+        sys.exit("\n".join(failures))
+    print("memory and atlas stayed flat")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    native = subparsers.add_parser("native", help="drawing at window resolution against drawing at art resolution")
+    native.add_argument("--frames", type=int, default=300)
+    native.set_defaults(run=bench_native)
+
+    cull = subparsers.add_parser("cull", help="drawing every tile against drawing the chunks in view")
+    cull.add_argument("--frames", type=int, default=300)
+    cull.add_argument("--copies", type=int, default=8, help="how many times wider the custom level is")
+    cull.set_defaults(run=bench_cull)
+
+    split = subparsers.add_parser("split", help="one view against a split screen")
+    split.add_argument("--frames", type=int, default=300)
+    split.set_defaults(run=bench_split)
+
+    zoom = subparsers.add_parser("zoom", help="zoomed out views, with and without the decoration layers' textures")
+    zoom.add_argument("--frames", type=int, default=300)
+    zoom.add_argument("--max-zoom", type=float, default=MAX_ZOOM)
+    zoom.set_defaults(run=bench_zoom)
+
+    atlas = subparsers.add_parser("atlas", help="filling the texture atlas while playing against filling it while loading")
+    atlas.add_argument("--frames", type=int, default=600)
+    atlas.set_defaults(run=bench_atlas)
+
+    enemies = subparsers.add_parser("enemies", help="whole frames, ticks and drawing, without and with many Sprouts")
+    enemies.add_argument("--count", type=int, default=500)
+    enemies.add_argument("--frames", type=int, default=300)
+    enemies.set_defaults(run=bench_enemies)
+
+    soak = subparsers.add_parser("soak", help="switching levels over and over, checking memory and the atlas stay flat")
+    soak.add_argument("--switches", type=int, default=500)
+    soak.add_argument("--ticks", type=int, default=30, help="ticks played after every switch")
+    soak.add_argument("--warmup", type=int, default=20, help="switches before the usage is measured")
+    soak.add_argument("--rss-slack", type=float, default=16, help="MB the memory may grow by")
+    soak.set_defaults(run=bench_soak)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Build the packed maps and the asset pack.
+
+The maps use tiles from more than thirty tilesets, and loading a level
+decodes the whole image of every tileset it uses a tile of, even the big
+background sheets it takes a few tiles from. A packed map has a single
+tileset instead: an atlas of only the tile images the map uses, with
+pixel-identical tiles stored once, and its layers' tile ids remapped to it
+(keeping the flip bits). Tiles animated by the manifest's frame sequences
+(rules.TILE_ANIMATIONS) get a Tiled animation over their packed frames.
+
+The packed maps and atlases go to maps/packed/ with an index of the files
+each was built from. rules.py loads a packed map instead of its source map
+as long as it is newer than all of them, so an edited map or tileset is
+used as is until the next build.
+
+Then it writes the asset pack (see assetpack.py): the maps just packed and
+their atlases, the enemies' sheets, every character frame and every sound
+in a single file the game memory-maps. The game loads it when it is there,
+so run this again after changing any of them, or play with --loose.
+
+    python build_assets.py [--pack FILE]
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+from pathlib import Path
+
+import pytiled_parser
+from PIL import Image
+
+from assetpack import ASSET_PACK, write_pack
+from assets import PARSED_MAP
+from enemies import SPROUT_STATES
+from rules import LEVEL_RULES, MANIFEST, PACKED_DIRECTORY, PACKED_INDEX, TILE_ANIMATIONS
+
+# Tiled keeps the flips of a tile in the top bits of its id
+FLIP_BITS = 0xF0000000
+
+
+class Packer:
+    """The unique tile images of one map, and the packed tile id of every tile id it uses."""
+
+    def __init__(self, tiled_map):
+        self.tiled_map = tiled_map
+        self.tile_size = (tiled_map.tile_size.width, tiled_map.tile_size.height)
+        # Source images by path, they are only opened once
+        self.images = {}
+        # Packed tile ids by image bytes, the images in packed id order, and the animations by packed id
+        self.unique = {}
+        self.packed_images = []
+        self.animations = {}
+        self.animated = {}
+        self.gids = {}
+
+    def gid(self, gid):
+        """The packed tile id for a tile id of the source map, flip bits included."""
+        if not gid:
+            return 0
+        flips = gid & FLIP_BITS
+        tile_gid = gid & ~FLIP_BITS
+        packed = self.gids.get(tile_gid)
+        if packed is None:
+            packed = self.gids[tile_gid] = self._pack(tile_gid)
+        return packed | flips
+
+    def _pack(self, tile_gid):
+        first_gid = max(first for first in self.tiled_map.tilesets if first <= tile_gid)
+        tileset = self.tiled_map.tilesets[first_gid]
+        tile_id = tile_gid - first_gid
+        if tileset.image is None or (tileset.tile_width, tileset.tile_height) != self.tile_size:
+            raise ValueError(f"tile {tile_gid} of {tileset.name}: only tiles of the map's size from tileset images are packed")
+
+        frames = self._frames(tileset, tile_id)
+        if frames is None:
+            return self._image_id(self._crop(tileset, tileset.image, tile_id))
+
+        # Animated tiles get their own id, even when they start like a still tile
+        frames = tuple((self._image_id(image), duration) for image, duration in frames)
+        packed = self.animated.get(frames)
+        if packed is None:
+            packed = self.animated[frames] = len(self.packed_images) + 1
+            self.packed_images.append(self.packed_images[frames[0][0] - 1])
+            self.animations[packed] = frames
+        return packed
+
+    def _frames(self, tileset, tile_id):
+        """(image, milliseconds) of every frame of an animated tile, None if it is not animated."""
+        tile = (tileset.tiles or {}).get(tile_id)
+        if tile is not None and tile.animation:
+            return [(self._crop(tileset, tileset.image, frame.tile_id), frame.duration) for frame in tile.animation]
+        image = tileset.image.resolve()
+        for images, duration in TILE_ANIMATIONS:
+            if image in images:
+                # The same part of every frame image, starting at the tileset's own image, like tilemesh.py plays them
+                start = images.index(image)
+                return [(self._crop(tileset, frame, tile_id), duration) for frame in images[start:] + images[:start]]
+        return None
+
+    def _crop(self, tileset, path, tile_id):
+        """A tile's image, cut out of its tileset's image the way arcade does."""
+        image = self.images.get(path)
+        if image is None:
+            image = self.images[path] = Image.open(path).convert("RGBA")
+        margin = tileset.margin or 0
+        spacing = tileset.spacing or 0
+        x = margin + tile_id % tileset.columns * (tileset.tile_width + spacing)
+        y = margin + tile_id // tileset.columns * (tileset.tile_height + spacing)
+        return image.crop((x, y, x + tileset.tile_width, y + tileset.tile_height))
+
+    def _image_id(self, image):
+        key = image.tobytes()
+        packed = self.unique.get(key)
+        if packed is None:
+            self.packed_images.append(image)
+            packed = self.unique[key] = len(self.packed_images)
+        return packed
+
+    def atlas(self):
+        """The packed images in a square-ish grid, and its number of columns."""
+        width, height = self.tile_size
+        columns = math.ceil(math.sqrt(len(self.packed_images))) or 1
+        rows = math.ceil(len(self.packed_images) / columns) or 1
+        atlas = Image.new("RGBA", (columns * width, rows * height))
+        for index, image in enumerate(self.packed_images):
+            atlas.paste(image, (index % columns * width, index // columns * height))
+        return atlas, columns
+
+
+def remap_layers(layers, packer):
+    """Replace the tile ids of raw Tiled JSON layers with packed ones."""
+    for layer in layers:
+        if layer["type"] == "tilelayer":
+            if "data" not in layer or not isinstance(layer["data"], list):
+                raise ValueError(f"layer {layer['name']!r}: only finite maps with uncompressed layer data are packed")
+            layer["data"] = [packer.gid(gid) for gid in layer["data"]]
+        elif layer["type"] == "group":
+            remap_layers(layer["layers"], packer)
+        elif layer["type"] == "objectgroup":
+            for tiled_object in layer["objects"]:
+                if "gid" in tiled_object:
+                    tiled_object["gid"] = packer.gid(tiled_object["gid"])
+
+
+def build(map_name):
+    """Pack one map. Returns its index entry and (source, packed) file bytes and decoded pixels."""
+    map_path = Path(map_name)
+    with open(map_path) as file:
+        raw_map = json.load(file)
+    tileset_files = [map_path.parent / tileset["source"] for tileset in raw_map["tilesets"] if "source" in tileset]
+    packer = Packer(pytiled_parser.parse_map(map_path))
+    remap_layers(raw_map["layers"], packer)
+    atlas, columns = packer.atlas()
+
+    directory = Path(PACKED_DIRECTORY)
+    directory.mkdir(parents=True, exist_ok=True)
+    packed_map = directory / map_path.name
+    packed_atlas = packed_map.with_suffix(".png")
+    tile_width, tile_height = packer.tile_size
+    raw_map["tilesets"] = [{
+        "firstgid": 1, "name": packed_map.stem, "image": packed_atlas.name,
+        "imagewidth": atlas.width, "imageheight": atlas.height, "columns": columns,
+        "tilecount": len(packer.packed_images), "tilewidth": tile_width, "tileheight": tile_height,
+        "margin": 0, "spacing": 0,
+        "tiles": [
+            {"id": packed - 1, "animation": [{"tileid": frame - 1, "duration": duration} for frame, duration in frames]}
+            for packed, frames in sorted(packer.animations.items())
+        ],
+    }]
+    atlas.save(packed_atlas, optimize=True)
+    with open(packed_map, "w") as file:
+        json.dump(raw_map, file, separators=(",", ":"))
+
+    # Everything loading the source map reads: the map, its tilesets and the images of the tiles it uses
+    sources = [map_path, *tileset_files, *packer.images]
+    source_bytes = sum(os.path.getsize(path) for path in sources)
+    source_pixels = sum(image.width * image.height * 4 for image in packer.images.values())
+    packed_bytes = os.path.getsize(packed_map) + os.path.getsize(packed_atlas)
+    print(f"{map_name}: {len(packer.gids)} tile ids, {len(packer.unique)} unique tile images, {len(packer.animations)} animated tiles"
+          f" -> {packed_map} with a {atlas.width}x{atlas.height} atlas")
+    print(f"  files read: {len(sources)} -> 2, bytes {source_bytes:,} -> {packed_bytes:,}, decoded image bytes {source_pixels:,}"
+          f" -> {atlas.width * atlas.height * 4:,}")
+    # The manifest too, for the animations
+    entry = {"map": packed_map.as_posix(), "files": [packed_map.as_posix(), packed_atlas.as_posix()],
+             "sources": [Path(os.path.relpath(path)).as_posix() for path in [*sources, MANIFEST]]}
+    return entry, (source_bytes, packed_bytes, source_pixels, atlas.width * atlas.height * 4)
+
+
+def relative(path, directory):
+    """A path of a file, relative to the current directory like the pack's file names."""
+    return Path(os.path.relpath(Path(directory, path)))
+
+
+def map_files(map_name):
+    """The files of a map in the pack: the map, the map parsed and its images, as (name, path or bytes)."""
+    tiled_map = pytiled_parser.parse_map(Path(map_name))
+    directory = Path(map_name).parent
+    images = set()
+    # Paths in the parsed map become the names of the images in the pack
+    tiled_map.map_file = relative(tiled_map.map_file, ".")
+    for tileset in tiled_map.tilesets.values():
+        if tileset.image is not None:
+            tileset.image = relative(tileset.image, directory)
+            images.add(tileset.image)
+            images.update(relative(frame, ".") for frames, _ in TILE_ANIMATIONS if tileset.image.resolve() in frames for frame in frames)
+        for tile in (tileset.tiles or {}).values():
+            if tile.image is not None:
+                tile.image = relative(tile.image, directory)
+                images.add(tile.image)
+    yield map_name, Path(map_name)
+    yield map_name + PARSED_MAP, pickle.dumps(tiled_map, protocol=pickle.HIGHEST_PROTOCOL)
+    for image in sorted(images):
+        yield image.as_posix(), image
+
+
+def build_pack(file_name, map_names):
+    """Write the asset pack, with the maps given, the enemies' sheets, every character frame and every sound."""
+    files = [file for map_name in map_names for file in map_files(map_name)]
+    files.extend((sheet, Path(sheet)) for sheet, _ in SPROUT_STATES)
+    for directory, pattern in (("characters", "*.png"), ("sounds", "*.wav")):
+        files.extend((path.as_posix(), path) for path in sorted(Path(directory).rglob(pattern)))
+
+    def contents():
+        for name, source in files:
+            yield name, source.read_bytes() if isinstance(source, Path) else source
+
+    index = write_pack(file_name, contents())
+    print(f"{file_name}: {len(index)} files, {os.path.getsize(file_name):,} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pack", default=ASSET_PACK, help="file to write the asset pack to")
+    args = parser.parse_args()
+
+    index = {}
+    totals = [0, 0, 0, 0]
+    for map_name in sorted({rules["source_map"] for rules in LEVEL_RULES.values()}):
+        index[map_name], sizes = build(map_name)
+        totals = [total + size for total, size in zip(totals, sizes)]
+    with open(PACKED_INDEX, "w") as file:
+        json.dump(index, file, indent=4)
+
+    source_bytes, packed_bytes, source_pixels, packed_pixels = totals
+    print(f"total: {source_bytes - packed_bytes:,} bytes saved ({1 - packed_bytes / source_bytes:.0%}),"
+          f" {source_pixels - packed_pixels:,} fewer bytes of images decoded ({1 - packed_pixels / source_pixels:.0%})")
+
+    build_pack(args.pack, [entry["map"] for entry in index.values()])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+The camera of the game's view.
+
+A FollowCamera keeps both players in frame. It aims at the middle of the
+two, but only moves once that point leaves a dead zone around the center
+of the view, and it eases towards where it aims instead of jumping there.
+When the players are too far apart for the window it zooms out, up to
+max_zoom. It scrolls vertically too, for maps taller than the window.
+
+The view is snapped to whole window pixels, and its projection matrix is
+only recomputed when the view actually changes.
+"""
+from pyglet.math import Mat4
+
+from constants import CHARACTER_BUFFER
+
+# How far the view can zoom out, in world pixels per window pixel
+MAX_ZOOM = 1.5
+# Half the width and height of the dead zone, in window pixels
+DEAD_ZONE = (96, 64)
+# Seconds the camera takes to go half the way to where it aims
+HALF_LIFE = 0.1
+
+
+class FollowCamera:
+    """A view of `width` x `height` window pixels that follows points of the world."""
+
+    def __init__(self, width, height, max_zoom=MAX_ZOOM):
+        self.width = width
+        self.height = height
+        self.max_zoom = max_zoom
+        self.center_x = width / 2
+        self.center_y = height / 2
+        self.zoom = 1.0
+
+        # The view as (left, bottom, width, height) in world pixels, and its projection
+        self.view = None
+        self.matrix = None
+        # How many times the projection was recomputed
+        self.projection_updates = 0
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+
+    def jump(self, points, map_width, map_height):
+        """Frame the points right away, like after a level change."""
+        self.center_x, self.center_y, self.zoom = self._aim(points, map_width, map_height, dead_zone=False)
+        self._update_view(map_width, map_height)
+
+    def update(self, points, map_width, map_height, delta_time):
+        """Move towards framing the points (x, y) for `delta_time` seconds."""
+        center_x, center_y, zoom = self._aim(points, map_width, map_height)
+        blend = 1 - 0.5 ** (delta_time / HALF_LIFE)
+        self.center_x += (center_x - self.center_x) * blend
+        self.center_y += (center_y - self.center_y) * blend
+        # Zooming in or out ends, rather than getting ever closer
+        self.zoom = zoom if abs(zoom - self.zoom) < 1e-3 else self.zoom + (zoom - self.zoom) * blend
+        self._update_view(map_width, map_height)
+
+    def _aim(self, points, map_width, map_height, dead_zone=True):
+        """Center and zoom that frame the points."""
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+
+        # Zoom out to keep some room around the points, but not past the map's width
+        zoom = max((max(xs) - min(xs) + 2 * CHARACTER_BUFFER) / self.width,
+                   (max(ys) - min(ys) + 2 * CHARACTER_BUFFER) / self.height, 1)
+        zoom = min(zoom, self.max_zoom, max(map_width / self.width, 1))
+
+        # Aim at the middle, as little as needed to bring it back into the dead zone
+        center_x = (max(xs) + min(xs)) / 2
+        center_y = (max(ys) + min(ys)) / 2
+        if dead_zone:
+            half_width, half_height = DEAD_ZONE[0] * zoom, DEAD_ZONE[1] * zoom
+            center_x = min(max(self.center_x, center_x - half_width), center_x + half_width)
+            center_y = min(max(self.center_y, center_y - half_height), center_y + half_height)
+        return center_x, center_y, zoom
+
+    def _update_view(self, map_width, map_height):
+        """Keep the view inside the map, from its bottom up when the map is not as tall, and update the projection."""
+        width = self.width * self.zoom
+        height = self.height * self.zoom
+        left = min(max(self.center_x - width / 2, 0), max(map_width - width, 0))
+        bottom = min(max(self.center_y - height / 2, 0), max(map_height - height, 0))
+        # Whole window pixels, so the pixel art doesn't shimmer and a still camera doesn't change
+        left = round(left / self.zoom) * self.zoom
+        bottom = round(bottom / self.zoom) * self.zoom
+
+        view = (left, bottom, width, height)
+        if view != self.view:
+            self.view = view
+            self.matrix = Mat4.orthogonal_projection(left, left + width, bottom, bottom + height, -100, 100)
+            self.projection_updates += 1
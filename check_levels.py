@@ -0,0 +1,289 @@
+"""
+Check that both players can still reach the Exit of a level.
+
+Searches, with A*, over states made of both players' cells and the
+triggers fired so far. Movement is abstracted to the moves of each
+character's NavGraph, one player moving at a time. A player fires its
+trigger by standing on it (levers) or by attacking facing right from it.
+States already reached at a lower cost are not expanded again, and the
+search gives up after a node budget.
+
+A solution is then played in the headless World to see whether the real
+game logic agrees, and the buttons it took can be written to a file.
+
+    python check_levels.py                  # every level
+    python check_levels.py 2 --budget 50000 --inputs solution.txt
+    python check_levels.py --inputs solution.txt    # solution-1.txt, solution-2.txt...
+"""
+import argparse
+import heapq
+import itertools
+import sys
+import time
+
+from constants import (
+    BUTTON_ATTACK, BUTTON_LEFT, BUTTON_RIGHT, CHARACTER_BUFFER, GRID_PIXEL_SIZE, PLAYER_MOVEMENT_SPEED, SCREEN_WIDTH,
+)
+from navigation import MAX_MOVE_TICKS, Body, NavGraph, move_buttons
+from rules import ATTACK_TICKS, LEVEL_RULES
+from tilegrid import TileGrid
+
+DEFAULT_BUDGET = 200000
+# Ticks to wait after a move for the character to settle, when playing a solution
+SETTLE_TICKS = 10
+
+
+def describe(move):
+    direction, jump, delay, hold = move
+    side = {-1: "left", 0: "", 1: "right"}[direction]
+    if not jump:
+        return f"walk {side}"
+    text = f"jump {side}".rstrip()
+    if direction and delay:
+        text += f" after {delay} ticks"
+    if direction and hold is not None:
+        text += f" for {hold} ticks"
+    return text
+
+
+class LevelSearch:
+    """The search over both players' positions for one level."""
+
+    def __init__(self, level, max_distance=SCREEN_WIDTH - CHARACTER_BUFFER):
+        self.level = level
+        self.rules = LEVEL_RULES[level]
+        self.triggers = self.rules["triggers"]
+        self.max_distance = max_distance
+        grid = TileGrid.from_map(LEVEL_RULES[level]["map"])
+
+        # graphs[player][fired], each updated from the one without the last trigger
+        self.graphs = []
+        for player in (0, 1):
+            graphs = [NavGraph(grid, level, player)]
+            for fired in range(1, 1 << len(self.triggers)):
+                graph = graphs[0].copy()
+                graph.update(fired)
+                graphs.append(graph)
+            self.graphs.append(graphs)
+
+    def start(self):
+        """Both players' nodes once they landed after spawning."""
+        nodes = []
+        for player in (0, 1):
+            graph = self.graphs[player][0]
+            body = Body(graph.solid, graph.grid.width, graph.grid.height, graph.box, *self.rules["spawns"][player])
+            body.grounded = False
+            for _ in range(120):
+                body.step(0, False)
+                if body.grounded and body.change_y == 0:
+                    break
+            nodes.append(graph.node_at(body.x, body.y))
+        return tuple(nodes)
+
+    def _estimate(self, nodes, fired):
+        # Each player has to walk to the nearest exit column at least
+        ticks = 0
+        for player in (0, 1):
+            exits = self.graphs[player][fired].goal_nodes("Exit")
+            if exits:
+                distance = min(abs(nodes[player][0] - col) for col, _ in exits)
+                ticks += max(0, distance - 1) * GRID_PIXEL_SIZE / PLAYER_MOVEMENT_SPEED
+        return ticks
+
+    def search(self, budget=DEFAULT_BUDGET):
+        """
+        Returns (solution, expanded) where solution is a list of steps
+        (player, action, target) or None when there is none within the budget.
+        """
+        start = (self.start(), 0)
+        if None in start[0]:
+            return None, 0
+
+        counter = itertools.count()
+        best = {start: 0}
+        came_from = {start: None}
+        queue = [(self._estimate(*start), 0, next(counter), start)]
+        expanded = 0
+        while queue and expanded < budget:
+            _, cost, _, state = heapq.heappop(queue)
+            if cost > best[state]:
+                continue
+            expanded += 1
+            nodes, fired = state
+
+            if all(nodes[player] in self.graphs[player][fired].goal_nodes("Exit") for player in (0, 1)):
+                steps = []
+                while came_from[state] is not None:
+                    state, step = came_from[state]
+                    steps.append(step)
+                steps.reverse()
+                return steps, expanded
+
+            for successor, step_cost, step in self._successors(nodes, fired):
+                new_cost = cost + step_cost
+                if new_cost < best.get(successor, float("inf")):
+                    best[successor] = new_cost
+                    came_from[successor] = (state, step)
+                    heapq.heappush(queue, (new_cost + self._estimate(*successor), new_cost, next(counter), successor))
+        return None, expanded
+
+    def _successors(self, nodes, fired):
+        for player in (0, 1):
+            graph = self.graphs[player][fired]
+
+            # Fire this player's triggers
+            for index, (trigger_player, layer, needs_attack, _, _) in enumerate(self.triggers):
+                if trigger_player == player and not fired & (1 << index) and nodes[player] in graph.goal_nodes(layer):
+                    new_fired = fired | (1 << index)
+                    # Standing where a removed wall was is fine, standing where a new one is isn't
+                    if all(nodes[p] in self.graphs[p][new_fired].edges for p in (0, 1)):
+                        cost = ATTACK_TICKS[player] if needs_attack else 0
+                        yield (nodes, new_fired), cost, (player, "attack" if needs_attack else "lever", layer)
+
+            # Move this player
+            other = nodes[1 - player]
+            for target, ticks, move in graph.edges.get(nodes[player], ()):
+                if abs(target[0] - other[0]) * GRID_PIXEL_SIZE > self.max_distance:
+                    continue
+                new_nodes = (target, other) if player == 0 else (other, target)
+                yield (new_nodes, fired), ticks, (player, move, target)
+
+
+def play(level, start, steps):
+    """
+    Play a solution in a headless World, one step after the other. Before
+    each move the player is walked back to the middle of its cell, since the
+    real game never lands exactly where the tile grid does.
+    Returns whether both players reached the exit, and the buttons played.
+    """
+    from world import World
+
+    world = World()
+    world.setup()
+    if level != world.current_level:
+        world.current_level = level
+        world.setup_level(level)
+    world.between_levels = False
+    sprites = (world.player_sprite_1, world.player_sprite_2)
+    inputs = []
+
+    def press(player, buttons):
+        pair = (buttons, 0) if player == 0 else (0, buttons)
+        inputs.append(pair)
+        world.update(*pair)
+        return world.current_level != level or world.game_end
+
+    def settle(player):
+        for _ in range(SETTLE_TICKS):
+            if press(player, 0):
+                return True
+        return False
+
+    if settle(0) or settle(1):
+        return True, inputs
+    nodes = list(start)
+    for player, action, target in steps:
+        sprite = sprites[player]
+        if action == "lever":
+            continue
+
+        # Back to the middle of the cell the step starts from
+        center = nodes[player][0] * GRID_PIXEL_SIZE + GRID_PIXEL_SIZE / 2
+        for _ in range(3 * GRID_PIXEL_SIZE):
+            offset = center - sprite.center_x
+            if abs(offset) < PLAYER_MOVEMENT_SPEED:
+                break
+            if press(player, BUTTON_RIGHT if offset > 0 else BUTTON_LEFT):
+                return True, inputs
+        if settle(player):
+            return True, inputs
+
+        if action == "attack":
+            # Face the middle of the target layer's tiles
+            xs = [tile.center_x for tile in world.scene[target]]
+            facing = BUTTON_RIGHT if sum(xs) / len(xs) > sprite.center_x else BUTTON_LEFT
+            script = [facing, 0, BUTTON_ATTACK] + [0] * ATTACK_TICKS[player]
+        else:
+            _, _, delay, hold = action
+            script = [move_buttons(action, tick) for tick in range(delay + (hold or 0) + 1)]
+            nodes[player] = target
+        for buttons in script:
+            if press(player, buttons):
+                return True, inputs
+        # Keep holding the direction of a jump until landing
+        last = script[-1] & ~BUTTON_ATTACK
+        for _ in range(MAX_MOVE_TICKS):
+            if sprite.change_y == 0:
+                break
+            if press(player, last if action != "attack" and action[3] is None else 0):
+                return True, inputs
+        if settle(player):
+            return True, inputs
+    return False, inputs
+
+
+def check(level, budget, verify, inputs_file=None):
+    start = time.perf_counter()
+    search = LevelSearch(level)
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    steps, expanded = search.search(budget)
+    searched = time.perf_counter() - start
+
+    print(f"level {level}: graphs built in {built * 1000:.0f} ms,"
+          f" searched in {searched * 1000:.0f} ms, {expanded} states expanded")
+    if steps is None:
+        verdict = "budget exhausted" if expanded >= budget else "NOT SOLVABLE"
+        print(f"  {verdict}")
+        return False
+
+    print(f"  solvable in {len(steps)} steps, one player moving at a time:")
+    for player, action, target in steps:
+        if action in ("lever", "attack"):
+            print(f"    P{player + 1} {action} {target}")
+        else:
+            print(f"    P{player + 1} {describe(action)} to cell {target}")
+
+    if verify:
+        start = time.perf_counter()
+        reached, inputs = play(level, search.start(), steps)
+        print(f"  played in the World in {len(inputs)} ticks, {(time.perf_counter() - start):.1f} s:"
+              f" {'exit reached' if reached else 'exit NOT reached, the tile grid and the game disagree'}")
+        if inputs_file:
+            with open(inputs_file, "w") as file:
+                for buttons in inputs:
+                    file.write(f"{buttons[0]} {buttons[1]}\n")
+            print(f"  inputs written to {inputs_file}")
+        return reached
+    return True
+
+
+def inputs_file(file_name, level, several):
+    """The file a level's inputs go to: with several levels, each gets its number added to the name."""
+    if file_name is None or not several:
+        return file_name
+    stem, dot, suffix = file_name.rpartition(".")
+    if not dot or "/" in suffix:
+        return f"{file_name}-{level}"
+    return f"{stem}-{level}.{suffix}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("levels", type=int, nargs="*", help="level numbers, all of them by default")
+    parser.add_argument("--budget", type=int, default=DEFAULT_BUDGET, help="most states to expand")
+    parser.add_argument("--no-verify", action="store_true", help="don't play the solution in the World")
+    parser.add_argument("--inputs", help="write the buttons played in the World, one tick per line, to this file"
+                                         " (with the level number added when checking several levels)")
+    args = parser.parse_args()
+
+    levels = args.levels or sorted(LEVEL_RULES)
+    results = [
+        check(level, args.budget, not args.no_verify, inputs_file(args.inputs, level, len(levels) > 1))
+        for level in levels
+    ]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+# --- Constants
+SCREEN_TITLE = "FireKnight&WaterPriestess"
+
+SCREEN_WIDTH = 1080
+SCREEN_HEIGHT = 768 # NUMBER_OF_TILES x TILE_SCALING x 16
+CHARACTER_BUFFER = 100
+
+# Constants used to scale our sprites from their original size
+CHARACTER_SCALING = 4
+TILE_SCALING = 4
+COIN_SCALING = 0.5
+ENEMY_SCALING = 2
+SPRITE_PIXEL_SIZE = 16
+GRID_PIXEL_SIZE = SPRITE_PIXEL_SIZE * TILE_SCALING
+
+# Movement speed of player, in pixels per frame
+PLAYER_MOVEMENT_SPEED = 5
+GRAVITY = 1
+PLAYER_JUMP_SPEED = 20
+
+# Animation states of the characters, in the order they are stored in save files
+PLAYER_STATES = ("idle", "walk", "jump", "surf", "attack")
+# Ticks each frame of a state's animation is shown, in the order of PLAYER_STATES
+PLAYER_FRAME_TICKS = (10, 10, 10, 10, 10)
+
+# Buttons of one player's input, as bits of one byte per tick
+BUTTON_LEFT = 1
+BUTTON_RIGHT = 2
+BUTTON_JUMP = 4
+BUTTON_ATTACK = 8
+BUTTON_CONTINUE = 16  # Leaves the chapter screen shown between levels
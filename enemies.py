@@ -0,0 +1,190 @@
+"""
+Enemies of a level: Sprouts that patrol the platforms.
+
+Enemies spawn at the points of the map's "Enemies" object layer. Their state
+is kept as a struct of arrays: one numpy array per field, one element per
+enemy. A tick moves all of them with a handful of array operations, no matter
+how many there are: gravity, landing on the cells of the walls grid, walking,
+and turning around at walls and ledges.
+
+All enemies are drawn from one SpriteList. Its sprites are only brought up to
+date with the arrays when a frame is drawn (see sync), so ticks simulated
+again after a rollback never touch them.
+"""
+import arcade
+import numpy as np
+
+from assets import load_image
+from constants import ENEMY_SCALING, GRAVITY
+from snapshot import ArrayState
+
+ENEMY_LAYER = "Enemies"
+
+# Animation states of a Sprout, in the order of their numbers: (sprite sheet, frames).
+# The frames are squares stacked from the top of the sheet, facing right.
+SPROUT_STATES = (
+    ("maps/Sprout/Idle/Sprout_idle.png", 4),
+    ("maps/Sprout/Move/Sprout_move.png", 5),
+    ("maps/Sprout/Attack/Sprout_attack.png", 6),
+    ("maps/Sprout/Damage/Sprout-damage.png", 5),
+    ("maps/Sprout/Death/Sprout-death.png", 8),
+)
+IDLE, MOVE, ATTACK, DAMAGE, DEATH = range(len(SPROUT_STATES))
+SPROUT_FRAME_SIZE = 96
+SPROUT_FRAME_TICKS = 8
+
+# Body of a Sprout (left, right, bottom, top) relative to its center, from the opaque pixels of its frames
+SPROUT_BOX = tuple(value * ENEMY_SCALING for value in (-23, 26, -30, 31))
+# Pixels per tick
+SPROUT_SPEED = 2
+# Less than a cell, so a falling Sprout can't go through a platform
+MAX_FALL_SPEED = 20
+# Ticks a Sprout stands still after turning around
+SPROUT_PAUSE_TICKS = 60
+
+# Rows of Enemies.floats and Enemies.ints
+FLOAT_FIELDS = ("x", "y", "change_x", "change_y")
+INT_FIELDS = ("state", "frame", "frame_tick", "pause", "direction")
+
+_textures = None
+
+
+def sprout_textures():
+    """Every frame of every state facing right, then all of them again facing left. Loaded once."""
+    global _textures
+    if _textures is None:
+        _textures = []
+        for flipped in (False, True):
+            for sheet, frames in SPROUT_STATES:
+                load_image(sheet)
+                for frame in range(frames):
+                    _textures.append(arcade.load_texture(
+                        sheet, 0, frame * SPROUT_FRAME_SIZE, SPROUT_FRAME_SIZE, SPROUT_FRAME_SIZE,
+                        flipped_horizontally=flipped, hit_box_algorithm="None",
+                    ))
+    return _textures
+
+
+class Enemies(ArrayState):
+    """The enemies of one level, as arrays."""
+
+    def __init__(self, spawns):
+        count = len(spawns)
+        self.count = count
+        # One row per field, so the whole state is two contiguous blocks to copy into snapshots
+        self.floats = np.zeros((len(FLOAT_FIELDS), count))
+        self.ints = np.zeros((len(INT_FIELDS), count), dtype=np.int32)
+        self.x, self.y, self.change_x, self.change_y = self.floats
+        self.state, self.frame, self.frame_tick, self.pause, self.direction = self.ints
+
+        self.x[:] = [x for x, _ in spawns]
+        self.y[:] = [bottom - SPROUT_BOX[2] for _, bottom in spawns]
+        self.state[:] = MOVE
+        self.direction[:] = 1
+        self.original = self.state_bytes()
+
+        # Texture number of a state's first frame, and the number of frames of each state
+        frame_counts = [frames for _, frames in SPROUT_STATES]
+        self.first_frames = np.cumsum([0] + frame_counts[:-1]).astype(np.int32)
+        self.frame_counts = np.array(frame_counts, dtype=np.int32)
+        self.mirrored = sum(frame_counts)
+
+        self.textures = sprout_textures()
+        self.sprite_list = arcade.SpriteList(capacity=max(count, 1))
+        self.sprites = []
+        for x, y in zip(self.x.tolist(), self.y.tolist()):
+            sprite = arcade.Sprite(texture=self.textures[0], scale=ENEMY_SCALING, center_x=x, center_y=y)
+            self.sprites.append(sprite)
+            self.sprite_list.append(sprite)
+        # Positions and texture numbers the sprites were last synced to
+        self.drawn = np.full((3, count), np.nan)
+
+    @classmethod
+    def from_tiled_map(cls, tiled_map, scaling):
+        """The enemies placed in a parsed Tiled map's "Enemies" object layer, none if it has no such layer."""
+        map_height = tiled_map.map_size.height * tiled_map.tile_size.height
+        spawns = []
+        for layer in tiled_map.layers:
+            if layer.name == ENEMY_LAYER:
+                for tiled_object in layer.tiled_objects:
+                    if tiled_object.class_ != "Sprout":
+                        raise ValueError(f"unknown enemy {tiled_object.class_!r} in {tiled_map.map_file}")
+                    # Tiled counts y from the top of the map, the point is where the feet are
+                    spawns.append((tiled_object.coordinates.x * scaling, (map_height - tiled_object.coordinates.y) * scaling))
+        return cls(spawns)
+
+    def __len__(self):
+        return self.count
+
+    def update(self, walls, cell_size):
+        """
+        Advance every enemy by one tick. `walls` is a grid of the cells enemies
+        stand on and can't walk through, indexed [row + 1, col + 1] with a
+        border of walls around the map (see Level.cell_grid).
+        """
+        if not self.count:
+            return
+        x, y, change_x, change_y = self.floats
+        state, frame, frame_tick, pause, direction = self.ints
+        left, right, bottom, top = SPROUT_BOX
+        rows, cols = walls.shape
+
+        def cells(values, size):
+            return np.clip(np.floor_divide(values, cell_size).astype(np.intp) + 1, 0, size - 1)
+
+        # Fall, and land on the cell the feet went into
+        change_y -= GRAVITY
+        np.maximum(change_y, -MAX_FALL_SPEED, out=change_y)
+        y += change_y
+        feet_col = cells(x + (left + right) / 2, cols)
+        feet_row = cells(y + bottom, rows)
+        landed = walls[feet_row, feet_col].astype(bool)
+        y[landed] = (feet_row[landed] * cell_size) - bottom
+        change_y[landed] = 0
+
+        # Standing still after turning around
+        paused = state == IDLE
+        pause[paused] -= 1
+        start = paused & (pause <= 0)
+        state[start] = MOVE
+
+        # Walk, turning around in front of walls and ledges
+        walking = landed & (state == MOVE)
+        ahead = cells(x + np.where(direction > 0, right, left) + direction * SPROUT_SPEED, cols)
+        blocked = (walls[cells(y + bottom + 1, rows), ahead] | walls[cells(y + (bottom + top) / 2, rows), ahead]
+                   | walls[cells(y + top - 1, rows), ahead]).astype(bool)
+        ledge = ~walls[cells(y + bottom - 1, rows), ahead].astype(bool)
+        turn = walking & (blocked | ledge)
+        direction[turn] *= -1
+        state[turn] = IDLE
+        pause[turn] = SPROUT_PAUSE_TICKS
+        change_x[:] = np.where(walking & ~turn, direction * SPROUT_SPEED, 0)
+        x += change_x
+
+        # Animation, from the first frame when the state changed
+        changed = turn | start
+        frame[changed] = 0
+        frame_tick[changed] = 0
+        frame_tick += 1
+        advance = frame_tick >= SPROUT_FRAME_TICKS
+        frame_tick[advance] = 0
+        frame[advance] += 1
+        frame %= self.frame_counts[state]
+
+    def sync(self):
+        """Move the sprites to the enemies' positions and frames, only touching the ones that changed."""
+        if not self.count:
+            return
+        textures = self.first_frames[self.state] + self.frame + np.where(self.direction < 0, self.mirrored, 0)
+        drawn_x, drawn_y, drawn_texture = self.drawn
+
+        moved = np.flatnonzero((self.x != drawn_x) | (self.y != drawn_y))
+        for index, x, y in zip(moved.tolist(), self.x[moved].tolist(), self.y[moved].tolist()):
+            self.sprites[index].position = (x, y)
+        changed = np.flatnonzero(textures != drawn_texture)
+        for index, texture in zip(changed.tolist(), textures[changed].tolist()):
+            self.sprites[index].texture = self.textures[texture]
+
+        drawn_x[:] = self.x
+        drawn_y[:] = self.y
+        drawn_texture[:] = textures
@@ -0,0 +1,475 @@
+"""
+Gym-style environments for training agents on the levels.
+
+CoopEnv wraps the World, so it plays exactly like the game, one level at a
+time. VecCoopEnv steps many copies of a level in lockstep with NumPy: every
+copy is a few rows of batched arrays (positions, velocities, grounded flags,
+coins and fired triggers as bitsets) and collisions are checked against the
+level's tile grid instead of sprites. Its physics follow the game's closely
+but not exactly: every tile counts as a full cell, there is no ramp climbing,
+and the floor below the map is solid.
+
+Both take one action per player and step as
+
+    observation, reward, terminated, truncated, info = env.step(actions)
+
+An action is the player's buttons (BUTTON_LEFT | BUTTON_JUMP ...), 0 to 15.
+An observation is a crop of the tile grid around each player, with channels
+(solid for this player, coins, exit, this player's trigger, other player).
+The reward is the number of coins collected plus EXIT_REWARD when both
+players reach the exit, which ends the episode.
+
+    python env.py --envs 1024 --steps 500
+"""
+import argparse
+import time
+
+import numpy as np
+
+from constants import (
+    BUTTON_ATTACK, BUTTON_JUMP, BUTTON_LEFT, BUTTON_RIGHT, CHARACTER_BUFFER, GRAVITY, GRID_PIXEL_SIZE,
+    PLAYER_JUMP_SPEED, PLAYER_MOVEMENT_SPEED, SCREEN_WIDTH,
+)
+from projectiles import PROJECTILE_SPEED, PROJECTILE_TICKS
+from rules import ATTACK_TICKS, LEVEL_RULES, PLAYER_BOXES, wall_layers
+from tilegrid import TileGrid
+
+ACTION_COUNT = 16
+EXIT_REWARD = 10.0
+MAX_STEPS = 3000
+CHANNELS = ("solid", "coins", "exit", "trigger", "other player")
+# Cells around the player in each direction
+CROP_X = 7
+CROP_Y = 5
+
+
+def crop_cells(x, y):
+    """Bottom left cell of the observation crop around each position."""
+    col = np.floor_divide(x, GRID_PIXEL_SIZE).astype(np.int64) - CROP_X
+    row = np.floor_divide(y, GRID_PIXEL_SIZE).astype(np.int64) - CROP_Y
+    return col, row
+
+
+class LevelTables:
+    """
+    A level's tile grid compiled to padded NumPy arrays. Cells outside the map
+    are solid to the left, right and below it, and empty above it.
+    """
+
+    def __init__(self, level):
+        self.level = level
+        self.rules = LEVEL_RULES[level]
+        grid = TileGrid.from_map(LEVEL_RULES[level]["map"])
+        self.grid = grid
+        self.end_of_map = grid.width * GRID_PIXEL_SIZE
+
+        # Enough padding for the largest hit box and crop to never leave the arrays
+        self.pad = max(CROP_X, CROP_Y) + 6
+        self.shape = (grid.height + 2 * self.pad, grid.width + 2 * self.pad)
+
+        def layer(names, outside=0):
+            cells = np.full(self.shape, outside, dtype=bool)
+            inner = np.frombuffer(grid.union(names), dtype=np.uint8).reshape(grid.height, grid.width)
+            cells[self.pad:self.pad + grid.height, self.pad:self.pad + grid.width] = inner.astype(bool)
+            return cells
+
+        def solid(names):
+            cells = layer(names)
+            cells[:self.pad, :] = True
+            cells[:, :self.pad] = True
+            cells[:, self.pad + grid.width:] = True
+            return cells
+
+        # Solid cells for each character after each combination of fired triggers:
+        # walls[fired * 2 + player], where bit t of fired is trigger t
+        triggers = self.rules["triggers"]
+        self.walls = []
+        for fired in range(1 << len(triggers)):
+            for player in (0, 1):
+                self.walls.append(solid(wall_layers(level, player, fired)))
+        self.walls = np.stack(self.walls)
+
+        self.exit = layer(["Exit"])
+        self.trigger_layers = np.stack([layer([trigger[1]]) for trigger in triggers])
+        self.trigger_players = np.array([trigger[0] for trigger in triggers])
+        self.trigger_attacks = np.array([trigger[2] for trigger in triggers])
+        # Each player's trigger cells, for observations
+        self.player_triggers = np.stack([
+            layer([trigger[1] for trigger in triggers if trigger[0] == player]) for player in (0, 1)
+        ])
+
+        # Index of the coin in each cell, -1 where there is none
+        self.coin_index = np.full(self.shape, -1, dtype=np.int64)
+        coin_cells = grid.cells("Coins")
+        for index, (col, row) in enumerate(coin_cells):
+            self.coin_index[row + self.pad, col + self.pad] = index
+        self.coin_count = len(coin_cells)
+
+        self.spawns = np.array(self.rules["spawns"], dtype=np.float64)
+        self.boxes = np.array(PLAYER_BOXES, dtype=np.float64)
+        self.attack_ticks = np.array(ATTACK_TICKS)
+
+
+class VecCoopEnv:
+    """`num_envs` copies of one level, stepped together."""
+
+    def __init__(self, num_envs, level=1, max_steps=MAX_STEPS, seed=None):
+        self.num_envs = num_envs
+        self.tables = LevelTables(level)
+        self.max_steps = max_steps
+        self.random = np.random.default_rng(seed)
+        self.observation_shape = (2, len(CHANNELS), 2 * CROP_Y + 1, 2 * CROP_X + 1)
+
+        k = num_envs
+        self.x = np.zeros((k, 2))
+        self.y = np.zeros((k, 2))
+        self.change_x = np.zeros((k, 2))
+        self.change_y = np.zeros((k, 2))
+        self.grounded = np.zeros((k, 2), dtype=bool)
+        self.facing_right = np.ones((k, 2), dtype=bool)
+        self.buttons = np.zeros((k, 2), dtype=np.int64)
+        self.attack_timer = np.zeros((k, 2), dtype=np.int64)
+        self.attack_hit = np.zeros((k, len(self.tables.trigger_players)), dtype=bool)
+        # Bit t is set once trigger t fired
+        self.fired = np.zeros(k, dtype=np.int64)
+        self.coins = np.ones((k, self.tables.coin_count + 1), dtype=bool)
+        self.camera_x = np.zeros(k)
+        self.steps = np.zeros(k, dtype=np.int64)
+        self.score = np.zeros(k, dtype=np.int64)
+
+        self._envs = np.arange(k)[:, None]
+        self._players = np.arange(2)[None, :]
+
+    # --- Grid lookups
+
+    def _cells(self, left, right, bottom, top):
+        """Padded row and column indices of the cells a box overlaps, and a mask of the ones it really does."""
+        size = GRID_PIXEL_SIZE
+        pad = self.tables.pad
+        col0 = np.floor_divide(left, size).astype(np.int64)
+        row0 = np.floor_divide(bottom, size).astype(np.int64)
+        cols = col0[..., None] + np.arange(5)
+        rows = row0[..., None] + np.arange(4)
+        cols_valid = cols * size < right[..., None]
+        rows_valid = rows * size < top[..., None]
+        cols = np.clip(cols + pad, 0, self.tables.shape[1] - 1)
+        rows = np.clip(rows + pad, 0, self.tables.shape[0] - 1)
+        valid = rows_valid[..., :, None] & cols_valid[..., None, :]
+        return rows[..., :, None], cols[..., None, :], valid, row0, col0
+
+    def _solid(self, left, right, bottom, top):
+        rows, cols, valid, row0, col0 = self._cells(left, right, bottom, top)
+        walls = (self.fired[:, None] * 2 + self._players)[..., None, None]
+        return self.tables.walls[walls, rows, cols] & valid, row0, col0
+
+    def _box(self):
+        boxes = self.tables.boxes
+        return (self.x + boxes[:, 0], self.x + boxes[:, 1], self.y + boxes[:, 2], self.y + boxes[:, 3])
+
+    def _touching(self, layers):
+        """Whether each player's box overlaps a cell of a (padded) layer grid."""
+        rows, cols, valid, _, _ = self._cells(*self._box())
+        return (layers[rows, cols] & valid).any(axis=(-1, -2))
+
+    def _shoot(self, attack):
+        """
+        Fly the projectiles of the attacks starting now to their end, along the
+        row of the middle of the body (see projectiles.py), and mark the attack
+        triggers they hit. Walls are taken as they are when the attack starts.
+        """
+        tables = self.tables
+        size = GRID_PIXEL_SIZE
+        boxes = tables.boxes
+        x = self.x + (boxes[:, 0] + boxes[:, 1]) / 2
+        step = np.where(self.facing_right, PROJECTILE_SPEED, -PROJECTILE_SPEED)
+        row = np.clip(np.floor_divide(self.y + (boxes[:, 2] + boxes[:, 3]) / 2, size).astype(np.int64) + tables.pad,
+                      0, tables.shape[0] - 1)
+        walls = self.fired[:, None] * 2 + self._players
+        targets = [index for index in range(len(tables.trigger_players)) if tables.trigger_attacks[index]]
+        flying = attack.copy()
+        for _ in range(PROJECTILE_TICKS):
+            x = x + step
+            col = np.clip(np.floor_divide(x, size).astype(np.int64) + tables.pad, 0, tables.shape[1] - 1)
+            for index in targets:
+                player = tables.trigger_players[index]
+                hit = flying[:, player] & tables.trigger_layers[index][row[:, player], col[:, player]]
+                self.attack_hit[:, index] |= hit
+                flying[:, player] &= ~hit
+            flying &= ~tables.walls[walls, row, col]
+            if not flying.any():
+                break
+
+    # --- Env API
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.random = np.random.default_rng(seed)
+        self._reset(np.ones(self.num_envs, dtype=bool))
+        return self.observe(), {}
+
+    def _reset(self, mask):
+        self.x[mask] = self.tables.spawns[:, 0]
+        self.y[mask] = self.tables.spawns[:, 1]
+        self.change_x[mask] = 0
+        self.change_y[mask] = 0
+        self.grounded[mask] = False
+        self.facing_right[mask] = True
+        self.buttons[mask] = 0
+        self.attack_timer[mask] = 0
+        self.attack_hit[mask] = False
+        self.fired[mask] = 0
+        self.coins[mask] = True
+        self.coins[:, -1] = False
+        self.camera_x[mask] = 0
+        self.steps[mask] = 0
+        self.score[mask] = 0
+
+    def step(self, actions):
+        """Advance every copy by one tick. `actions` is (num_envs, 2) buttons."""
+        tables = self.tables
+        size = GRID_PIXEL_SIZE
+        buttons = np.asarray(actions, dtype=np.int64) & 15
+        pressed = buttons & ~self.buttons
+        self.buttons = buttons
+        self.steps += 1
+
+        # Buttons
+        direction = buttons & (BUTTON_LEFT | BUTTON_RIGHT)
+        self.change_x = np.where(direction == BUTTON_LEFT, -PLAYER_MOVEMENT_SPEED,
+                                 np.where(direction == BUTTON_RIGHT, PLAYER_MOVEMENT_SPEED, 0)).astype(np.float64)
+        turned = (pressed & (BUTTON_LEFT | BUTTON_RIGHT)) != 0
+        self.facing_right = np.where(turned, (pressed & BUTTON_LEFT) == 0, self.facing_right)
+        jump = ((pressed & BUTTON_JUMP) != 0) & self.grounded
+        self.change_y[jump] = PLAYER_JUMP_SPEED
+        can_attack = np.isin(self._players, tables.trigger_players[tables.trigger_attacks])
+        attack = ((pressed & BUTTON_ATTACK) != 0) & can_attack & (self.attack_timer == 0)
+        self.attack_timer = np.where(attack, tables.attack_ticks, self.attack_timer)
+        if attack.any():
+            self._shoot(attack)
+
+        # Keep players inside the map
+        self.x = np.minimum(self.x, tables.end_of_map - tables.boxes[:, 1])
+
+        # Gravity, then move vertically and push out of whatever was hit.
+        # Never fall more than a cell per tick so no tile can be skipped.
+        self.change_y = np.maximum(self.change_y - GRAVITY, 1 - size)
+        self.y += self.change_y
+        left, right, bottom, top = self._box()
+        hit, row0, _ = self._solid(left, right, bottom, top)
+        rows_hit = hit.any(axis=-1)
+        any_hit = rows_hit.any(axis=-1)
+        rows = row0[..., None] + np.arange(4)
+        highest = np.where(rows_hit, rows, -1 << 30).max(axis=-1)
+        lowest = np.where(rows_hit, rows, 1 << 30).min(axis=-1)
+        falling = any_hit & (self.change_y <= 0)
+        rising = any_hit & (self.change_y > 0)
+        self.y = np.where(falling, (highest + 1) * size - tables.boxes[:, 2], self.y)
+        self.y = np.where(rising, lowest * size - tables.boxes[:, 3], self.y)
+        self.change_y[any_hit] = 0
+
+        # Move horizontally
+        self.x += self.change_x
+        left, right, bottom, top = self._box()
+        hit, _, col0 = self._solid(left, right, bottom, top)
+        cols_hit = hit.any(axis=-2)
+        any_hit = cols_hit.any(axis=-1)
+        cols = col0[..., None] + np.arange(5)
+        rightmost = np.where(cols_hit, cols, -1 << 30).max(axis=-1)
+        leftmost = np.where(cols_hit, cols, 1 << 30).min(axis=-1)
+        self.x = np.where(any_hit & (self.change_x > 0), leftmost * size - tables.boxes[:, 1], self.x)
+        self.x = np.where(any_hit & (self.change_x < 0), (rightmost + 1) * size - tables.boxes[:, 0], self.x)
+
+        # Standing on something: a wall right below the box
+        left, right, bottom, top = self._box()
+        below, _, _ = self._solid(left, right, bottom - 5, bottom)
+        self.grounded = below.any(axis=(-1, -2))
+
+        self._center_camera()
+        reward = self._interact()
+
+        # Both players at the exit
+        at_exit = self._touching(tables.exit)
+        terminated = at_exit.all(axis=1)
+        reward += terminated * EXIT_REWARD
+        truncated = (self.steps >= self.max_steps) & ~terminated
+
+        info = {"score": self.score.copy()}
+        done = terminated | truncated
+        if done.any():
+            self._reset(done)
+        return self.observe(), reward, terminated, truncated, info
+
+    def _center_camera(self):
+        """World.center_camera_to_player for every copy, with a SCREEN_WIDTH wide view."""
+        width = SCREEN_WIDTH
+        distance = np.abs(self.x[:, 0] - self.x[:, 1])
+        follow = distance < width - CHARACTER_BUFFER
+        center = np.clip((self.x[:, 0] + self.x[:, 1]) / 2 - width / 2, 0, self.tables.end_of_map - width)
+        self.camera_x = np.where(follow, center, self.camera_x)
+
+        # Too far apart: keep both players in the view
+        boxes = self.tables.boxes
+        left = self.camera_x[:, None]
+        right = left + width
+        constrained = ~follow[:, None]
+        self.x = np.where(constrained & (self.x + boxes[:, 0] < left), left - boxes[:, 0], self.x)
+        self.x = np.where(constrained & (self.x + boxes[:, 1] > right), right - boxes[:, 1], self.x)
+
+    def _interact(self):
+        """Coins and triggers. Returns the reward of this step."""
+        tables = self.tables
+
+        # Coins: every coin cell overlapped by a player is taken
+        rows, cols, valid, _, _ = self._cells(*self._box())
+        touched = np.where(valid, tables.coin_index[rows, cols], -1)
+        touched = touched.reshape(self.num_envs, -1)
+        taken = np.zeros_like(self.coins)
+        taken[np.repeat(np.arange(self.num_envs), touched.shape[1]), touched.ravel()] = True
+        taken[:, -1] = False
+        gained = (taken & self.coins).sum(axis=1)
+        self.coins &= ~taken
+        self.score += gained
+
+        # Triggers: levers fire on touch, attacks fire when an attack whose projectile hit the target ends
+        for index in range(len(tables.trigger_players)):
+            player = tables.trigger_players[index]
+            if tables.trigger_attacks[index]:
+                ends = self.attack_timer[:, player] == 1
+                fire = ends & self.attack_hit[:, index]
+                self.attack_hit[ends, index] = False
+            else:
+                fire = self._touching(tables.trigger_layers[index])[:, player]
+            self.fired |= fire.astype(np.int64) << index
+        self.attack_timer = np.maximum(self.attack_timer - 1, 0)
+
+        return gained.astype(np.float64)
+
+    def observe(self):
+        """Tile-grid crops around each player, (num_envs, 2, channels, rows, cols) of uint8."""
+        tables = self.tables
+        col0, row0 = crop_cells(self.x, self.y)
+        # Rows of the crop go from top to bottom, like an image
+        rows = (row0 + tables.pad)[..., None, None] + np.arange(2 * CROP_Y, -1, -1)[:, None]
+        cols = (col0 + tables.pad)[..., None, None] + np.arange(2 * CROP_X + 1)[None, :]
+        rows = np.clip(rows, 0, tables.shape[0] - 1)
+        cols = np.clip(cols, 0, tables.shape[1] - 1)
+
+        observation = np.zeros((self.num_envs, *self.observation_shape), dtype=np.uint8)
+        walls = (self.fired[:, None] * 2 + self._players)[..., None, None]
+        observation[:, :, 0] = tables.walls[walls, rows, cols]
+        observation[:, :, 1] = np.take_along_axis(
+            self.coins, tables.coin_index[rows, cols].reshape(self.num_envs, -1), axis=1,
+        ).reshape(rows.shape[:2] + (rows.shape[2], cols.shape[3]))
+        observation[:, :, 2] = tables.exit[rows, cols]
+        observation[:, :, 3] = tables.player_triggers[self._players[..., None, None], rows, cols]
+
+        # The other player, if it is in the crop
+        other_col = np.floor_divide(self.x[:, ::-1], GRID_PIXEL_SIZE).astype(np.int64) - col0
+        other_row = 2 * CROP_Y - (np.floor_divide(self.y[:, ::-1], GRID_PIXEL_SIZE).astype(np.int64) - row0)
+        inside = (other_col >= 0) & (other_col <= 2 * CROP_X) & (other_row >= 0) & (other_row <= 2 * CROP_Y)
+        envs, players = np.nonzero(inside)
+        observation[envs, players, 4, other_row[inside], other_col[inside]] = 1
+        return observation
+
+
+class CoopEnv:
+    """One level played by the World itself, with the same actions and observations as VecCoopEnv."""
+
+    def __init__(self, level=1, max_steps=MAX_STEPS):
+        self.level_number = level
+        self.tables = LevelTables(level)
+        self.max_steps = max_steps
+        self.observation_shape = (2, len(CHANNELS), 2 * CROP_Y + 1, 2 * CROP_X + 1)
+        self.world = None
+
+    def reset(self, seed=None):
+        from world import World
+
+        if self.world is None:
+            self.world = World()
+        world = self.world
+        world.setup()
+        if self.level_number != world.current_level:
+            world.current_level = self.level_number
+            world.setup_level(self.level_number)
+        world.between_levels = False
+        self.steps = 0
+        return self.observe(), {}
+
+    def step(self, actions):
+        world = self.world
+        score = world.score
+        world.update(int(actions[0]) & 15, int(actions[1]) & 15)
+        self.steps += 1
+
+        reward = float(world.score - score)
+        terminated = world.current_level != self.level_number or world.game_end
+        if terminated:
+            reward += EXIT_REWARD
+        truncated = self.steps >= self.max_steps and not terminated
+        return self.observe(), reward, terminated, truncated, {"score": world.score}
+
+    def observe(self):
+        tables = self.tables
+        world = self.world
+        pad = tables.pad
+        players = (world.player_sprite_1, world.player_sprite_2)
+
+        # Rasterize what the World's physics engines and layers hold right now
+        coins = np.zeros(tables.shape, dtype=bool)
+        for coin in world.scene["Coins"]:
+            col, row = tables.grid.cell(coin.center_x, coin.center_y)
+            coins[row + pad, col + pad] = True
+        walls = []
+        for player in players:
+            solid = tables.walls[0].copy()
+            solid[pad:pad + tables.grid.height, pad:pad + tables.grid.width] = False
+            for wall_list in player.physics_engine.walls:
+                for wall in wall_list:
+                    col, row = tables.grid.cell(wall.center_x, wall.center_y)
+                    solid[row + pad, col + pad] = True
+            walls.append(solid)
+
+        x = np.array([player.center_x for player in players])
+        y = np.array([player.center_y for player in players])
+        col0, row0 = crop_cells(x, y)
+        observation = np.zeros(self.observation_shape, dtype=np.uint8)
+        for index in (0, 1):
+            rows = np.clip(np.arange(2 * CROP_Y, -1, -1) + row0[index] + pad, 0, tables.shape[0] - 1)[:, None]
+            cols = np.clip(np.arange(2 * CROP_X + 1) + col0[index] + pad, 0, tables.shape[1] - 1)[None, :]
+            observation[index, 0] = walls[index][rows, cols]
+            observation[index, 1] = coins[rows, cols]
+            observation[index, 2] = tables.exit[rows, cols]
+            observation[index, 3] = tables.player_triggers[index][rows, cols]
+
+            other = 1 - index
+            other_col = int(x[other] // GRID_PIXEL_SIZE) - col0[index]
+            other_row = 2 * CROP_Y - (int(y[other] // GRID_PIXEL_SIZE) - row0[index])
+            if 0 <= other_col <= 2 * CROP_X and 0 <= other_row <= 2 * CROP_Y:
+                observation[index, 4, other_row, other_col] = 1
+        return observation
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the throughput of VecCoopEnv with random actions.")
+    parser.add_argument("--envs", type=int, default=1024)
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--level", type=int, default=1)
+    args = parser.parse_args()
+
+    env = VecCoopEnv(args.envs, args.level, seed=0)
+    env.reset()
+    rng = np.random.default_rng(0)
+    actions = rng.integers(0, ACTION_COUNT, size=(args.steps, args.envs, 2))
+    start = time.perf_counter()
+    total_reward = 0.0
+    for step in range(args.steps):
+        _, reward, _, _, _ = env.step(actions[step])
+        total_reward += reward.sum()
+    elapsed = time.perf_counter() - start
+    print(f"level {args.level}: {args.envs} envs x {args.steps} steps in {elapsed:.2f} s,"
+          f" {args.envs * args.steps / elapsed:,.0f} env-steps/s, total reward {total_reward:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+A disk cache for the hit boxes of textures.
+
+arcade computes the hit box of a texture the first time a sprite uses it, by
+scanning the image's alpha for the outline of its opaque pixels. Loading the
+players and a level does that for every character frame and every tile
+image, which is most of the time setup takes.
+
+Once installed, the cache keeps every hit box arcade computes in a file,
+keyed by a hash of the image's pixels and the hit box algorithm (and detail).
+The next start reads them back instead of scanning the images again, and an
+edited image simply gets a new key. Call save() after loading to write the
+new hit boxes out.
+
+Layers whose tiles are all rectangles don't need a scan at all: the level
+manifest lists them under "bounding_boxes" and they get plain bounding boxes.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import arcade.texture
+
+CACHE_FILE = os.path.join(".cache", "hitboxes.json")
+# Bump when the cached data changes meaning
+VERSION = 1
+
+
+class HitBoxCache:
+    """Hit boxes by image key, with counts of what was computed and what came from the cache."""
+
+    def __init__(self, file_name=CACHE_FILE):
+        self.file_name = file_name
+        self.points = {}
+        self.dirty = False
+        # Hit boxes computed and read from the cache, and the seconds spent on each
+        self.computed = 0
+        self.hits = 0
+        self.compute_time = 0.0
+        self.lookup_time = 0.0
+        self.load()
+
+    def load(self):
+        """Read the cache file, a missing or outdated one is an empty cache."""
+        try:
+            with open(self.file_name) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == VERSION:
+            self.points = {key: tuple(tuple(point) for point in points) for key, points in data["points"].items()}
+
+    def save(self):
+        """
+        Write the cache file if anything was added to it. The cache is only
+        a speed-up, so a file that can't be written is reported and skipped.
+        """
+        if not self.dirty:
+            return
+        directory = os.path.dirname(self.file_name) or "."
+        temporary = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Written to a file of its own and then swapped in, so a crash never leaves half a file
+            # and server workers saving at the same time each swap in a whole one
+            handle, temporary = tempfile.mkstemp(prefix=os.path.basename(self.file_name) + ".", suffix=".tmp", dir=directory)
+            with os.fdopen(handle, "w") as file:
+                json.dump({"version": VERSION, "points": self.points}, file, separators=(",", ":"))
+            os.replace(temporary, self.file_name)
+        except OSError as error:
+            print(f"Warning: could not save the hit box cache {self.file_name}: {error}")
+            if temporary is not None and os.path.exists(temporary):
+                os.remove(temporary)
+            return
+        self.dirty = False
+
+    def reset_counts(self):
+        self.computed = self.hits = 0
+        self.compute_time = self.lookup_time = 0.0
+
+    def report(self):
+        return (f"{self.computed} hit boxes computed in {self.compute_time * 1e3:.0f} ms,"
+                f" {self.hits} read from the cache in {self.lookup_time * 1e3:.0f} ms")
+
+    def wrap(self, calculate, algorithm):
+        """A version of an arcade hit box function that goes through the cache."""
+
+        def cached(image, *args):
+            start = time.perf_counter()
+            key = image_key(image, algorithm, *args)
+            points = self.points.get(key)
+            if points is not None:
+                self.hits += 1
+                self.lookup_time += time.perf_counter() - start
+                return points
+            points = tuple(tuple(point) for point in calculate(image, *args))
+            self.points[key] = points
+            self.dirty = True
+            self.computed += 1
+            self.compute_time += time.perf_counter() - start
+            return points
+
+        cached.uncached = calculate
+        return cached
+
+
+def image_key(image, algorithm, *args):
+    """Key of a hit box: a hash of the image's size and pixels, the algorithm and its arguments."""
+    digest = hashlib.sha1(f"{image.mode} {image.width}x{image.height}".encode("ascii"))
+    digest.update(image.tobytes())
+    return " ".join([digest.hexdigest(), algorithm, *map(str, args)])
+
+
+# The installed cache, if any
+cache = None
+
+
+def install(file_name=CACHE_FILE):
+    """Make arcade's textures get their hit boxes through a cache kept in `file_name`. Returns the cache."""
+    global cache
+    cache = HitBoxCache(file_name)
+    # Texture.hit_box_points calls these by their names in arcade.texture
+    simple = getattr(arcade.texture.calculate_hit_box_points_simple, "uncached", arcade.texture.calculate_hit_box_points_simple)
+    detailed = getattr(arcade.texture.calculate_hit_box_points_detailed, "uncached", arcade.texture.calculate_hit_box_points_detailed)
+    arcade.texture.calculate_hit_box_points_simple = cache.wrap(simple, "Simple")
+    arcade.texture.calculate_hit_box_points_detailed = cache.wrap(detailed, "Detailed")
+    return cache
+
+
+def save():
+    """Write the installed cache's new hit boxes to its file."""
+    if cache is not None:
+        cache.save()
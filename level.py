@@ -0,0 +1,471 @@
+import itertools
+import zlib
+from array import array
+
+import arcade
+import attr
+import numpy as np
+
+from assets import load_map
+from enemies import ENEMY_LAYER, Enemies
+
+# Layer and alpha versions come from one counter shared by all levels, so two equal
+# versions always mean equal content, even after restoring an older snapshot.
+_versions = itertools.count(1)
+
+# Layers whose tiles are all less opaque than this are treated as hidden layers
+HIDDEN_ALPHA = 8
+
+
+def bit_indices(bits):
+    """Return the sorted indices of the bits set in a bitset."""
+    return [
+        (byte_index << 3) + bit
+        for byte_index, byte in enumerate(bits) if byte
+        for bit in range(8) if byte & (1 << bit)
+    ]
+
+
+class Level:
+    """
+    A built tile map and scene that is kept around after loading.
+
+    Besides the scene itself this keeps an index of every tile sprite the
+    map was built with. The dynamic state of the level lives in flat buffers
+    next to the scene: one membership bitset per layer over all tile sprites,
+    one alpha byte per sprite and one visibility byte per layer. Changes have
+    to go through remove_sprite, clear_layer, move_layer, set_layer_alpha and
+    set_layer_visible so the buffers stay in sync; that way the state can be
+    captured by copying the buffers and restored by rebuilding only the
+    layers that differ.
+
+    Showing and hiding whole layers is what the game's triggers do, so it is
+    a flag on the layer's SpriteList that drawing skips, not an alpha write
+    per sprite. Hidden layers still collide: invisible walls are layers too.
+
+    The level also keeps a surface grid: the surface type of every cell, from
+    the visible tiles of the layers given in surface_layers. It is rebuilt on
+    the first lookup after a change to the layers.
+
+    The enemies placed in the map are part of the level's state as well, they
+    are drawn from an "Enemies" sprite list after the tile layers.
+    """
+
+    def __init__(self, number, map_name, tile_scaling, layer_options=None, use_spatial_hash=None, tiled_map=None,
+                 surface_layers=(), layers=None):
+        self.number = number
+
+        # Read in the tiled map, unless it was already parsed (the server parses every map once for all sessions)
+        if tiled_map is None:
+            tiled_map = load_map(map_name)
+        # The whole map, for drawing it (see tilemesh.py)
+        self.tiled_map = tiled_map
+
+        # Only the layers the game logic uses get sprites, decoration is drawn from the map data
+        if layers is not None:
+            tiled_map = attr.evolve(tiled_map, layers=[layer for layer in tiled_map.layers if layer.name in layers])
+        self.tile_map = arcade.TileMap(
+            scaling=tile_scaling, layer_options=layer_options, use_spatial_hash=use_spatial_hash, tiled_map=tiled_map,
+        )
+
+        # Initialize Scene with our TileMap, this will automatically add all layers
+        # from the map as SpriteLists in the scene in the proper order.
+        self.scene = arcade.Scene.from_tilemap(self.tile_map)
+
+        # Tile layers in draw order. Layers added later on (like "Player") are not tracked.
+        self.layer_names = list(self.scene.name_mapping.keys())
+        self.layer_by_name = {name: index for index, name in enumerate(self.layer_names)}
+        self.layer_by_list = {id(self.scene[name]): index for index, name in enumerate(self.layer_names)}
+
+        # Every tile sprite of the map, layer after layer, in its original order.
+        # origin_ranges[i] is the (start, stop) slice of layer i in self.sprites.
+        self.sprites = []
+        self.origin_ranges = []
+        for name in self.layer_names:
+            start = len(self.sprites)
+            self.sprites.extend(self.scene[name])
+            self.origin_ranges.append((start, len(self.sprites)))
+        self.sprite_index = {sprite: index for index, sprite in enumerate(self.sprites)}
+        self.origin_layer = array("H", [0] * len(self.sprites))
+        for layer_index, (start, stop) in enumerate(self.origin_ranges):
+            self.origin_layer[start:stop] = array("H", [layer_index] * (stop - start))
+
+        # Membership bitsets, layer i holds the bytes [i * stride, (i + 1) * stride)
+        self.stride = (len(self.sprites) + 7) // 8
+        self.membership = bytearray(self.stride * len(self.layer_names))
+        for layer_index, (start, stop) in enumerate(self.origin_ranges):
+            for sprite_index in range(start, stop):
+                self.membership[layer_index * self.stride + (sprite_index >> 3)] |= 1 << (sprite_index & 7)
+        self.original_membership = bytes(self.membership)
+
+        # Tiled layers made (almost) transparent are layers meant to be shown later on, or never.
+        # They become hidden layers of opaque tiles, so showing them is a single flag change.
+        for name in self.layer_names:
+            sprite_list = self.scene[name]
+            if len(sprite_list) and all(sprite.alpha < HIDDEN_ALPHA for sprite in sprite_list):
+                sprite_list.visible = False
+                for sprite in sprite_list:
+                    sprite.alpha = 255
+        self.visible = bytearray(self.scene[name].visible for name in self.layer_names)
+        self.original_visible = bytes(self.visible)
+
+        self.alpha = bytearray(sprite.alpha for sprite in self.sprites)
+        self.original_alpha = bytes(self.alpha)
+
+        # Version of every layer's membership and of the alpha of every layer's original sprites
+        self.layer_versions = array("Q", [0] * len(self.layer_names))
+        self.alpha_versions = array("Q", [0] * len(self.layer_names))
+
+        # Identifies the map layout, so a saved state is never applied to a different map
+        self.signature = zlib.crc32("\n".join(self.layer_names).encode("utf-8"))
+
+        # Surface type of every cell, row after row from the bottom of the map
+        self.surface_layers = surface_layers
+        self.surface_indices = {self.layer_by_name[name] for name, _ in surface_layers}
+        self.cell_size = self.tile_map.tile_width * tile_scaling
+        self.width = self.tile_map.width
+        self.height = self.tile_map.height
+        self.surfaces = bytearray(self.width * self.height)
+        self.surfaces_dirty = True
+
+        # Grids of the cells holding tiles, by layer names: (layer versions, grid)
+        self.cell_grids = {}
+
+        self.enemies = Enemies.from_tiled_map(self.tiled_map, tile_scaling)
+        if len(self.enemies):
+            self.scene.add_sprite_list(ENEMY_LAYER, sprite_list=self.enemies.sprite_list)
+
+    # --- Changes
+
+    def _set_bit(self, layer_index, sprite_index, value):
+        offset = layer_index * self.stride + (sprite_index >> 3)
+        if value:
+            self.membership[offset] |= 1 << (sprite_index & 7)
+        else:
+            self.membership[offset] &= ~(1 << (sprite_index & 7))
+        self.layer_versions[layer_index] = next(_versions)
+        self._touch_surfaces(layer_index)
+
+    def remove_sprite(self, sprite):
+        """Remove a tile sprite from every layer it is in."""
+        sprite_index = self.sprite_index[sprite]
+        for sprite_list in sprite.sprite_lists:
+            layer_index = self.layer_by_list.get(id(sprite_list))
+            if layer_index is not None:
+                self._set_bit(layer_index, sprite_index, False)
+        sprite.remove_from_sprite_lists()
+
+    def _clear_bits(self, layer_index):
+        offset = layer_index * self.stride
+        self.membership[offset:offset + self.stride] = bytes(self.stride)
+        self.layer_versions[layer_index] = next(_versions)
+        self._touch_surfaces(layer_index)
+
+    def clear_layer(self, name):
+        """
+        Remove every sprite of a layer. The layer is emptied at once, removing
+        its sprites one by one searches the whole list for each of them.
+        """
+        sprite_list = self.scene[name]
+        # A sprite in other lists as well leaves them too, like with remove_sprite
+        for sprite in [sprite for sprite in sprite_list if len(sprite.sprite_lists) > 1]:
+            self.remove_sprite(sprite)
+        if len(sprite_list):
+            self._clear_bits(self.layer_by_name[name])
+            sprite_list.clear()
+
+    def move_layer(self, name, destination):
+        """Move every sprite of one layer to the end of another layer, all at once like clear_layer."""
+        sprites = list(self.scene[name])
+        if not sprites:
+            return
+        destination_index = self.layer_by_name[destination]
+        offset = destination_index * self.stride
+        for sprite in sprites:
+            sprite_index = self.sprite_index[sprite]
+            self.membership[offset + (sprite_index >> 3)] |= 1 << (sprite_index & 7)
+        self.layer_versions[destination_index] = next(_versions)
+        self._touch_surfaces(destination_index)
+        self._clear_bits(self.layer_by_name[name])
+        self.scene[name].clear()
+        self.scene[destination].extend(sprites)
+
+    def set_layer_alpha(self, name, alpha):
+        """Set the alpha of every sprite currently in a layer."""
+        for sprite in self.scene[name]:
+            sprite_index = self.sprite_index[sprite]
+            if self.alpha[sprite_index] != alpha:
+                self.alpha[sprite_index] = alpha
+                sprite.alpha = alpha
+                self.alpha_versions[self.origin_layer[sprite_index]] = next(_versions)
+                if self._on_surface(sprite):
+                    self.surfaces_dirty = True
+
+    def unload(self, textures=True):
+        """
+        Tear the level down: every layer and the enemies' list are emptied at
+        once, with their spatial hashes, and the textures of their sprites
+        leave arcade's texture cache unless `textures` is False. Lists the
+        level didn't build, like the players' and the projectiles', are left
+        alone. The level can't be used afterwards.
+        """
+        # Every tile sprite, even those no layer holds anymore, and the enemies
+        names = set()
+        if textures:
+            for sprite in itertools.chain(self.sprites, self.enemies.sprite_list):
+                names.add(sprite.texture.name)
+                names.update(frame.texture.name for frame in getattr(sprite, "frames", ()))
+        for name in self.layer_names:
+            self.scene[name].clear()
+        self.enemies.sprite_list.clear()
+        self.sprites = []
+        self.sprite_index = {}
+        cache = arcade.load_texture.texture_cache
+        for key in [key for key, texture in cache.items() if texture.name in names]:
+            del cache[key]
+
+    # --- Surfaces
+
+    def _touch_surfaces(self, layer_index):
+        """Have the surfaces rebuilt if a layer that makes them changed."""
+        if layer_index in self.surface_indices:
+            self.surfaces_dirty = True
+
+    def _on_surface(self, sprite):
+        """Whether a tile sprite is in a layer that makes surfaces."""
+        return any(self.layer_by_list.get(id(sprite_list)) in self.surface_indices for sprite_list in sprite.sprite_lists)
+
+    def _build_surfaces(self):
+        surfaces = self.surfaces
+        surfaces[:] = bytes(len(surfaces))
+        for name, surface in self.surface_layers:
+            # Hidden tiles, like the frozen water before it freezes, make no surface
+            if not self.visible[self.layer_by_name[name]]:
+                continue
+            for sprite in self.scene[name]:
+                if self.alpha[self.sprite_index[sprite]] >= 128:
+                    col = int(sprite.center_x // self.cell_size)
+                    row = int(sprite.center_y // self.cell_size)
+                    if 0 <= col < self.width and 0 <= row < self.height:
+                        surfaces[row * self.width + col] = surface
+        self.surfaces_dirty = False
+
+    def surface_at(self, x, y):
+        """The surface type (an index in rules.SURFACE_TYPES) of the cell containing a point."""
+        if self.surfaces_dirty:
+            self._build_surfaces()
+        col = int(x // self.cell_size)
+        row = int(y // self.cell_size)
+        if 0 <= col < self.width and 0 <= row < self.height:
+            return self.surfaces[row * self.width + col]
+        return 0
+
+    def surface_under(self, x, bottom):
+        """
+        The surface of feet at (x, bottom): the tiles they are in, like fire,
+        or if those make no surface, the tiles they stand on, like water.
+        """
+        return self.surface_at(x, bottom + 1) or self.surface_at(x, bottom - 1)
+
+    def cell_grid(self, names, border=1):
+        """
+        The cells holding a tile of any of the layers, as a numpy grid indexed
+        [row + 1, col + 1] with a border of `border` around the map, so lookups
+        can clip to it (see Enemies.update). Kept until one of the layers changes.
+        """
+        versions = tuple(self.layer_versions[self.layer_by_name[name]] for name in names)
+        cached = self.cell_grids.get((names, border))
+        if cached is None or cached[0] != versions:
+            grid = np.full((self.height + 2, self.width + 2), border, dtype=np.uint8)
+            grid[1:-1, 1:-1] = 0
+            for name in names:
+                for sprite in self.scene[name]:
+                    col = int(sprite.center_x // self.cell_size)
+                    row = int(sprite.center_y // self.cell_size)
+                    if 0 <= col < self.width and 0 <= row < self.height:
+                        grid[row + 1, col + 1] = 1
+            cached = self.cell_grids[(names, border)] = (versions, grid)
+        return cached[1]
+
+    def set_layer_visible(self, name, visible):
+        """Show or hide a whole layer. Collisions are not affected."""
+        layer_index = self.layer_by_name[name]
+        if self.visible[layer_index] != visible:
+            self.visible[layer_index] = visible
+            self.scene[name].visible = bool(visible)
+            self._touch_surfaces(layer_index)
+
+    def _sync_visible(self):
+        for layer_index, (name, visible) in enumerate(zip(self.layer_names, self.visible)):
+            sprite_list = self.scene[name]
+            if sprite_list.visible != bool(visible):
+                sprite_list.visible = bool(visible)
+                self._touch_surfaces(layer_index)
+
+    # --- Saving and restoring
+
+    def _sync_layer(self, layer_index):
+        """Rebuild a layer's SpriteList from its membership bitset."""
+        offset = layer_index * self.stride
+        sprite_list = self.scene[self.layer_names[layer_index]]
+        sprite_list.clear()
+        sprite_list.extend([self.sprites[index] for index in bit_indices(self.membership[offset:offset + self.stride])])
+        self._touch_surfaces(layer_index)
+
+    def _sync_alpha(self, layer_index):
+        start, stop = self.origin_ranges[layer_index]
+        for sprite, value in zip(self.sprites[start:stop], self.alpha[start:stop]):
+            if sprite.alpha != value:
+                sprite.alpha = value
+                if self._on_surface(sprite):
+                    self.surfaces_dirty = True
+
+    def capture_state(self):
+        """
+        Return the differences between the level's current and original state.
+
+        "layers" maps a layer index to its membership bitset, for the layers whose
+        content changed. "alpha" maps a layer index to the alpha of the sprites that
+        layer was built with: a single byte when they all share one value, one byte
+        per sprite otherwise. "visible" maps a layer index to one byte, 1 if the
+        layer is shown, for the layers that were shown or hidden. "enemies" is
+        the state of the level's enemies, see Enemies.state_bytes.
+        """
+        layers = {}
+        for layer_index in range(len(self.layer_names)):
+            offset = layer_index * self.stride
+            bits = bytes(self.membership[offset:offset + self.stride])
+            if bits != self.original_membership[offset:offset + self.stride]:
+                layers[layer_index] = bits
+
+        alpha = {}
+        for layer_index, (start, stop) in enumerate(self.origin_ranges):
+            values = bytes(self.alpha[start:stop])
+            if values != self.original_alpha[start:stop]:
+                alpha[layer_index] = values[:1] if values.count(values[0]) == len(values) else values
+
+        visible = {
+            layer_index: bytes((value,))
+            for layer_index, (value, original) in enumerate(zip(self.visible, self.original_visible)) if value != original
+        }
+
+        return {"layers": layers, "alpha": alpha, "visible": visible, "enemies": self.enemies.state_bytes()}
+
+    def apply_state(self, state):
+        """
+        Bring the level to a state returned by capture_state. Unchanged layers are left alone.
+        Without "visible", which layers are shown is worked out from their alpha.
+        Raises ValueError, leaving the level as it was, if the state does not fit its layers.
+        """
+        self.check_state(state)
+        layers = state.get("layers", {})
+        for layer_index in range(len(self.layer_names)):
+            offset = layer_index * self.stride
+            bits = layers.get(layer_index, self.original_membership[offset:offset + self.stride])
+            if self.membership[offset:offset + self.stride] != bits:
+                self.membership[offset:offset + self.stride] = bits
+                self.layer_versions[layer_index] = next(_versions)
+                self._sync_layer(layer_index)
+
+        alpha = state.get("alpha", {})
+        visible = state.get("visible")
+        if visible is None:
+            visible, alpha = self._visible_from_alpha(alpha)
+        for layer_index, (start, stop) in enumerate(self.origin_ranges):
+            values = alpha.get(layer_index, self.original_alpha[start:stop])
+            if len(values) == 1:
+                values = values * (stop - start)
+            if self.alpha[start:stop] != values:
+                self.alpha[start:stop] = values
+                self.alpha_versions[layer_index] = next(_versions)
+                self._sync_alpha(layer_index)
+
+        values = bytearray(self.original_visible)
+        for layer_index, value in visible.items():
+            values[layer_index] = value[0]
+        if values != self.visible:
+            self.visible[:] = values
+            self._sync_visible()
+
+        self.enemies.apply_bytes(state.get("enemies", self.enemies.original))
+
+    def check_state(self, state):
+        """Raise ValueError if a layer index or the length of some bytes in a state does not fit this level."""
+        def check_index(layer_index):
+            if not isinstance(layer_index, int) or not 0 <= layer_index < len(self.layer_names):
+                raise ValueError(f"no layer {layer_index!r} in level {self.number}")
+
+        for layer_index, bits in state.get("layers", {}).items():
+            check_index(layer_index)
+            if len(bits) != self.stride:
+                raise ValueError(f"{len(bits)} membership bytes for layer {layer_index}, expected {self.stride}")
+        for layer_index, values in state.get("alpha", {}).items():
+            check_index(layer_index)
+            start, stop = self.origin_ranges[layer_index]
+            # A single value stands for the whole layer
+            if len(values) not in (1, stop - start):
+                raise ValueError(f"{len(values)} alpha values for layer {layer_index}, expected {stop - start}")
+        for layer_index, value in (state.get("visible") or {}).items():
+            check_index(layer_index)
+            if len(value) != 1:
+                raise ValueError(f"{len(value)} visibility bytes for layer {layer_index}, expected 1")
+        if len(state.get("enemies", self.enemies.original)) != self.enemies.nbytes:
+            raise ValueError("the enemies state has the wrong size")
+
+    def _visible_from_alpha(self, alpha):
+        """
+        The "visible" and "alpha" of a state from before layers were shown and
+        hidden (save files before version 3), when an (almost) transparent layer
+        was a hidden one and showing it made its tiles opaque.
+        """
+        visible = {}
+        alpha = dict(alpha)
+        for layer_index, values in list(alpha.items()):
+            if max(values) < HIDDEN_ALPHA:
+                visible[layer_index] = b"\0"
+                del alpha[layer_index]
+            elif not self.original_visible[layer_index]:
+                visible[layer_index] = b"\1"
+        return visible, alpha
+
+    def reset(self):
+        """Put every sprite back where the map originally had it."""
+        self.apply_state({})
+
+    def capture_into(self, snapshot):
+        """Copy the level state into a snapshot's buffers, reallocating them only when their size differs."""
+        if len(snapshot.membership) != len(self.membership):
+            snapshot.membership = bytearray(len(self.membership))
+            snapshot.alpha = bytearray(len(self.alpha))
+            snapshot.layer_versions = array("Q", self.layer_versions)
+            snapshot.alpha_versions = array("Q", self.alpha_versions)
+            snapshot.visible = bytearray(len(self.visible))
+        if len(snapshot.enemies) != len(self.enemies.original):
+            snapshot.enemies = bytearray(len(self.enemies.original))
+        snapshot.membership[:] = self.membership
+        snapshot.alpha[:] = self.alpha
+        snapshot.layer_versions[:] = self.layer_versions
+        snapshot.alpha_versions[:] = self.alpha_versions
+        snapshot.visible[:] = self.visible
+        self.enemies.capture_into(snapshot.enemies)
+
+    def restore_from(self, snapshot):
+        """Restore a state captured with capture_into, only touching layers whose version differs."""
+        for layer_index in range(len(self.layer_names)):
+            if self.layer_versions[layer_index] != snapshot.layer_versions[layer_index]:
+                offset = layer_index * self.stride
+                self.membership[offset:offset + self.stride] = snapshot.membership[offset:offset + self.stride]
+                self.layer_versions[layer_index] = snapshot.layer_versions[layer_index]
+                self._sync_layer(layer_index)
+
+            if self.alpha_versions[layer_index] != snapshot.alpha_versions[layer_index]:
+                start, stop = self.origin_ranges[layer_index]
+                self.alpha[start:stop] = snapshot.alpha[start:stop]
+                self.alpha_versions[layer_index] = snapshot.alpha_versions[layer_index]
+                self._sync_alpha(layer_index)
+
+        if self.visible != snapshot.visible:
+            self.visible[:] = snapshot.visible
+            self._sync_visible()
+
+        self.enemies.restore_from(snapshot.enemies)
@@ -0,0 +1,108 @@
+"""
+Drawing the world at the art's own resolution.
+
+The tiles are 16 pixel images drawn TILE_SCALING times bigger, and so are
+the characters, so the game is really a small pixel art image blown up to
+the window's size: 270x192 art pixels in a 1080x768 window. Drawing it at
+window size fills and blends every art pixel 16 times.
+
+A NativeTarget draws the world into an offscreen framebuffer with one
+pixel per art pixel instead, with the camera snapped to whole art pixels
+so nothing shimmers while scrolling. The framebuffer is then scaled up by
+exactly TILE_SCALING to the window with nearest filtering, and the GUI
+text is drawn over it at full resolution.
+"""
+import math
+from contextlib import contextmanager
+
+import arcade
+
+from constants import TILE_SCALING
+
+VERTEX_SHADER = """
+#version 330
+
+in vec2 in_vert;
+in vec2 in_uv;
+
+out vec2 v_uv;
+
+void main() {
+    gl_Position = vec4(in_vert, 0.0, 1.0);
+    v_uv = in_uv;
+}
+"""
+
+FRAGMENT_SHADER = """
+#version 330
+
+uniform sampler2D image;
+
+in vec2 v_uv;
+
+out vec4 f_color;
+
+void main() {
+    f_color = texture(image, v_uv);
+}
+"""
+
+
+class NativeTarget:
+    """An offscreen framebuffer at art resolution, scaled up to the window."""
+
+    def __init__(self, ctx, width, height, scale=TILE_SCALING):
+        self.ctx = ctx
+        self.scale = scale
+        self.program = ctx.program(vertex_shader=VERTEX_SHADER, fragment_shader=FRAGMENT_SHADER)
+        self.framebuffer = None
+        self.quad = None
+        self.resize(width, height)
+
+    def resize(self, width, height):
+        """Size the framebuffer for a window, rounding up so its last art pixels cover the window's edges."""
+        size = (math.ceil(width / self.scale), math.ceil(height / self.scale))
+        if self.framebuffer is None or self.framebuffer.size != size:
+            texture = self.ctx.texture(size, components=4)
+            texture.filter = self.ctx.NEAREST, self.ctx.NEAREST
+            self.framebuffer = self.ctx.framebuffer(color_attachments=[texture])
+        # The framebuffer scaled up, from the window's lower left corner, in normalized coordinates
+        quad_width = 2 * size[0] * self.scale / width
+        quad_height = 2 * size[1] * self.scale / height
+        self.quad = arcade.gl.geometry.quad_2d((quad_width, quad_height), (quad_width / 2 - 1, quad_height / 2 - 1))
+
+    @contextmanager
+    def activate(self, background_color=(0, 0, 0, 255)):
+        """Draw into the cleared framebuffer inside this block, placing each view with use_view."""
+        projection = self.ctx.projection_2d
+        with self.framebuffer.activate():
+            self.framebuffer.clear(background_color)
+            try:
+                yield self
+            finally:
+                self.ctx.viewport = (0, 0, *self.framebuffer.size)
+                self.ctx.projection_2d = projection
+
+    def use_view(self, camera_x, camera_y=0, x=0, width=None):
+        """
+        Draw to the part of the window from x on and `width` pixels wide, all of
+        it by default, in world coordinates with the view's lower left corner at
+        (camera_x, camera_y) snapped to art pixels. Returns the view as
+        (left, bottom, width, height) in world coordinates.
+        """
+        columns, rows = self.framebuffer.size
+        first = x // self.scale
+        columns = columns - first if width is None else min(math.ceil(width / self.scale), columns - first)
+        left = camera_x - camera_x % self.scale
+        bottom = camera_y - camera_y % self.scale
+        view = (left, bottom, columns * self.scale, rows * self.scale)
+        self.ctx.viewport = (first, 0, columns, rows)
+        self.ctx.projection_2d = (left, left + view[2], bottom, bottom + view[3])
+        return view
+
+    def draw(self):
+        """Scale the framebuffer up to the window."""
+        self.ctx.disable(self.ctx.BLEND)
+        self.framebuffer.color_attachments[0].use(0)
+        self.quad.render(self.program)
+        self.ctx.enable(self.ctx.BLEND)
@@ -0,0 +1,484 @@
+"""
+Navigation for the computer-controlled character of single-player mode.
+
+A NavGraph holds, for one character, every cell it can stand in and the
+moves between them: walking to the next cell, walking off ledges, and jump
+arcs with PLAYER_JUMP_SPEED and GRAVITY, holding a direction from different
+ticks on. Moves are found by simulating them on the level's tile grid, with
+the character's own walls (only Fire Knight passes through Water Wall, only
+Water Priestess stands on Water...).
+
+When levers or attacks remove layers the graph is updated, not rebuilt: only
+the cells near what changed are checked again, and only the moves whose
+simulation came near it are simulated again.
+
+Paths are found with A* over move durations in ticks, and are cached until
+the graph changes. A Follower plays one character along those paths.
+
+    python navigation.py [--level N]
+"""
+import argparse
+import heapq
+import math
+import time
+
+from constants import (
+    BUTTON_ATTACK, BUTTON_JUMP, BUTTON_LEFT, BUTTON_RIGHT, GRAVITY, GRID_PIXEL_SIZE, PLAYER_JUMP_SPEED,
+    PLAYER_MOVEMENT_SPEED,
+)
+from rules import LEVEL_RULES, PLAYER_BOXES, fired_triggers, wall_layers
+from tilegrid import TileGrid
+
+# Longest time a move may spend in the air
+MAX_MOVE_TICKS = 120
+# Ticks a walk to the next cell holds the direction for
+WALK_TICKS = math.ceil(GRID_PIXEL_SIZE / PLAYER_MOVEMENT_SPEED)
+# The moves tried from every cell: (direction, jump, ticks before holding the direction, ticks to hold it or None)
+MOVES = (
+    (-1, False, 0, WALK_TICKS), (1, False, 0, WALK_TICKS), (0, True, 0, None),
+) + tuple(
+    (direction, True, delay, hold)
+    for direction in (-1, 1)
+    for delay, hold in ((0, None), (0, WALK_TICKS), (0, 2 * WALK_TICKS), (12, None), (24, None))
+)
+
+
+class Body:
+    """
+    One character moving on a tile grid, with the physics of VecCoopEnv plus
+    arcade's climbing onto low ledges: every tile is a full cell, and outside
+    the map it is solid to the left, right and below.
+    """
+
+    def __init__(self, solid, width, height, box, x, y):
+        self.solid = solid
+        self.width = width
+        self.height = height
+        self.left_offset, self.right_offset, self.bottom_offset, self.top_offset = box
+        self.x = x
+        self.y = y
+        self.change_y = 0
+        self.grounded = True
+        # Cells the box went through, (min col, max col, min row, max row)
+        self.bounds = [width, -1, height, -1]
+
+    def _is_solid(self, col, row):
+        if col < 0 or col >= self.width or row < 0:
+            return True
+        if row >= self.height:
+            return False
+        return self.solid[row * self.width + col] == 1
+
+    def _hits(self, left, right, bottom, top):
+        """Solid cells a box overlaps, as (col, row)."""
+        size = GRID_PIXEL_SIZE
+        col0, col1 = int(left // size), math.ceil(right / size) - 1
+        row0, row1 = int(bottom // size), math.ceil(top / size) - 1
+        bounds = self.bounds
+        bounds[0], bounds[1] = min(bounds[0], col0), max(bounds[1], col1)
+        bounds[2], bounds[3] = min(bounds[2], row0), max(bounds[3], row1)
+        return [
+            (col, row) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1) if self._is_solid(col, row)
+        ]
+
+    def step(self, direction, jump):
+        size = GRID_PIXEL_SIZE
+        change_x = direction * PLAYER_MOVEMENT_SPEED
+        if jump and self.grounded:
+            self.change_y = PLAYER_JUMP_SPEED
+        self.x = min(self.x, self.width * size - self.right_offset)
+
+        self.change_y = max(self.change_y - GRAVITY, 1 - size)
+        self.y += self.change_y
+        hits = self._hits(self.x + self.left_offset, self.x + self.right_offset,
+                          self.y + self.bottom_offset, self.y + self.top_offset)
+        if hits:
+            if self.change_y <= 0:
+                self.y = (max(row for _, row in hits) + 1) * size - self.bottom_offset
+            else:
+                self.y = min(row for _, row in hits) * size - self.top_offset
+            self.change_y = 0
+
+        self.x += change_x
+        hits = self._hits(self.x + self.left_offset, self.x + self.right_offset,
+                          self.y + self.bottom_offset, self.y + self.top_offset)
+        if hits and change_x:
+            # Like arcade's ramp_up, running into a ledge less than a step high climbs onto it
+            lift = abs(change_x)
+            if not self._hits(self.x + self.left_offset, self.x + self.right_offset,
+                              self.y + lift + self.bottom_offset, self.y + lift + self.top_offset):
+                while lift > 1 and not self._hits(self.x + self.left_offset, self.x + self.right_offset,
+                                                  self.y + lift - 1 + self.bottom_offset, self.y + lift - 1 + self.top_offset):
+                    lift -= 1
+                self.y += lift
+                hits = []
+        if hits:
+            if change_x > 0:
+                self.x = min(col for col, _ in hits) * size - self.right_offset
+            elif change_x < 0:
+                self.x = (max(col for col, _ in hits) + 1) * size - self.left_offset
+
+        bottom = self.y + self.bottom_offset
+        self.grounded = bool(self._hits(self.x + self.left_offset, self.x + self.right_offset, bottom - 5, bottom))
+
+
+def touches(grid, layer, left, right, bottom, top):
+    """Whether a box overlaps a cell of a layer."""
+    col0, col1 = int(left // GRID_PIXEL_SIZE), math.ceil(right / GRID_PIXEL_SIZE) - 1
+    row0, row1 = int(bottom // GRID_PIXEL_SIZE), math.ceil(top / GRID_PIXEL_SIZE) - 1
+    return any(grid.has_tile(layer, col, row) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1))
+
+
+def move_buttons(move, tick):
+    """Buttons to hold on a tick of a move."""
+    direction, jump, delay, hold = move
+    buttons = BUTTON_JUMP if jump and tick == 0 else 0
+    if direction and tick >= delay and (hold is None or tick < delay + hold):
+        buttons |= BUTTON_RIGHT if direction > 0 else BUTTON_LEFT
+    return buttons
+
+
+class NavGraph:
+    """Cells one character can stand in, and the moves between them."""
+
+    def __init__(self, grid, level, player, fired=0):
+        self.grid = grid
+        self.level = level
+        self.player = player
+        self.fired = fired
+        self.box = PLAYER_BOXES[player]
+        self.solid = grid.union(wall_layers(level, player, fired))
+
+        # Node (col, row) -> list of edges (target node, ticks, move)
+        self.edges = {}
+        # Node -> cells its moves' simulations went through, to know which to redo after a change
+        self.bounds = {}
+        # (start, goal) -> path and layer -> goal nodes, until the graph changes
+        self.paths = {}
+        self.goals = {}
+        self.version = 0
+
+        nodes = [
+            (col, row) for row in range(grid.height) for col in range(grid.width) if self.standable(col, row)
+        ]
+        for node in nodes:
+            self.edges[node] = []
+        for node in nodes:
+            self._find_moves(node)
+
+    # --- Building
+
+    def position(self, node):
+        """Where the character stands in a node: centered on the cell, its feet at the bottom of it."""
+        col, row = node
+        return col * GRID_PIXEL_SIZE + GRID_PIXEL_SIZE / 2, row * GRID_PIXEL_SIZE - self.box[2]
+
+    def node_at(self, x, y):
+        """The node of a standing character, or None."""
+        node = (int(x // GRID_PIXEL_SIZE), round((y + self.box[2]) / GRID_PIXEL_SIZE))
+        return node if node in self.edges else None
+
+    def _body(self, node):
+        return Body(self.solid, self.grid.width, self.grid.height, self.box, *self.position(node))
+
+    def standable(self, col, row):
+        body = self._body((col, row))
+        left, right = body.x + body.left_offset, body.x + body.right_offset
+        bottom, top = body.y + body.bottom_offset, body.y + body.top_offset
+        return not body._hits(left, right, bottom, top) and bool(body._hits(left, right, bottom - 5, bottom))
+
+    def _find_moves(self, node):
+        best = {}
+        bounds = [self.grid.width, -1, self.grid.height, -1]
+        for move in MOVES:
+            body = self._body(node)
+            target = None
+            for tick in range(MAX_MOVE_TICKS):
+                buttons = move_buttons(move, tick)
+                direction = (1 if buttons & BUTTON_RIGHT else 0) - (1 if buttons & BUTTON_LEFT else 0)
+                body.step(direction, buttons & BUTTON_JUMP)
+                if body.grounded and body.change_y == 0 and tick + 1 >= (move[3] or 0) + move[2]:
+                    target = (tick + 1, self.node_at(body.x, body.y))
+                    break
+            bounds = [min(bounds[0], body.bounds[0]), max(bounds[1], body.bounds[1]),
+                      min(bounds[2], body.bounds[2]), max(bounds[3], body.bounds[3])]
+            if target is None or target[1] is None or target[1] == node:
+                continue
+            ticks, target_node = target
+            if target_node not in best or ticks < best[target_node][1]:
+                best[target_node] = (target_node, ticks, move)
+        self.edges[node] = list(best.values())
+        self.bounds[node] = bounds
+
+    # --- Changes
+
+    def copy(self):
+        """A graph that can be updated without changing this one."""
+        graph = NavGraph.__new__(NavGraph)
+        graph.__dict__.update(self.__dict__)
+        graph.edges = dict(self.edges)
+        graph.bounds = dict(self.bounds)
+        graph.paths = {}
+        graph.goals = {}
+        return graph
+
+    def update(self, fired):
+        """Follow a change of the fired triggers, redoing only what the changed cells can affect."""
+        if fired == self.fired:
+            return
+        solid = self.grid.union(wall_layers(self.level, self.player, fired))
+        width = self.grid.width
+        changed = [index for index, (old, new) in enumerate(zip(self.solid, solid)) if old != new]
+        self.solid = solid
+        self.fired = fired
+        if not changed:
+            return
+        self.paths.clear()
+        self.goals.clear()
+        self.version += 1
+
+        cols = [index % width for index in changed]
+        rows = [index // width for index in changed]
+        # Cells whose standing box or the floor under it contains a changed cell
+        reach_x = math.ceil(max(-self.box[0], self.box[1]) / GRID_PIXEL_SIZE) + 1
+        reach_y = math.ceil((self.box[3] - self.box[2]) / GRID_PIXEL_SIZE) + 1
+        min_col, max_col = min(cols) - reach_x, max(cols) + reach_x
+        min_row, max_row = min(rows) - reach_y, max(rows) + 1
+
+        redo = set()
+        for row in range(max(0, min_row), min(self.grid.height, max_row + 1)):
+            for col in range(max(0, min_col), min(width, max_col + 1)):
+                node = (col, row)
+                standable = self.standable(col, row)
+                if standable and node not in self.edges:
+                    self.edges[node] = []
+                    redo.add(node)
+                elif not standable and node in self.edges:
+                    del self.edges[node]
+                    del self.bounds[node]
+
+        # Moves whose simulation went through a changed cell
+        for node, (col0, col1, row0, row1) in self.bounds.items():
+            if col0 <= max(cols) and min(cols) <= col1 and row0 <= max(rows) and min(rows) <= row1:
+                redo.add(node)
+        for node in redo:
+            self._find_moves(node)
+        # Moves into nodes that are gone
+        for node, edges in self.edges.items():
+            if any(edge[0] not in self.edges for edge in edges):
+                self.edges[node] = [edge for edge in edges if edge[0] in self.edges]
+
+    # --- Paths
+
+    def goal_nodes(self, layer):
+        """Nodes where the character's box overlaps a layer."""
+        if layer not in self.goals:
+            goals = []
+            for node in self.edges:
+                x, y = self.position(node)
+                if touches(self.grid, layer, x + self.box[0], x + self.box[1], y + self.box[2], y + self.box[3]):
+                    goals.append(node)
+            self.goals[layer] = goals
+        return self.goals[layer]
+
+    def find_path(self, start, goals, key=None):
+        """
+        The fastest list of edges from start to any of the goal nodes, or None.
+        Results are cached by (start, key) until the graph changes.
+        """
+        cache_key = (start, key if key is not None else tuple(goals))
+        if cache_key in self.paths:
+            return self.paths[cache_key]
+
+        goals = set(goals)
+        goal_cols = sorted({col for col, _ in goals})
+        ticks_per_col = GRID_PIXEL_SIZE / PLAYER_MOVEMENT_SPEED
+
+        def estimate(node):
+            # Never more than the real cost: moving a column takes at least this many ticks
+            distance = min(abs(node[0] - col) for col in goal_cols) if goal_cols else 0
+            return max(0, distance - 1) * ticks_per_col
+
+        path = None
+        came_from = {start: None}
+        cost = {start: 0}
+        queue = [(estimate(start), 0, start)]
+        while queue:
+            _, ticks, node = heapq.heappop(queue)
+            if node in goals:
+                path = []
+                while came_from[node] is not None:
+                    node, edge = came_from[node]
+                    path.append(edge)
+                path.reverse()
+                break
+            if ticks > cost[node]:
+                continue
+            for edge in self.edges.get(node, ()):
+                target, edge_ticks, _ = edge
+                new_cost = ticks + edge_ticks
+                if new_cost < cost.get(target, math.inf):
+                    cost[target] = new_cost
+                    came_from[target] = (node, edge)
+                    heapq.heappush(queue, (new_cost + estimate(target), new_cost, target))
+
+        self.paths[cache_key] = path
+        return path
+
+
+class Follower:
+    """
+    Plays one character of a World: fires its own trigger (lever or special
+    attack), goes to the exit once the other player is there, and otherwise
+    follows the other player around.
+    """
+
+    def __init__(self, world, player):
+        self.world = world
+        self.player = player
+        # (level, fired) -> NavGraph
+        self.graphs = {}
+        self.move = None
+        self.move_tick = 0
+        self.move_ticks = 0
+        self.last_buttons = 0
+
+    def graph(self):
+        level = self.world.current_level
+        fired = fired_triggers(level, self.world.scene)
+        if (level, fired) not in self.graphs:
+            self.prepare(level)
+        return self.graphs[(level, fired)]
+
+    def prepare(self, level):
+        """
+        Build the graphs of a level for every combination of fired triggers up
+        front, each one updated from the previous one, so no graph is built mid-game.
+        """
+        grid = TileGrid.from_map(LEVEL_RULES[level]["map"])
+        graph = NavGraph(grid, level, self.player)
+        self.graphs[(level, 0)] = graph
+        for fired in range(1, 1 << len(LEVEL_RULES[level]["triggers"])):
+            graph = graph.copy()
+            graph.update(fired)
+            self.graphs[(level, fired)] = graph
+
+    def buttons(self):
+        """The buttons to hold this tick."""
+        self.last_buttons = self._choose_buttons()
+        return self.last_buttons
+
+    def _choose_buttons(self):
+        world = self.world
+        if world.game_end:
+            return 0
+        if world.between_levels:
+            # Build the graphs while the chapter screen is shown
+            if (world.current_level, 0) not in self.graphs:
+                self.prepare(world.current_level)
+            return 0
+        sprites = (world.player_sprite_1, world.player_sprite_2)
+        me, other = sprites[self.player], sprites[1 - self.player]
+
+        # Finish the move under way: it ends when landing after its planned duration
+        if self.move is not None:
+            self.move_tick += 1
+            if self.move_tick < self.move_ticks or (me.change_y != 0 and self.move_tick < MAX_MOVE_TICKS):
+                return move_buttons(self.move, self.move_tick)
+            self.move = None
+
+        # An attack is under way
+        if not me.can_update_state:
+            return 0
+
+        graph = self.graph()
+        start = graph.node_at(me.center_x, me.center_y)
+        if start is None or me.change_y != 0:
+            return 0
+
+        # Choose where to go
+        level = world.current_level
+        fired = graph.fired
+        goal_key = None
+        attack = False
+        for index, (player, layer, needs_attack, _, _) in enumerate(LEVEL_RULES[level]["triggers"]):
+            if player == self.player and not fired & (1 << index):
+                goal_key, attack = layer, needs_attack
+        if goal_key is not None and graph.find_path(start, graph.goal_nodes(goal_key), goal_key) is None:
+            goal_key = None
+        if goal_key is None:
+            if touches(graph.grid, "Exit", other.left, other.right, other.bottom, other.top):
+                goal_key = "Exit"
+            else:
+                other_node = (int(other.center_x // GRID_PIXEL_SIZE), round(other.bottom / GRID_PIXEL_SIZE))
+                # Follow, stopping a little behind
+                if abs(other_node[0] - start[0]) <= 2:
+                    return 0
+                goals = [node for node in graph.edges if node[0] == other_node[0]] or [other_node]
+                path = graph.find_path(start, goals, ("follow", other_node[0]))
+                return self._start(path[0][2] if path else None)
+
+        goals = graph.goal_nodes(goal_key)
+        if start in goals:
+            if attack:
+                # Face the middle of the target's tiles, then attack
+                cells = graph.grid.cells(goal_key)
+                target_x = (sum(col for col, _ in cells) / len(cells) + 0.5) * GRID_PIXEL_SIZE
+                if target_x > me.center_x and not me.facing_right:
+                    return BUTTON_RIGHT
+                if target_x < me.center_x and me.facing_right:
+                    return BUTTON_LEFT
+                return BUTTON_ATTACK if not self.last_buttons & BUTTON_ATTACK else 0
+            return 0
+        path = graph.find_path(start, goals, goal_key)
+        return self._start(path[0][2] if path else None)
+
+    def _start(self, move):
+        if move is None:
+            return 0
+        self.move = move
+        self.move_tick = 0
+        self.move_ticks = move[2] + (move[3] or 1)
+        return move_buttons(move, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the navigation graphs of a level and report their size and cost.")
+    parser.add_argument("--level", type=int, default=1)
+    args = parser.parse_args()
+
+    grid = TileGrid.from_map(LEVEL_RULES[args.level]["map"])
+    triggers = LEVEL_RULES[args.level]["triggers"]
+    for player in (0, 1):
+        start = time.perf_counter()
+        graph = NavGraph(grid, args.level, player)
+        built = time.perf_counter() - start
+        edges = sum(len(edges) for edges in graph.edges.values())
+        print(f"player {player + 1}: {len(graph.edges)} nodes, {edges} moves, built in {built * 1000:.0f} ms")
+
+        for index in range(len(triggers)):
+            fired = graph.fired | (1 << index)
+            start = time.perf_counter()
+            graph.update(fired)
+            updated = time.perf_counter() - start
+            rebuilt = NavGraph(grid, args.level, player, fired)
+            same = rebuilt.edges == graph.edges
+            print(f"  trigger {index} fired: updated in {updated * 1000:.0f} ms,"
+                  f" {'same as' if same else 'DIFFERENT from'} a full rebuild")
+
+        nodes = sorted(graph.edges)
+        goals = graph.goal_nodes("Exit")
+        start = time.perf_counter()
+        paths = [graph.find_path(node, goals, "Exit") for node in nodes]
+        searched = time.perf_counter() - start
+        start = time.perf_counter()
+        for node in nodes:
+            graph.find_path(node, goals, "Exit")
+        cached = time.perf_counter() - start
+        reachable = sum(path is not None for path in paths)
+        print(f"  A* to the exit from every node: {reachable}/{len(nodes)} reachable,"
+              f" {searched / len(nodes) * 1e6:.0f} us per search, {cached / len(nodes) * 1e6:.2f} us cached")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""
+Online co-op over UDP with input delay and rollback.
+
+Both clients simulate the whole World. Every tick each client sends its own
+buttons to the other one, scheduled `input_delay` ticks into the future to
+hide most of the latency. When the other player's buttons for a tick have
+not arrived yet, they are predicted to be the last ones received. When they
+do arrive and differ from the prediction, the World is restored from the
+snapshot before that tick and the ticks since are simulated again.
+
+Packets repeat every input the peer has not acknowledged yet, so a lost
+packet costs nothing as long as a later one arrives. They also carry the
+checksum of the last tick simulated with confirmed inputs, to detect desyncs.
+
+A relay that forwards packets between two clients over loopback with added
+latency, jitter and loss is included for testing:
+
+    python netplay.py relay --latency 60 --jitter 15 --loss 0.05
+    python main.py --net-port 7101 --peer 127.0.0.1:7000 --player 1
+    python main.py --net-port 7102 --peer 127.0.0.1:7001 --player 2
+
+`python netplay.py loopback` runs both clients headless in one process
+through the relay and reports rollbacks, CPU time and bandwidth.
+"""
+import argparse
+import heapq
+import random
+import select
+import socket
+import struct
+import threading
+import time
+
+from snapshot import SnapshotRing
+
+PACKET_MAGIC = b"FK"
+PACKET_VERSION = 1
+# magic, version, ack, first input tick, input count, checksum tick, checksum
+_PACKET = struct.Struct("<2sBIIBII")
+# Most inputs repeated in one packet
+MAX_INPUTS_PER_PACKET = 64
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class UdpTransport:
+    """A non-blocking UDP socket talking to one peer."""
+
+    def __init__(self, local_port, peer, host="0.0.0.0"):
+        self.peer = peer
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, local_port))
+        self.socket.setblocking(False)
+        self.bytes_sent = 0
+        self.packets_sent = 0
+
+    def send(self, data):
+        try:
+            self.socket.sendto(data, self.peer)
+        except OSError:
+            return
+        self.bytes_sent += len(data)
+        self.packets_sent += 1
+
+    def receive(self):
+        packets = []
+        while True:
+            try:
+                data, _ = self.socket.recvfrom(2048)
+            except (BlockingIOError, ConnectionResetError):
+                return packets
+            packets.append(data)
+
+    def close(self):
+        self.socket.close()
+
+
+class RollbackSession:
+    """
+    Drives a World from the local player's buttons and the buttons received
+    from the peer. Call advance() once per frame.
+    """
+
+    def __init__(self, world, local_player, transport, input_delay=2, max_rollback=8):
+        self.world = world
+        self.local_player = local_player
+        self.transport = transport
+        self.input_delay = input_delay
+        self.max_rollback = max_rollback
+        self.ring = SnapshotRing(max_rollback + 2)
+
+        # Buttons by tick. Nobody has input for the first input_delay ticks.
+        self.local_inputs = {tick: 0 for tick in range(1, input_delay + 1)}
+        self.remote_inputs = dict(self.local_inputs)
+        self.predicted = {}
+
+        # Last tick for which all remote input arrived, and the last tick the peer acknowledged
+        self.remote_confirmed = input_delay
+        self.remote_ack = 0
+        # Earliest tick whose prediction turned out wrong
+        self.rollback_tick = None
+        # Last tick simulated with confirmed input on both sides, and the checksums of such ticks
+        self.confirmed_tick = 0
+        self.checksums = {}
+        self.remote_checksum = (0, 0)
+        self.desynced_tick = None
+
+        # Statistics
+        self.rollbacks = 0
+        self.resimulated_ticks = 0
+        self.max_resimulated = 0
+        self.stalls = 0
+
+        self.world.tick = 0
+        self.ring.capture(self.world)
+
+    @property
+    def latest_local_tick(self):
+        return self.world.tick + self.input_delay
+
+    def advance(self, buttons):
+        """Simulate the next tick with the local player's buttons. Returns False when waiting for the peer."""
+        self._receive()
+
+        if self.rollback_tick is not None:
+            self._rollback(self.rollback_tick)
+            self.rollback_tick = None
+
+        # Never run further ahead of the peer than we can roll back
+        next_tick = self.world.tick + 1
+        if next_tick - self.remote_confirmed > self.max_rollback:
+            self.stalls += 1
+            self._send()
+            return False
+
+        self.local_inputs[next_tick + self.input_delay] = buttons
+        self._simulate(next_tick)
+        self._confirm()
+        self._send()
+        self._forget(next_tick - len(self.ring.snapshots) - self.input_delay)
+        return True
+
+    def _buttons(self, tick):
+        remote = self.remote_inputs.get(tick)
+        if remote is None:
+            # Predict the peer keeps holding the last buttons we know of
+            remote = self.remote_inputs[self.remote_confirmed]
+            self.predicted[tick] = remote
+        local = self.local_inputs[tick]
+        return (local, remote) if self.local_player == 1 else (remote, local)
+
+    def _simulate(self, tick):
+        self.world.update(*self._buttons(tick))
+        self.ring.capture(self.world)
+
+    def _rollback(self, tick):
+        current = self.world.tick
+
+        # Sounds were already played the first time these ticks were simulated, and restoring
+        # the snapshot from before them may set up a level again
+        sound_handler, self.world.sound_handler = self.world.sound_handler, None
+        try:
+            self.ring.restore(self.world, tick - 1)
+            for resimulated in range(tick, current + 1):
+                self.predicted.pop(resimulated, None)
+                self._simulate(resimulated)
+        finally:
+            self.world.sound_handler = sound_handler
+
+        count = current - tick + 1
+        self.rollbacks += 1
+        self.resimulated_ticks += count
+        self.max_resimulated = max(self.max_resimulated, count)
+
+    def _confirm(self):
+        confirmed = min(self.world.tick, self.remote_confirmed)
+        for tick in range(self.confirmed_tick + 1, confirmed + 1):
+            self.checksums[tick] = self.ring.get(tick).checksum()
+        self.confirmed_tick = max(self.confirmed_tick, confirmed)
+        self._check_desync()
+
+    def _check_desync(self):
+        tick, checksum = self.remote_checksum
+        if tick in self.checksums and self.checksums[tick] != checksum and self.desynced_tick is None:
+            self.desynced_tick = tick
+
+    def _send(self):
+        first = max(self.remote_ack + 1, self.latest_local_tick - MAX_INPUTS_PER_PACKET + 1, 1)
+        inputs = bytes(self.local_inputs[tick] for tick in range(first, self.latest_local_tick + 1))
+        checksum_tick = self.confirmed_tick
+        header = _PACKET.pack(
+            PACKET_MAGIC, PACKET_VERSION, self.remote_confirmed, first, len(inputs),
+            checksum_tick, self.checksums.get(checksum_tick, 0),
+        )
+        self.transport.send(header + inputs)
+
+    def _receive(self):
+        for data in self.transport.receive():
+            if len(data) < _PACKET.size:
+                continue
+            magic, version, ack, first, count, checksum_tick, checksum = _PACKET.unpack_from(data)
+            if magic != PACKET_MAGIC or version != PACKET_VERSION or len(data) != _PACKET.size + count:
+                continue
+
+            self.remote_ack = max(self.remote_ack, ack)
+            if checksum_tick > self.remote_checksum[0]:
+                self.remote_checksum = (checksum_tick, checksum)
+
+            for offset, buttons in enumerate(data[_PACKET.size:]):
+                tick = first + offset
+                if tick <= self.remote_confirmed or tick in self.remote_inputs:
+                    continue
+                self.remote_inputs[tick] = buttons
+                if tick in self.predicted and self.predicted[tick] != buttons:
+                    self.rollback_tick = tick if self.rollback_tick is None else min(self.rollback_tick, tick)
+
+            while self.remote_confirmed + 1 in self.remote_inputs:
+                self.remote_confirmed += 1
+
+    def _forget(self, tick):
+        """Drop inputs too old to ever be needed again."""
+        for inputs in (self.local_inputs, self.remote_inputs, self.predicted, self.checksums):
+            # Local inputs are kept until the peer acknowledges them, they may have to be sent again
+            limit = min(tick, self.remote_ack + 1) if inputs is self.local_inputs else tick
+            for old in [old for old in inputs if old < limit and old != self.remote_confirmed]:
+                del inputs[old]
+
+
+class LossyRelay:
+    """
+    Forwards UDP packets between two clients on this machine, adding latency,
+    jitter and loss. Client A sends to port_a and receives from it, client B the same with port_b.
+    """
+
+    def __init__(self, port_a, client_a, port_b, client_b, latency=0.0, jitter=0.0, loss=0.0, seed=None):
+        self.sockets = []
+        for port in (port_a, port_b):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", port))
+            sock.setblocking(False)
+            self.sockets.append(sock)
+        self.clients = (client_a, client_b)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.queue = []
+        self.sequence = 0
+        self.forwarded = 0
+        self.dropped = 0
+        self.running = False
+
+    def _schedule(self, data, destination):
+        if self.random.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        self.sequence += 1
+        heapq.heappush(self.queue, (time.perf_counter() + delay, self.sequence, data, destination))
+
+    def run(self):
+        self.running = True
+        while self.running:
+            timeout = 0.01
+            if self.queue:
+                timeout = max(0.0, min(timeout, self.queue[0][0] - time.perf_counter()))
+            readable, _, _ = select.select(self.sockets, [], [], timeout)
+            for index, sock in enumerate(self.sockets):
+                if sock not in readable:
+                    continue
+                while True:
+                    try:
+                        data, _ = sock.recvfrom(2048)
+                    except (BlockingIOError, ConnectionResetError):
+                        break
+                    # Packets coming in on A's port go out to B through B's port, and the other way around
+                    self._schedule(data, 1 - index)
+
+            now = time.perf_counter()
+            while self.queue and self.queue[0][0] <= now:
+                _, _, data, destination = heapq.heappop(self.queue)
+                self.sockets[destination].sendto(data, self.clients[destination])
+                self.forwarded += 1
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        for sock in self.sockets:
+            sock.close()
+
+
+def run_loopback(args):
+    """Run two headless clients against each other through a LossyRelay."""
+    from bench import new_world, scripted_buttons
+
+    relay = LossyRelay(args.relay_port, ("127.0.0.1", args.relay_port + 101), args.relay_port + 1,
+                       ("127.0.0.1", args.relay_port + 102), args.latency / 1000, args.jitter / 1000, args.loss, seed=1)
+    relay.start()
+
+    sessions = []
+    for player in (1, 2):
+        transport = UdpTransport(args.relay_port + 100 + player, ("127.0.0.1", args.relay_port + player - 1), "127.0.0.1")
+        sessions.append(RollbackSession(new_world(), player, transport, args.input_delay, args.max_rollback))
+
+    inputs = scripted_buttons(args.ticks)
+    frame_time = 1 / 60
+    advance_times = []
+    start = time.perf_counter()
+    frame = 0
+    while min(session.confirmed_tick for session in sessions) < args.ticks:
+        for index, session in enumerate(sessions):
+            buttons = inputs[session.world.tick][index] if session.world.tick < args.ticks else 0
+            begin = time.perf_counter()
+            session.advance(buttons)
+            advance_times.append(time.perf_counter() - begin)
+        frame += 1
+        # Keep a 60 Hz frame rate, like the window does
+        time.sleep(max(0.0, start + frame * frame_time - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    relay.stop()
+
+    advance_times.sort()
+    print(f"{args.ticks} ticks, latency {args.latency} ms, jitter {args.jitter} ms, loss {args.loss:.0%},"
+          f" input delay {args.input_delay}, max rollback {args.max_rollback}")
+    print(f"relay: {relay.forwarded} packets forwarded, {relay.dropped} dropped")
+    for index, session in enumerate(sessions):
+        bandwidth = session.transport.bytes_sent / elapsed
+        print(f"player {index + 1}: {session.rollbacks} rollbacks, {session.resimulated_ticks} ticks re-simulated"
+              f" (at most {session.max_resimulated} in a frame), {session.stalls} stalls,"
+              f" {bandwidth:.0f} B/s sent ({session.transport.bytes_sent / max(1, session.transport.packets_sent):.1f} B/packet)")
+    print(f"advance(): mean {sum(advance_times) / len(advance_times) * 1000:.2f} ms,"
+          f" p99 {advance_times[int(len(advance_times) * 0.99)] * 1000:.2f} ms, max {advance_times[-1] * 1000:.2f} ms")
+
+    checksums = [session.checksums.get(args.ticks) for session in sessions]
+    desyncs = [session.desynced_tick for session in sessions if session.desynced_tick is not None]
+    if checksums[0] != checksums[1] or desyncs:
+        print(f"DESYNC: checksums at tick {args.ticks}: {checksums}, desynced ticks: {desyncs}")
+        return 1
+    print(f"in sync at tick {args.ticks}, checksum {checksums[0]:08x}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("relay", "loopback"):
+        command = subparsers.add_parser(name)
+        command.add_argument("--latency", type=float, default=60, help="one-way latency in milliseconds")
+        command.add_argument("--jitter", type=float, default=15, help="latency varies by up to this many milliseconds")
+        command.add_argument("--loss", type=float, default=0.05, help="fraction of packets dropped")
+        if name == "relay":
+            command.add_argument("--port-a", type=int, default=7000)
+            command.add_argument("--client-a", type=parse_address, default=("127.0.0.1", 7101))
+            command.add_argument("--port-b", type=int, default=7001)
+            command.add_argument("--client-b", type=parse_address, default=("127.0.0.1", 7102))
+        else:
+            command.add_argument("--ticks", type=int, default=600)
+            command.add_argument("--input-delay", type=int, default=2)
+            command.add_argument("--max-rollback", type=int, default=8)
+            command.add_argument("--relay-port", type=int, default=7200)
+
+    args = parser.parse_args()
+    if args.command == "relay":
+        relay = LossyRelay(args.port_a, args.client_a, args.port_b, args.client_b,
+                           args.latency / 1000, args.jitter / 1000, args.loss)
+        print(f"relaying {args.port_a} <-> {args.client_b} and {args.port_b} <-> {args.client_a}")
+        try:
+            relay.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            relay.close()
+        return 0
+    return run_loopback(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
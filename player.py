@@ -0,0 +1,93 @@
+import arcade
+
+from assets import load_texture_pair
+from constants import PLAYER_FRAME_TICKS, PLAYER_STATES
+
+# Animations already loaded, by character directory
+_animations = {}
+
+
+class Animations:
+    """
+    The frames of every animation state of one character, built once when its
+    textures are loaded. Everything is indexed by the state's position in
+    PLAYER_STATES, so switching state only swaps references to these tuples.
+    """
+
+    def __init__(self, texture_dict, frame_ticks=PLAYER_FRAME_TICKS):
+        self.index = {state: index for index, state in enumerate(PLAYER_STATES)}
+        self.frames = tuple(tuple(pair[0] for pair in texture_dict[state]) for state in PLAYER_STATES)
+        self.mirrored = tuple(tuple(pair[1] for pair in texture_dict[state]) for state in PLAYER_STATES)
+        self.frame_ticks = tuple(frame_ticks)
+
+
+def load_textures(path):
+    animations = _animations.get(path)
+    if animations is None:
+        texture_dict = {state: [] for state in PLAYER_STATES}
+        for state in texture_dict.keys():
+            frame_index = 1
+            while True:
+                try:
+                    texture = load_texture_pair(f"{path}/{state}/{state}_{frame_index}.png")
+                    texture_dict[state].append(texture)
+                    frame_index += 1
+                except FileNotFoundError:
+                    break
+        animations = _animations[path] = Animations(texture_dict)
+    return animations
+
+
+class Player(arcade.Sprite):
+    def __init__(self, animations, state="idle", scale=1.0):
+        super().__init__(texture=animations.frames[animations.index["idle"]][0], scale=scale)
+        self.animations = animations
+        self._switch(state)
+        self.current_frame = 0
+        self.texture_change_tick = 0
+        self.facing_right = True
+        self.physics_engine = None
+        self.on_special_surface = False
+        self.can_update_state = True
+        self.hit_object = False
+
+    def _switch(self, state):
+        index = self.animations.index[state]
+        self.state = state
+        self.textures = self.animations.frames[index]
+        self.textures_mirrored = self.animations.mirrored[index]
+        self.texture_change_rate = self.animations.frame_ticks[index]
+
+    def update_state(self, state):
+        # Asking for the state the player is already in keeps its animation going
+        if self.can_update_state and state != self.state:  # Check if the state can be updated
+            self._switch(state)
+            self.current_frame = 0
+
+    def restore_state(self, state, current_frame, texture_change_tick):
+        """Set the animation state and frame directly, e.g. when loading a saved game."""
+        self._switch(state)
+        self.current_frame = current_frame % len(self.textures)
+        self.texture_change_tick = texture_change_tick
+        self.texture = self.textures[self.current_frame] if self.facing_right else self.textures_mirrored[self.current_frame]
+
+    def update_state_on_ground(self, physics_engine):
+        if physics_engine.can_jump() and self.change_x == 0 and self.change_y == 0:
+            self.update_state("idle")
+
+    def update(self):
+        self.texture_change_tick += 1
+        if self.texture_change_tick >= self.texture_change_rate:
+            self.texture_change_tick = 0
+            self.current_frame += 1
+            if self.current_frame >= len(self.textures):
+                self.current_frame = 0
+                # Stop attack if animation is dones
+                if self.state == "attack":
+                    self.can_update_state = True  # Set to True when the attack animation is finished
+                    self.update_state("idle")
+            self.texture = self.textures[self.current_frame] if self.facing_right else self.textures_mirrored[self.current_frame]
+
+        # Call the new method to update the player's state based on their position and movement
+        if self.state == "jump" and hasattr(self, "physics_engine"):
+            self.update_state_on_ground(self.physics_engine)
@@ -0,0 +1,120 @@
+"""
+Projectiles of the characters' special attacks: a fire bolt and a water bolt.
+
+Projectiles come from a pool of fixed size, allocated once with the World.
+Their state is a struct of arrays like the enemies' (see enemies.py) and every
+slot has its sprite in one SpriteList from the start, hidden while the slot is
+free. Firing takes a free slot, or the oldest one when all of them are flying,
+and a projectile goes back to the pool when it hits something or its time is
+up. So attacking never creates a sprite or grows a sprite list.
+
+A tick moves all projectiles at once and looks up the cell each one is in: a
+tile of the owner's attack target layer is a hit, the owner's walls stop it.
+"""
+import arcade
+import numpy as np
+
+from snapshot import ArrayState
+
+PROJECTILE_POOL = 8
+# Pixels per tick, less than a cell so a projectile can't skip one
+PROJECTILE_SPEED = 12
+# Ticks a projectile flies before it goes back to the pool
+PROJECTILE_TICKS = 60
+PROJECTILE_SCALING = 1.5
+# Texture and angle of each character's projectile
+PROJECTILE_TEXTURES = (
+    (":resources:images/space_shooter/laserRed01.png", 90),
+    (":resources:images/space_shooter/laserBlue01.png", 0),
+)
+
+# Rows of Projectiles.floats and Projectiles.ints. A slot with 0 ticks left is free,
+# "order" counts the projectiles fired, to find the oldest one.
+FLOAT_FIELDS = ("x", "y", "change_x")
+INT_FIELDS = ("owner", "ticks", "order")
+
+
+class Projectiles(ArrayState):
+    """The pool of projectiles of both characters."""
+
+    def __init__(self, size=PROJECTILE_POOL):
+        self.floats = np.zeros((len(FLOAT_FIELDS), size))
+        self.ints = np.zeros((len(INT_FIELDS), size), dtype=np.int32)
+        self.x, self.y, self.change_x = self.floats
+        self.owner, self.ticks, self.order = self.ints
+
+        self.textures = [arcade.load_texture(file_name, hit_box_algorithm="None") for file_name, _ in PROJECTILE_TEXTURES]
+        self.sprite_list = arcade.SpriteList(capacity=size)
+        self.sprites = []
+        for _ in range(size):
+            sprite = arcade.Sprite(texture=self.textures[0], scale=PROJECTILE_SCALING)
+            sprite.visible = False
+            self.sprites.append(sprite)
+            self.sprite_list.append(sprite)
+        # Position, owner and flying of every sprite when they were last synced
+        self.drawn = np.full((4, size), np.nan)
+
+    def clear(self):
+        """Put every projectile back into the pool."""
+        self.floats[:] = 0
+        self.ints[:] = 0
+
+    def fire(self, owner, x, y, direction):
+        """Launch a projectile from (x, y), to the right if direction is positive."""
+        free = np.flatnonzero(self.ticks == 0)
+        slot = free[0] if free.size else np.argmin(self.order)
+        self.x[slot] = x
+        self.y[slot] = y
+        self.change_x[slot] = PROJECTILE_SPEED if direction > 0 else -PROJECTILE_SPEED
+        self.owner[slot] = owner
+        self.ticks[slot] = PROJECTILE_TICKS
+        self.order[slot] = self.order.max() + 1
+
+    def update(self, targets, walls, cell_size):
+        """
+        Move every flying projectile by one tick. targets[owner] and walls[owner]
+        are grids of cells like Level.cell_grid returns, targets[owner] may be
+        None. Returns the bitset of the owners whose projectile hit their target.
+        """
+        flying = self.ticks > 0
+        if not flying.any():
+            return 0
+        self.x += self.change_x
+        self.ticks[flying] -= 1
+
+        hits = 0
+        for owner in (0, 1):
+            slots = np.flatnonzero(flying & (self.owner == owner))
+            if not slots.size:
+                continue
+            rows, cols = walls[owner].shape
+            col = np.clip(np.floor_divide(self.x[slots], cell_size).astype(np.intp) + 1, 0, cols - 1)
+            row = np.clip(np.floor_divide(self.y[slots], cell_size).astype(np.intp) + 1, 0, rows - 1)
+            stopped = walls[owner][row, col].astype(bool)
+            if targets[owner] is not None:
+                hit = targets[owner][row, col].astype(bool)
+                if hit.any():
+                    hits |= 1 << owner
+                stopped |= hit
+            self.ticks[slots[stopped]] = 0
+        self.change_x[self.ticks == 0] = 0
+        return hits
+
+    def sync(self):
+        """Move the flying projectiles' sprites and show or hide the ones whose slot changed."""
+        flying = self.ticks > 0
+        drawn_x, drawn_y, drawn_owner, drawn_flying = self.drawn
+        changed = np.flatnonzero((self.x != drawn_x) | (self.y != drawn_y) | (self.owner != drawn_owner) | (flying != drawn_flying))
+        for slot in changed.tolist():
+            sprite = self.sprites[slot]
+            if flying[slot]:
+                owner = int(self.owner[slot])
+                sprite.texture = self.textures[owner]
+                sprite.angle = PROJECTILE_TEXTURES[owner][1]
+                sprite.position = (float(self.x[slot]), float(self.y[slot]))
+            sprite.visible = bool(flying[slot])
+
+        drawn_x[:] = self.x
+        drawn_y[:] = self.y
+        drawn_owner[:] = self.owner
+        drawn_flying[:] = flying
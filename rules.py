@@ -0,0 +1,191 @@
+"""
+Each level's rules, read from the level manifest (maps/levels.json) and
+compiled into lookup tables once, when this module is imported.
+
+For each character the manifest gives the directory of its animation frames
+and its hit box. For every level it gives its map, music and chapter screen, where
+the characters spawn, which layers are walls for which character, the
+layers that make surfaces (fire, water, ice) and the triggers: a lever a
+character touches or something it attacks, and what that changes in the
+level. Adding a level only takes a map and an entry in the manifest.
+"""
+import json
+import os
+from pathlib import Path
+
+from constants import PLAYER_FRAME_TICKS, PLAYER_STATES
+
+MANIFEST = "maps/levels.json"
+# Packed copies of the maps and the index of what they were built from, see build_assets.py
+PACKED_DIRECTORY = "maps/packed"
+PACKED_INDEX = "maps/packed/index.json"
+
+# Layers World.update checks on every level
+LOGIC_LAYERS = ("Coins", "Exit")
+
+# Surface types of the tiles under a character, numbered in this order in surface grids
+SURFACE_TYPES = ("normal", "fire", "water", "ice")
+
+
+def packed_maps(file_name=PACKED_INDEX):
+    """The packed map to load by source map, leaving out those older than a file they were built from."""
+    try:
+        with open(file_name) as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    maps = {}
+    for source_map, entry in index.items():
+        try:
+            fresh = min(map(os.path.getmtime, entry["files"])) >= max(map(os.path.getmtime, entry["sources"]))
+        except OSError:
+            continue
+        if fresh:
+            maps[source_map] = entry["map"]
+    return maps
+
+
+def frame_count(directory, state):
+    """The number of frames of one of a character's animations, numbered from 1 as player.load_textures reads them."""
+    count = 0
+    while os.path.exists(f"{directory}/{state}/{state}_{count + 1}.png"):
+        count += 1
+    return count
+
+
+def compile_level(entry, next_level, packed=None):
+    """Turn one manifest entry into the tables the game and the tile grid code use."""
+    walls = tuple(tuple(names) for names in entry["walls"])
+    # Saves and snapshots keep the fired triggers in one byte
+    if len(entry["triggers"]) > 8:
+        raise ValueError(f"level {entry['number']}: more than 8 triggers")
+
+    triggers = []
+    effects = []
+    touch_triggers = ([], [])
+    attack_triggers = [None, None]
+    for index, trigger in enumerate(entry["triggers"]):
+        player = trigger["player"]
+        moves = tuple(trigger.get("move", {}).items())
+        clear = tuple(trigger.get("clear", ()))
+        # Layers moved into a layer that is a wall for both characters become walls themselves
+        added = tuple(name for name, destination in moves if all(destination in names for names in walls))
+        # (player, layer to touch, needs an attack, layers removed, layers that become walls for both)
+        triggers.append((player, trigger["layer"], trigger["attack"], clear, added))
+        # (sound, only the first time, layers to show, layers to hide, layers to move, layers to clear)
+        effects.append((trigger.get("sound"), trigger.get("sound_once", False),
+                        tuple(trigger.get("show", ())), tuple(trigger.get("hide", ())), moves, clear))
+
+        if not trigger["attack"]:
+            touch_triggers[player].append(index)
+        elif attack_triggers[player] is None:
+            attack_triggers[player] = index
+        else:
+            # A character only remembers that its attack hit, not what it hit
+            raise ValueError(f"level {entry['number']}: player {player + 1} has more than one attack trigger")
+
+    # (layer, surface type), later layers cover earlier ones
+    surfaces = tuple((name, SURFACE_TYPES.index(surface)) for name, surface in entry.get("surfaces", ()))
+
+    # Every layer the game logic looks at, the others are only decoration
+    layers = set(LOGIC_LAYERS).union(*walls)
+    layers.update(name for name, _ in surfaces)
+    for trigger, (_, _, shown, hidden, moves, clear) in zip(triggers, effects):
+        layers.add(trigger[1])
+        layers.update(shown, hidden, clear, *moves)
+
+    # Layers of rectangular tiles, whose hit boxes are their bounding boxes (see hitboxes.py)
+    bounding_boxes = frozenset(entry.get("bounding_boxes", ()))
+    if not bounding_boxes <= layers:
+        raise ValueError(f"level {entry['number']}: bounding_boxes lists layers without sprites: {sorted(bounding_boxes - layers)}")
+
+    music = entry.get("music")
+    return {
+        # The packed map when it is up to date, the map as drawn in Tiled otherwise
+        "map": (packed or {}).get(entry["map"], entry["map"]),
+        "source_map": entry["map"],
+        "music": (music["sound"], music.get("volume", 1.0)) if music else None,
+        "title": entry["title"],
+        "heading": entry.get("heading", ""),
+        "instructions": tuple(entry.get("instructions", ())),
+        "attacks": entry.get("attacks", False),
+        "spawns": tuple(tuple(spawn) for spawn in entry["spawns"]),
+        "layers": frozenset(layers),
+        "bounding_boxes": bounding_boxes,
+        "walls": walls,
+        "surfaces": surfaces,
+        "triggers": tuple(triggers),
+        "effects": tuple(effects),
+        "touch_triggers": (tuple(touch_triggers[0]), tuple(touch_triggers[1])),
+        "attack_triggers": tuple(attack_triggers),
+        # None after the last level
+        "next": next_level,
+    }
+
+
+def load_manifest(file_name=MANIFEST):
+    """
+    Read the level manifest. Returns the compiled rules by level number in
+    play order, the surf sound of each surface type, for each character the
+    bitset of surface types it surfs on, the tile animations, and for each
+    character the directory of its frames, its hit box (left, right, bottom,
+    top) relative to its center, and the ticks its attack animation lasts.
+    """
+    with open(file_name) as file:
+        manifest = json.load(file)
+    entries = manifest["levels"]
+    numbers = [entry["number"] for entry in entries]
+    packed = packed_maps()
+    levels = {
+        entry["number"]: compile_level(entry, numbers[index + 1] if index + 1 < len(numbers) else None, packed)
+        for index, entry in enumerate(entries)
+    }
+
+    types = manifest.get("surface_types", {})
+    sounds = tuple(types.get(surface, {}).get("sound") for surface in SURFACE_TYPES)
+    surfers = tuple(
+        sum(1 << SURFACE_TYPES.index(surface) for surface in surfaces) for surfaces in manifest.get("surfers", ((), ()))
+    )
+    # (frame images, milliseconds per frame). Tiles of a tileset whose image is one of
+    # the frames play the same part of the following images, see tilemesh.py. Frames laid
+    # out in one spritesheet, like the portals', are Tiled <animation> tiles in their
+    # tileset instead. The portal tilesets have none yet: no map places a portal tile, and
+    # their images ("32x32 Portal Asset Pack") are not in maps/.
+    directory = Path(file_name).parent
+    animations = tuple(
+        (tuple((directory / frame).resolve() for frame in animation["frames"]), animation["duration"])
+        for animation in manifest.get("tile_animations", ())
+    )
+
+    characters = manifest["characters"]
+    directories = tuple(character["directory"] for character in characters)
+    boxes = tuple(tuple(character["box"]) for character in characters)
+    attack_ticks = tuple(
+        frame_count(directory, "attack") * PLAYER_FRAME_TICKS[PLAYER_STATES.index("attack")] for directory in directories
+    )
+    return levels, sounds, surfers, animations, directories, boxes, attack_ticks
+
+
+(LEVEL_RULES, SURFACE_SOUNDS, SURFERS, TILE_ANIMATIONS,
+ PLAYER_DIRECTORIES, PLAYER_BOXES, ATTACK_TICKS) = load_manifest()
+FIRST_LEVEL = next(iter(LEVEL_RULES))
+
+
+def wall_layers(level, player, fired):
+    """Names of the layers that are walls for a player once the triggers in the `fired` bitset fired."""
+    rules = LEVEL_RULES[level]
+    names = set(rules["walls"][player])
+    for index, (_, _, _, removed, added) in enumerate(rules["triggers"]):
+        if fired & (1 << index):
+            names.difference_update(removed)
+            names.update(added)
+    return sorted(names)
+
+
+def fired_triggers(level, scene):
+    """The bitset of triggers that fired in a World's scene: all of their removed layers are empty."""
+    fired = 0
+    for index, (_, _, _, removed, _) in enumerate(LEVEL_RULES[level]["triggers"]):
+        if all(len(scene[name]) == 0 for name in removed):
+            fired |= 1 << index
+    return fired
@@ -0,0 +1,150 @@
+"""
+Binary save file format.
+
+A save file is a small header followed by the two players, the projectiles
+in flight and the dynamic state of the current level. The level state is stored as differences against
+the freshly built map: for every layer whose content changed, a bitset over all
+of the level's tile sprites telling which ones the layer holds, and for every
+layer whose alpha changed, the new alpha values, and for every layer that was
+shown or hidden, whether it is visible, followed by the state arrays of the
+level's enemies. That part is zlib compressed.
+
+All numbers are little-endian.
+
+Saves of earlier versions are read too, with what they did not have yet
+left at its default: version 1 kept two lever flags where the fired triggers
+are now, version 3 added which layers are shown, version 4 the enemies and
+version 5 the projectiles.
+"""
+import struct
+import zlib
+
+SAVE_MAGIC = b"FKWP"
+SAVE_VERSION = 5
+
+# magic, version, level number, game flags and fired triggers, score, player_initial_position
+_HEADER = struct.Struct("<4sHBHId")
+# center_x, center_y, change_x, change_y, state, current_frame, texture_change_tick, flags
+_PLAYER = struct.Struct("<ddffBBBB")
+# map signature, number of tile sprites, compressed level state size
+_LEVEL = struct.Struct("<III")
+_COUNT = struct.Struct("<H")
+_ENTRY = struct.Struct("<HI")
+_SIZE = struct.Struct("<I")
+
+GAME_FLAGS = ("between_levels", "game_end", "paused", "end_sound_played")
+# The level's fired triggers bitset takes the high byte of the game flags
+_TRIGGER_SHIFT = 8
+PLAYER_FLAGS = ("facing_right", "can_update_state", "hit_object", "on_special_surface")
+# Game flags of version 1 saves, where the sound flags of level 1's levers stand for its two triggers
+_V1_GAME_FLAGS = ("between_levels", "game_end", "paused", "lever1_sound_played", "lever2_sound_played", "end_sound_played")
+
+
+class SaveFormatError(Exception):
+    """Raised when a save file is not in a format this version can read."""
+
+
+def _pack_flags(data, names):
+    return sum(1 << bit for bit, name in enumerate(names) if data[name])
+
+
+def _unpack_flags(value, names):
+    return {name: bool(value & (1 << bit)) for bit, name in enumerate(names)}
+
+
+def encode_save(game_data):
+    """Serialize a game_data dictionary (see MyGame.save_game) into bytes."""
+    level_state = game_data["level_state"]
+
+    payload = bytearray()
+    for key in ("layers", "alpha", "visible"):
+        payload += _COUNT.pack(len(level_state[key]))
+        for layer_index, value in sorted(level_state[key].items()):
+            payload += _ENTRY.pack(layer_index, len(value)) + value
+    payload += _SIZE.pack(len(level_state["enemies"])) + level_state["enemies"]
+    payload = zlib.compress(bytes(payload), 9)
+
+    data = bytearray(_HEADER.pack(
+        SAVE_MAGIC, SAVE_VERSION, game_data["current_level"],
+        _pack_flags(game_data, GAME_FLAGS) | game_data["triggers_fired"] << _TRIGGER_SHIFT, game_data["score"], game_data["player_initial_position"],
+    ))
+    for player in game_data["players"]:
+        data += _PLAYER.pack(
+            player["center_x"], player["center_y"], player["change_x"], player["change_y"],
+            player["state"], player["current_frame"], player["texture_change_tick"],
+            _pack_flags(player, PLAYER_FLAGS),
+        )
+    data += _SIZE.pack(len(game_data["projectiles"])) + game_data["projectiles"]
+    data += _LEVEL.pack(game_data["signature"], game_data["sprite_count"], len(payload))
+    data += payload
+    return bytes(data)
+
+
+def decode_save(data):
+    """
+    Parse bytes written by encode_save, by this version or an earlier one, back
+    into a game_data dictionary. Saves from before version 5 have no projectiles
+    (None), from before version 4 no "enemies" in their level state and from
+    before version 3 no "visible" (see Level.apply_state).
+    """
+    try:
+        magic, version, level, flags, score, initial_position = _HEADER.unpack_from(data, 0)
+        if magic != SAVE_MAGIC:
+            raise SaveFormatError("not a save file")
+        if not 1 <= version <= SAVE_VERSION:
+            raise SaveFormatError(f"unsupported save version {version}")
+
+        game_data = {"current_level": level, "score": score, "player_initial_position": initial_position}
+        if version == 1:
+            old_flags = _unpack_flags(flags, _V1_GAME_FLAGS)
+            game_data.update((name, old_flags[name]) for name in GAME_FLAGS)
+            game_data["triggers_fired"] = old_flags["lever1_sound_played"] | old_flags["lever2_sound_played"] << 1
+        else:
+            game_data.update(_unpack_flags(flags, GAME_FLAGS))
+            game_data["triggers_fired"] = flags >> _TRIGGER_SHIFT
+
+        offset = _HEADER.size
+        game_data["players"] = []
+        for _ in range(2):
+            x, y, change_x, change_y, state, frame, tick, player_flags = _PLAYER.unpack_from(data, offset)
+            offset += _PLAYER.size
+            player = {
+                "center_x": x, "center_y": y, "change_x": change_x, "change_y": change_y,
+                "state": state, "current_frame": frame, "texture_change_tick": tick,
+            }
+            player.update(_unpack_flags(player_flags, PLAYER_FLAGS))
+            game_data["players"].append(player)
+
+        game_data["projectiles"] = None
+        if version >= 5:
+            (size,) = _SIZE.unpack_from(data, offset)
+            offset += _SIZE.size
+            game_data["projectiles"] = bytes(data[offset:offset + size])
+            offset += size
+
+        signature, sprite_count, size = _LEVEL.unpack_from(data, offset)
+        offset += _LEVEL.size
+        payload = zlib.decompress(data[offset:offset + size])
+
+        keys = ("layers", "alpha", "visible") if version >= 3 else ("layers", "alpha")
+        level_state = {key: {} for key in keys}
+        offset = 0
+        for key in keys:
+            (count,) = _COUNT.unpack_from(payload, offset)
+            offset += _COUNT.size
+            for _ in range(count):
+                layer_index, length = _ENTRY.unpack_from(payload, offset)
+                offset += _ENTRY.size
+                level_state[key][layer_index] = payload[offset:offset + length]
+                offset += length
+        if version >= 4:
+            (length,) = _SIZE.unpack_from(payload, offset)
+            offset += _SIZE.size
+            level_state["enemies"] = payload[offset:offset + length]
+    except (struct.error, zlib.error) as error:
+        raise SaveFormatError(f"corrupt save file: {error}") from error
+
+    game_data["signature"] = signature
+    game_data["sprite_count"] = sprite_count
+    game_data["level_state"] = level_state
+    return game_data
@@ -0,0 +1,285 @@
+"""
+Headless game server: runs many game sessions without a window.
+
+Sessions are spread over one worker process per core. Every worker steps all
+of its sessions at the fixed tick rate. The Tiled maps are parsed once by the
+main process and put in shared memory. The tile ids of their layers, which
+are most of a map, stay there: every worker reads them as numpy arrays on
+the shared block instead of keeping a copy. The rest of a map is small and
+is unpickled by each worker. The levels themselves are still built per
+session, since sessions change them.
+
+Every few seconds the workers report their session count and tick times,
+and the main process writes them to a JSON stats file. A worker that dies
+is started again with its sessions, from their beginning. On shutdown every
+session is stopped, tearing its levels down, before the workers exit.
+
+    python server.py --sessions 200 --stats server-stats.json
+
+Sessions are played by bots pressing random buttons until clients can
+connect to the server.
+"""
+import argparse
+import json
+import os
+import pickle
+import queue
+import random
+import time
+from multiprocessing import Process, Queue
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+
+import numpy
+import pytiled_parser
+
+import hitboxes
+from constants import BUTTON_CONTINUE, BUTTON_JUMP, BUTTON_LEFT, BUTTON_RIGHT
+from rules import LEVEL_RULES
+from tilemesh import tile_layers
+from world import World
+
+TICK_RATE = 60
+STATS_INTERVAL = 2.0
+
+
+def compile_maps():
+    """Parse the Tiled map of every level in the manifest.
+
+    Returns the tile ids of all their tile layers packed in one array, and the maps pickled by level
+    number. In the pickled maps, the data of each tile layer is the offset and shape of its tile ids.
+    """
+    tiled_maps = {}
+    gids = []
+    offset = 0
+    for level, rules in LEVEL_RULES.items():
+        tiled_map = pytiled_parser.parse_map(Path(rules["map"]))
+        for layer in tile_layers(tiled_map.layers):
+            if layer.data is None:
+                continue
+            layer_gids = numpy.array(layer.data, dtype=numpy.uint32)
+            gids.append(layer_gids.ravel())
+            layer.data = (offset, layer_gids.shape)
+            offset += layer_gids.size
+        tiled_maps[level] = tiled_map
+    gids = numpy.concatenate(gids) if gids else numpy.zeros(0, dtype=numpy.uint32)
+    return gids, pickle.dumps(tiled_maps, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def share_maps(gids, maps):
+    """Copy compiled maps into a new shared memory block, the tile ids first. The caller unlinks it."""
+    memory = SharedMemory(create=True, size=max(1, gids.nbytes + len(maps)))
+    memory.buf[:gids.nbytes] = gids.tobytes()
+    memory.buf[gids.nbytes:gids.nbytes + len(maps)] = maps
+    return memory
+
+
+def attach_maps(name, gids_size, maps_size):
+    """Read the compiled maps from a shared memory block created by share_maps.
+
+    The tile layers' data become read-only views on the block, so the block is returned too and must
+    stay open as long as the maps are used.
+    """
+    memory = SharedMemory(name=name)
+    gids = numpy.ndarray((gids_size,), dtype=numpy.uint32, buffer=memory.buf)
+    gids.flags.writeable = False
+    tiled_maps = pickle.loads(memory.buf[gids.nbytes:gids.nbytes + maps_size])
+    for tiled_map in tiled_maps.values():
+        for layer in tile_layers(tiled_map.layers):
+            if layer.data is not None:
+                offset, shape = layer.data
+                layer.data = gids[offset:offset + shape[0] * shape[1]].reshape(shape)
+    return memory, tiled_maps
+
+
+class Bot:
+    """Random buttons for one player, changing every now and then."""
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.buttons = BUTTON_RIGHT
+
+    def next(self):
+        if self.random.random() < 0.05:
+            self.buttons = self.random.choice((BUTTON_RIGHT, BUTTON_RIGHT, BUTTON_LEFT, 0))
+        if self.random.random() < 0.03:
+            self.buttons ^= BUTTON_JUMP
+        return self.buttons
+
+
+class Session:
+    """One game: a World and whoever plays its two characters."""
+
+    def __init__(self, session_id, tiled_maps, seed):
+        self.session_id = session_id
+        self.world = World(tiled_maps)
+        self.world.setup()
+        self.players = (Bot(seed), Bot(seed + 1))
+
+    def step(self):
+        world = self.world
+        buttons_1, buttons_2 = (player.next() for player in self.players)
+        if world.between_levels:
+            buttons_1 |= BUTTON_CONTINUE
+        world.update(buttons_1, buttons_2)
+
+
+class TickStats:
+    """Tick times of one worker since the last report."""
+
+    def __init__(self):
+        self.times = []
+        self.overruns = 0
+
+    def report(self, worker, sessions, ticks):
+        times = sorted(self.times) or [0.0]
+        report = {
+            "worker": worker,
+            "pid": os.getpid(),
+            "sessions": sessions,
+            "ticks": ticks,
+            "tick_ms_mean": sum(times) / len(times) * 1000,
+            "tick_ms_p99": times[int(len(times) * 0.99)] * 1000,
+            "tick_ms_max": times[-1] * 1000,
+            "session_ms_mean": sum(times) / len(times) * 1000 / max(1, sessions),
+            "overruns": self.overruns,
+        }
+        self.times.clear()
+        self.overruns = 0
+        return report
+
+
+def run_worker(worker, commands, stats, maps_name, gids_size, maps_size, tick_rate):
+    """Step this worker's sessions at the tick rate until told to stop."""
+    # The maps' tile ids are views on the shared memory, it stays open until the worker exits
+    memory, tiled_maps = attach_maps(maps_name, gids_size, maps_size)
+    hitboxes.install()
+    sessions = {}
+    tick_stats = TickStats()
+    period = 1 / tick_rate
+    ticks = 0
+    next_tick = time.perf_counter()
+    next_report = next_tick + STATS_INTERVAL
+
+    while True:
+        # Building a session takes a few ticks worth of time, so only one is started per tick.
+        # Stopping one is quick, any number are stopped.
+        command = ()
+        while command is not None and command[:1] != ("start",):
+            try:
+                command = commands.get_nowait()
+            except queue.Empty:
+                break
+            if command is not None and command[0] == "stop":
+                session = sessions.pop(command[1], None)
+                # Sprites and their lists refer to each other, without a teardown the garbage collector
+                # has to find them. The other sessions use the same textures, they stay cached.
+                if session is not None:
+                    session.world.unload(textures=False)
+        if command is None:
+            break
+        if command[:1] == ("start",):
+            _, session_id, seed = command
+            sessions[session_id] = Session(session_id, tiled_maps, seed)
+
+        start = time.perf_counter()
+        for session in sessions.values():
+            session.step()
+        end = time.perf_counter()
+        tick_stats.times.append(end - start)
+        ticks += 1
+
+        if end >= next_report:
+            stats.put(tick_stats.report(worker, len(sessions), ticks))
+            next_report = end + STATS_INTERVAL
+
+        # Wait for the next tick. When late, start the next tick right away
+        # but don't try to catch up on the ticks that were missed.
+        next_tick += period
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            tick_stats.overruns += 1
+            next_tick = time.perf_counter()
+
+
+def write_stats(filename, reports, started):
+    workers = sorted(reports.values(), key=lambda report: report["worker"])
+    summary = {
+        "time": time.time(),
+        "uptime": time.perf_counter() - started,
+        "sessions": sum(report["sessions"] for report in workers),
+        "workers": workers,
+    }
+    # Write to a temporary file first so readers never see half a file
+    with open(filename + ".tmp", "w") as file:
+        json.dump(summary, file, indent=2)
+    os.replace(filename + ".tmp", filename)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100, help="number of sessions to run")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes, one per core by default")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE)
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run for, forever when 0")
+    parser.add_argument("--stats", default="server-stats.json", help="file the worker stats are written to")
+    args = parser.parse_args()
+
+    gids, maps = compile_maps()
+    memory = share_maps(gids, maps)
+
+    # Deal the sessions out to the workers in turn, as (session id, seed)
+    dealt = [[] for _ in range(args.workers)]
+    for session_id in range(args.sessions):
+        dealt[session_id % args.workers].append((session_id, session_id * 2))
+
+    stats = Queue()
+
+    def start_worker(worker):
+        commands = Queue()
+        process = Process(
+            target=run_worker, args=(worker, commands, stats, memory.name, gids.size, len(maps), args.tick_rate),
+            daemon=True,
+        )
+        process.start()
+        for session_id, seed in dealt[worker]:
+            commands.put(("start", session_id, seed))
+        return process, commands
+
+    workers = [start_worker(worker) for worker in range(args.workers)]
+    started = time.perf_counter()
+    reports = {}
+    try:
+        while not args.duration or time.perf_counter() - started < args.duration:
+            for worker, (process, _) in enumerate(workers):
+                if not process.is_alive():
+                    print(f"worker {worker} (pid {process.pid}) exited with code {process.exitcode},"
+                          f" starting it again with its {len(dealt[worker])} sessions")
+                    reports.pop(worker, None)
+                    workers[worker] = start_worker(worker)
+            try:
+                report = stats.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            reports[report["worker"]] = report
+            summary = write_stats(args.stats, reports, started)
+            print(f"{summary['sessions']} sessions on {len(reports)} workers, tick ms per worker: "
+                  + ", ".join(f"{r['tick_ms_mean']:.1f}/{r['tick_ms_max']:.1f}" for r in summary["workers"]))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker, (process, commands) in enumerate(workers):
+            for session_id, _ in dealt[worker]:
+                commands.put(("stop", session_id))
+            commands.put(None)
+        for process, commands in workers:
+            process.join(timeout=5)
+        memory.close()
+        memory.unlink()
+
+
+if __name__ == "__main__":
+    main()
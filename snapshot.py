@@ -0,0 +1,108 @@
+"""
+In-memory snapshots of the World, for rollback and debugging.
+
+A Snapshot is a set of preallocated buffers. Capturing copies the world's
+state into them and restoring copies it back, so taking snapshots every tick
+does not create any objects once the buffers have their size.
+"""
+import struct
+import zlib
+from array import array
+
+# Per player: center_x, center_y, change_x, change_y
+PLAYER_FLOATS = 4
+# Per player: state, current_frame, texture_change_tick, flags, buttons
+PLAYER_INTS = 5
+
+
+class Snapshot:
+    """The state of a World at one tick."""
+
+    def __init__(self):
+        self.tick = -1
+        self.level = 0
+        self.score = 0
+        self.flags = 0
+        self.camera_x = 0.0
+        self.players = array("d", [0.0] * (2 * PLAYER_FLOATS))
+        self.player_ints = array("i", [0] * (2 * PLAYER_INTS))
+
+        # Level buffers, sized by Level.capture_into
+        self.membership = bytearray()
+        self.alpha = bytearray()
+        self.layer_versions = array("Q")
+        self.alpha_versions = array("Q")
+        self.visible = bytearray()
+        self.enemies = bytearray()
+        # Sized by World.capture_snapshot
+        self.projectiles = bytearray()
+
+    def checksum(self):
+        """
+        CRC32 of the captured game state, to compare worlds on different machines.
+        Layer versions are left out, they are local to each process.
+        """
+        crc = zlib.crc32(struct.pack("<qiiid", self.tick, self.level, self.score, self.flags, self.camera_x))
+        for buffer in (self.players, self.player_ints, self.membership, self.alpha, self.visible, self.enemies, self.projectiles):
+            crc = zlib.crc32(buffer, crc)
+        return crc
+
+
+class ArrayState:
+    """
+    Base for state kept in two numpy arrays with one row per field, `floats`
+    and `ints` (see enemies.py). The state is copied into snapshots and save
+    files as the raw bytes of both arrays.
+    """
+
+    @property
+    def nbytes(self):
+        """The length of the state's bytes."""
+        return self.floats.nbytes + self.ints.nbytes
+
+    def state_bytes(self):
+        return self.floats.tobytes() + self.ints.tobytes()
+
+    def apply_bytes(self, data):
+        """Restore a state returned by state_bytes."""
+        if len(data) != self.nbytes:
+            raise ValueError(f"the {type(self).__name__.lower()} state has the wrong size")
+        self.restore_from(data)
+
+    def capture_into(self, buffer):
+        """Copy the state into a bytearray of the right size without allocating."""
+        if self.floats.size:
+            floats = self.floats.nbytes
+            buffer[:floats] = self.floats.data.cast("B")
+            buffer[floats:] = self.ints.data.cast("B")
+
+    def restore_from(self, buffer):
+        if self.floats.size:
+            floats = self.floats.nbytes
+            buffer = memoryview(buffer)
+            self.floats.data.cast("B")[:] = buffer[:floats]
+            self.ints.data.cast("B")[:] = buffer[floats:]
+
+
+class SnapshotRing:
+    """The snapshots of the last `size` ticks."""
+
+    def __init__(self, size):
+        self.snapshots = [Snapshot() for _ in range(size)]
+
+    def capture(self, world):
+        """Capture the world's current tick, overwriting the snapshot from `size` ticks ago."""
+        snapshot = self.snapshots[world.tick % len(self.snapshots)]
+        world.capture_snapshot(snapshot)
+        return snapshot
+
+    def get(self, tick):
+        """Return the snapshot of a tick, or None if it is not in the ring anymore."""
+        snapshot = self.snapshots[tick % len(self.snapshots)]
+        return snapshot if snapshot.tick == tick else None
+
+    def restore(self, world, tick):
+        snapshot = self.get(tick)
+        if snapshot is None:
+            raise KeyError(f"tick {tick} is not in the snapshot ring")
+        world.restore_snapshot(snapshot)
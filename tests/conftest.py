@@ -0,0 +1,7 @@
+"""The tests import the game's modules and read its maps relative to the repository root."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
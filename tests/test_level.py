@@ -0,0 +1,160 @@
+import arcade
+import pytest
+
+from bench import new_world
+from level import bit_indices
+
+
+def members(level, name):
+    """Indices of the tile sprites a layer's membership bitset holds."""
+    offset = level.layer_by_name[name] * level.stride
+    return bit_indices(level.membership[offset:offset + level.stride])
+
+
+def probe(sprite):
+    """A sprite covering another one, to find it in a list's spatial hash."""
+    box = arcade.SpriteSolidColor(int(sprite.width), int(sprite.height), arcade.color.WHITE)
+    box.position = sprite.position
+    return box
+
+
+@pytest.fixture
+def world():
+    return new_world(1)
+
+
+def test_clear_layer(world):
+    level = world.level
+    sprites = list(world.scene["Fire Wall"])
+    assert sprites
+    version = level.layer_versions[level.layer_by_name["Fire Wall"]]
+
+    level.clear_layer("Fire Wall")
+    assert len(world.scene["Fire Wall"]) == 0
+    assert members(level, "Fire Wall") == []
+    assert level.layer_versions[level.layer_by_name["Fire Wall"]] != version
+    # The spatial hash is emptied with the list
+    assert arcade.check_for_collision_with_list(probe(sprites[0]), world.scene["Fire Wall"]) == []
+    assert level.layer_by_name["Fire Wall"] in level.capture_state()["layers"]
+
+    level.reset()
+    assert list(world.scene["Fire Wall"]) == sprites
+    assert level.capture_state()["layers"] == {}
+
+
+def test_clear_layer_of_sprites_in_several_layers(world):
+    level = world.level
+    level.move_layer("Bridge", "Platforms")
+    bridge = [level.sprites[index] for index in members(level, "Platforms") if level.origin_layer[index] == level.layer_by_name["Bridge"]]
+    # A bridge tile also put back in its own layer is in two of the level's lists
+    world.scene["Bridge"].append(bridge[0])
+    level._set_bit(level.layer_by_name["Bridge"], level.sprite_index[bridge[0]], True)
+
+    level.clear_layer("Bridge")
+    assert bridge[0] not in world.scene["Platforms"]
+    assert level.sprite_index[bridge[0]] not in members(level, "Platforms")
+    assert all(sprite in world.scene["Platforms"] for sprite in bridge[1:])
+
+
+def test_move_layer(world):
+    level = world.level
+    bridge = list(world.scene["Bridge"])
+    platforms = list(world.scene["Platforms"])
+    assert bridge
+
+    level.move_layer("Bridge", "Platforms")
+    assert len(world.scene["Bridge"]) == 0
+    assert members(level, "Bridge") == []
+    # Moved sprites go to the end of the destination, in their order
+    assert list(world.scene["Platforms"]) == platforms + bridge
+    assert members(level, "Platforms") == sorted(level.sprite_index[sprite] for sprite in platforms + bridge)
+    assert bridge[0] in arcade.check_for_collision_with_list(probe(bridge[0]), world.scene["Platforms"])
+
+    # Moving an empty layer changes nothing
+    version = level.layer_versions[level.layer_by_name["Platforms"]]
+    level.move_layer("Bridge", "Platforms")
+    assert level.layer_versions[level.layer_by_name["Platforms"]] == version
+
+    level.reset()
+    assert list(world.scene["Bridge"]) == bridge
+    assert set(world.scene["Platforms"]) == set(platforms)
+
+
+def test_unload(world):
+    world.current_level = 2
+    world.setup_level(2)
+    level = world.levels[1]
+    with pytest.raises(ValueError):
+        world.unload_level(2)
+
+    names = {sprite.texture.name for sprite in level.sprites}
+    count = len(level.sprites)
+    lists = [level.scene[name] for name in level.layer_names]
+    world.unload_level(1)
+    assert 1 not in world.levels
+    assert all(len(sprite_list) == 0 for sprite_list in lists)
+    assert level.sprites == [] and level.sprite_index == {}
+    cached = {texture.name for texture in arcade.load_texture.texture_cache.values()}
+    # Level 2's own textures stay cached, unless level 1 used them too
+    assert not names & cached
+    assert {sprite.texture.name for sprite in world.level.sprites} - names <= cached
+
+    # The level is built again when it is needed
+    world.current_level = 1
+    world.setup_level(1)
+    assert world.levels[1] is not level
+    assert len(world.level.sprites) == count
+
+
+def test_apply_state_rejects_states_of_other_layers(world):
+    level = world.level
+    world.fire_trigger(0)
+    state = level.capture_state()
+    layer_index = level.layer_by_name["Fire Wall"]
+    start, stop = level.origin_ranges[layer_index]
+    bad_states = [
+        dict(state, layers={len(level.layer_names): bytes(level.stride)}),
+        dict(state, layers={layer_index: bytes(level.stride + 1)}),
+        dict(state, alpha={-1: b"\xff"}),
+        dict(state, alpha={layer_index: b"\xff" * (stop - start + 1)}),
+        dict(state, visible={"0": b"\1"}),
+        dict(state, visible={layer_index: b"\1\1"}),
+        dict(state, enemies=state["enemies"] + b"\0"),
+    ]
+    original = level.capture_state()
+    for bad_state in bad_states:
+        with pytest.raises(ValueError):
+            level.apply_state(bad_state)
+        assert level.capture_state() == original
+
+    # A single alpha value stands for the whole layer
+    level.apply_state(dict(state, alpha={layer_index: b"\x80"}))
+    assert level.alpha[start:stop] == b"\x80" * (stop - start)
+
+
+def surfaces_up_to_date(level):
+    """Whether the surfaces surface_at uses are the ones built from the layers now."""
+    level.surface_at(0, 0)
+    surfaces = bytes(level.surfaces)
+    level._build_surfaces()
+    return level.surfaces == surfaces
+
+
+def test_only_surface_layers_change_the_surfaces(world):
+    level = world.level
+    original = level.capture_state()
+    level.surface_at(0, 0)
+    level.clear_layer("Fire Wall")
+    level.set_layer_visible("Fire Lever", False)
+    level.set_layer_alpha("Water Wall", 100)
+    assert not level.surfaces_dirty
+
+    level.clear_layer("Fire")
+    assert level.surfaces_dirty
+    assert surfaces_up_to_date(level)
+    level.move_layer("Bridge", "Platforms")
+    assert level.surfaces_dirty
+    assert surfaces_up_to_date(level)
+    level.apply_state(original)
+    assert level.surfaces_dirty
+    assert surfaces_up_to_date(level)
@@ -0,0 +1,107 @@
+import pytest
+
+from bench import new_world
+from constants import BUTTON_ATTACK, BUTTON_LEFT, BUTTON_RIGHT, GRID_PIXEL_SIZE, PLAYER_MOVEMENT_SPEED
+from navigation import Body, Follower, NavGraph
+from rules import LEVEL_RULES
+from tilegrid import TileGrid
+
+# A box one cell wide and two high, centered on x, feet at y
+BOX = (-GRID_PIXEL_SIZE / 2 + 1, GRID_PIXEL_SIZE / 2 - 1, 0, 2 * GRID_PIXEL_SIZE - 1)
+
+graphs = {}
+
+
+def graph(level, player):
+    """The graph of a character with no trigger fired, built once."""
+    if (level, player) not in graphs:
+        graphs[(level, player)] = NavGraph(TileGrid.from_map(LEVEL_RULES[level]["map"]), level, player)
+    return graphs[(level, player)]
+
+
+def floor_body(width=6, wall=None):
+    """A body standing on the floor row of a 6 x 6 grid, optionally with a wall two cells high at column `wall`."""
+    solid = bytearray(width * 6)
+    solid[:width] = b"\1" * width
+    if wall is not None:
+        solid[width + wall] = solid[2 * width + wall] = 1
+    return Body(solid, width, 6, BOX, 1.5 * GRID_PIXEL_SIZE, GRID_PIXEL_SIZE)
+
+
+def test_body_stands_and_jumps():
+    body = floor_body()
+    body.step(0, False)
+    assert (body.y, body.grounded) == (GRID_PIXEL_SIZE, True)
+
+    body.step(0, True)
+    heights = [body.y]
+    while not body.grounded:
+        body.step(0, False)
+        heights.append(body.y)
+    assert max(heights) > 2 * GRID_PIXEL_SIZE
+    assert body.y == GRID_PIXEL_SIZE
+
+
+def test_body_stops_at_walls():
+    body = floor_body(wall=3)
+    for _ in range(3 * GRID_PIXEL_SIZE // PLAYER_MOVEMENT_SPEED):
+        body.step(1, False)
+    assert body.x + body.right_offset == 3 * GRID_PIXEL_SIZE
+
+
+@pytest.mark.parametrize("level", sorted(LEVEL_RULES))
+@pytest.mark.parametrize("player", (0, 1))
+def test_update_matches_a_new_graph(level, player):
+    base = graph(level, player)
+    edges = dict(base.edges)
+    grid = base.grid
+    for fired in range(1, 1 << len(LEVEL_RULES[level]["triggers"])):
+        updated = base.copy()
+        updated.update(fired)
+        assert updated.edges == NavGraph(grid, level, player, fired).edges
+    # Updating a copy leaves the graph it was copied from alone
+    assert base.edges == edges
+
+
+@pytest.mark.parametrize("level", sorted(LEVEL_RULES))
+@pytest.mark.parametrize("player", (0, 1))
+def test_path_to_the_exit(level, player):
+    nav = graph(level, player).copy()
+    nav.update((1 << len(LEVEL_RULES[level]["triggers"])) - 1)
+    start = min(nav.edges)
+    goals = nav.goal_nodes("Exit")
+    path = nav.find_path(start, goals, "Exit")
+
+    assert path
+    node = start
+    for edge in path:
+        assert edge in nav.edges[node]
+        node = edge[0]
+    assert node in goals
+    # Cached until the graph changes
+    assert nav.find_path(start, goals, "Exit") is path
+    nav.update(0)
+    assert nav.paths == {}
+
+
+@pytest.mark.parametrize("player", (0, 1))
+def test_follower_faces_its_target_to_attack(player):
+    world = new_world(2)
+    follower = Follower(world, player)
+    nav = follower.graph()
+    _, layer, needs_attack, _, _ = LEVEL_RULES[2]["triggers"][player]
+    assert needs_attack
+    cols = [col for col, _ in nav.grid.cells(layer)]
+    target_x = (sum(cols) / len(cols) + 0.5) * GRID_PIXEL_SIZE
+
+    me = (world.player_sprite_1, world.player_sprite_2)[player]
+    me.change_y = 0
+    goals = nav.goal_nodes(layer)
+    assert goals
+    for node in goals:
+        me.center_x, me.center_y = nav.position(node)
+        right = me.center_x < target_x
+        me.facing_right = not right
+        assert follower._choose_buttons() == (BUTTON_RIGHT if right else BUTTON_LEFT)
+        me.facing_right = right
+        assert follower._choose_buttons() == BUTTON_ATTACK
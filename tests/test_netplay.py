@@ -0,0 +1,84 @@
+import pytest
+
+from bench import new_world, scripted_buttons
+from netplay import RollbackSession
+from snapshot import Snapshot
+
+TICKS = 240
+INPUT_DELAY = 2
+
+
+class QueueTransport:
+    """Packets to a peer's QueueTransport that arrive `latency` receives later. Every `loss`-th one is lost."""
+
+    def __init__(self, latency, loss=0):
+        self.latency = latency
+        self.loss = loss
+        self.peer = None
+        self.in_flight = []
+        self.sent = 0
+
+    def send(self, data):
+        self.sent += 1
+        if not (self.loss and self.sent % self.loss == 0):
+            self.peer.in_flight.append((self.latency, data))
+
+    def receive(self):
+        arrived = [data for countdown, data in self.in_flight if countdown <= 0]
+        self.in_flight = [(countdown - 1, data) for countdown, data in self.in_flight if countdown > 0]
+        return arrived
+
+
+def connected_sessions(latency, loss=0):
+    transports = QueueTransport(latency, loss), QueueTransport(latency, loss)
+    transports[0].peer, transports[1].peer = transports[1], transports[0]
+    return [RollbackSession(new_world(2), player, transport, INPUT_DELAY) for player, transport in zip((1, 2), transports)]
+
+
+def play(sessions, inputs):
+    for _ in range(10 * len(inputs)):
+        if min(session.confirmed_tick for session in sessions) >= len(inputs):
+            return
+        for index, session in enumerate(sessions):
+            tick = session.world.tick
+            session.advance(inputs[tick][index] if tick < len(inputs) else 0)
+    raise AssertionError("the sessions never confirmed every tick")
+
+
+def offline_checksums(inputs):
+    """The checksum of every tick of a World given the same buttons, with the same input delay, without rollbacks."""
+    world = new_world(2)
+    world.tick = 0
+    snapshot = Snapshot()
+    checksums = {}
+    for tick in range(1, len(inputs) + 1):
+        world.update(*(inputs[tick - 1 - INPUT_DELAY] if tick > INPUT_DELAY else (0, 0)))
+        world.capture_snapshot(snapshot)
+        checksums[tick] = snapshot.checksum()
+    return checksums
+
+
+@pytest.mark.parametrize("latency, loss", ((0, 0), (6, 0), (6, 5)))
+def test_rollbacks_end_in_the_offline_state(latency, loss):
+    inputs = scripted_buttons(TICKS)
+    sessions = connected_sessions(latency, loss)
+    play(sessions, inputs)
+
+    expected = offline_checksums(inputs)
+    for session in sessions:
+        assert session.desynced_tick is None
+        assert session.checksums[TICKS] == expected[TICKS]
+    if latency > INPUT_DELAY:
+        # Late inputs were mispredicted, so the World was rolled back and simulated again
+        assert all(session.rollbacks for session in sessions)
+        assert all(session.max_resimulated <= session.max_rollback + 1 for session in sessions)
+
+
+def test_desync_is_detected():
+    inputs = scripted_buttons(TICKS)
+    # Without rollbacks, which would restore the score from an earlier snapshot
+    sessions = connected_sessions(latency=0)
+    play(sessions, inputs[:TICKS // 2])
+    sessions[1].world.score += 1
+    play(sessions, inputs)
+    assert any(session.desynced_tick is not None for session in sessions)
@@ -0,0 +1,19 @@
+import pytest
+
+from bench import new_world
+from constants import PLAYER_STATES
+from rules import ATTACK_TICKS, PLAYER_BOXES
+
+
+@pytest.mark.parametrize("player", (0, 1))
+def test_characters_match_their_textures(player):
+    world = new_world(1)
+    sprite = (world.player_sprite_1, world.player_sprite_2)[player]
+    # The manifest's box is the one arcade computes from the scaled idle texture
+    points = sprite.get_adjusted_hit_box()
+    xs = [x - sprite.center_x for x, _ in points]
+    ys = [y - sprite.center_y for _, y in points]
+    assert PLAYER_BOXES[player] == (min(xs), max(xs), min(ys), max(ys))
+
+    attack = PLAYER_STATES.index("attack")
+    assert ATTACK_TICKS[player] == len(sprite.animations.frames[attack]) * sprite.animations.frame_ticks[attack]
@@ -0,0 +1,118 @@
+import pytest
+
+import savegame
+from bench import new_world, world_state
+from savegame import SAVE_VERSION, SaveFormatError, decode_save, encode_save
+
+
+def encode_version(game_data, version):
+    """What encode_save wrote for game_data when the format was at `version`."""
+    level_state = game_data["level_state"]
+    if version < 3:
+        # Layers were hidden by making their tiles transparent, and shown by making them opaque
+        level_state = dict(level_state, alpha=dict(level_state["alpha"]))
+        for layer_index, value in level_state["visible"].items():
+            level_state["alpha"][layer_index] = b"\xff" if value[0] else b"\0"
+    payload = bytearray()
+    for key in ("layers", "alpha", "visible") if version >= 3 else ("layers", "alpha"):
+        payload += savegame._COUNT.pack(len(level_state[key]))
+        for layer_index, value in sorted(level_state[key].items()):
+            payload += savegame._ENTRY.pack(layer_index, len(value)) + value
+    if version >= 4:
+        payload += savegame._SIZE.pack(len(level_state["enemies"])) + level_state["enemies"]
+    payload = savegame.zlib.compress(bytes(payload))
+
+    if version == 1:
+        old_flags = dict(game_data, lever1_sound_played=game_data["triggers_fired"] & 1,
+                         lever2_sound_played=game_data["triggers_fired"] & 2)
+        flags = savegame._pack_flags(old_flags, savegame._V1_GAME_FLAGS)
+    else:
+        flags = savegame._pack_flags(game_data, savegame.GAME_FLAGS) | game_data["triggers_fired"] << savegame._TRIGGER_SHIFT
+    data = bytearray(savegame._HEADER.pack(savegame.SAVE_MAGIC, version, game_data["current_level"], flags,
+                                           game_data["score"], game_data["player_initial_position"]))
+    for player in game_data["players"]:
+        data += savegame._PLAYER.pack(
+            player["center_x"], player["center_y"], player["change_x"], player["change_y"],
+            player["state"], player["current_frame"], player["texture_change_tick"],
+            savegame._pack_flags(player, savegame.PLAYER_FLAGS),
+        )
+    if version >= 5:
+        data += savegame._SIZE.pack(len(game_data["projectiles"])) + game_data["projectiles"]
+    data += savegame._LEVEL.pack(game_data["signature"], game_data["sprite_count"], len(payload)) + payload
+    return bytes(data)
+
+
+@pytest.fixture(scope="module")
+def played():
+    """A level 1 world after some walking, with its Fire Lever pulled."""
+    world = new_world(1)
+    for _ in range(30):
+        world.update()
+    world.fire_trigger(0)
+    world.score = 7
+    return world
+
+
+def test_round_trip(played):
+    data = encode_save(played.save_data())
+    assert encode_save(decode_save(data)) == data
+
+    world = new_world(1)
+    world.load_data(decode_save(data))
+    # Save files leave out the tick
+    assert world_state(world)[1:] == world_state(played)[1:]
+    assert world.triggers_fired == played.triggers_fired == 1
+
+
+@pytest.mark.parametrize("version", range(1, SAVE_VERSION + 1))
+def test_earlier_versions(played, version):
+    game_data = decode_save(encode_version(played.save_data(), version))
+    assert game_data["triggers_fired"] == 1
+    assert game_data["projectiles"] is None if version < 5 else game_data["projectiles"] is not None
+    assert ("enemies" in game_data["level_state"]) == (version >= 4)
+
+    world = new_world(1)
+    world.load_data(game_data)
+    assert world_state(world)[1:] == world_state(played)[1:]
+    assert encode_save(world.save_data()) == encode_save(played.save_data())
+
+
+def test_earlier_version_without_projectiles():
+    world = new_world(2)
+    world.projectiles.fire(0, world.player_sprite_1.center_x, world.player_sprite_1.center_y, 1)
+    game_data = decode_save(encode_version(world.save_data(), 4))
+    world.load_data(game_data)
+    assert world.projectiles.state_bytes() == new_world(2).projectiles.state_bytes()
+
+
+@pytest.mark.parametrize("version", (0, SAVE_VERSION + 1))
+def test_unsupported_versions(played, version):
+    with pytest.raises(SaveFormatError, match="unsupported save version"):
+        decode_save(encode_version(played.save_data(), SAVE_VERSION)[:4] + version.to_bytes(2, "little") + b"\0" * 64)
+
+
+def test_corrupt_files(played):
+    data = encode_save(played.save_data())
+    with pytest.raises(SaveFormatError, match="not a save file"):
+        decode_save(b"NOPE" + data[4:])
+    with pytest.raises(SaveFormatError, match="corrupt"):
+        decode_save(data[:-10])
+
+
+def test_failed_load_leaves_the_world_alone():
+    world = new_world(1)
+    world.fire_trigger(0)
+    state = world_state(world)
+    other = new_world(2).save_data()
+    bad_saves = [
+        dict(other, signature=other["signature"] ^ 1),
+        dict(other, sprite_count=other["sprite_count"] + 1),
+        dict(other, level_state=dict(other["level_state"], enemies=other["level_state"]["enemies"] + b"\0")),
+        dict(other, projectiles=other["projectiles"] + b"\0"),
+        dict(other, current_level=99),
+    ]
+    for game_data in bad_saves:
+        with pytest.raises(ValueError):
+            world.load_data(game_data)
+        assert world.level.number == world.current_level == 1
+        assert world_state(world) == state
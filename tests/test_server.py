@@ -0,0 +1,31 @@
+from pathlib import Path
+
+import numpy
+import pytest
+import pytiled_parser
+
+from rules import LEVEL_RULES
+from server import attach_maps, compile_maps, share_maps
+from tilemesh import tile_layers
+
+
+def test_shared_maps():
+    gids, maps = compile_maps()
+    memory = share_maps(gids, maps)
+    try:
+        attached, tiled_maps = attach_maps(memory.name, gids.size, len(maps))
+        for level, rules in LEVEL_RULES.items():
+            parsed = pytiled_parser.parse_map(Path(rules["map"]))
+            layers = list(tile_layers(tiled_maps[level].layers))
+            assert [layer.name for layer in layers] == [layer.name for layer in tile_layers(parsed.layers)]
+            for layer, parsed_layer in zip(layers, tile_layers(parsed.layers)):
+                # The tile ids are read-only views on the shared block, not copies
+                assert numpy.shares_memory(layer.data, numpy.frombuffer(attached.buf, numpy.uint8))
+                assert layer.data.tolist() == parsed_layer.data
+                with pytest.raises(ValueError):
+                    layer.data[0, 0] = 0
+        del layers, layer, tiled_maps
+        attached.close()
+    finally:
+        memory.close()
+        memory.unlink()
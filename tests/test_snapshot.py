@@ -0,0 +1,67 @@
+import pytest
+
+from bench import new_world, scripted_buttons, world_state
+from snapshot import Snapshot, SnapshotRing
+
+
+@pytest.mark.parametrize("level", (1, 2))
+def test_round_trip(level):
+    world = new_world(level)
+    inputs = scripted_buttons(300)
+    for buttons in inputs[:150]:
+        world.update(*buttons)
+    snapshot = Snapshot()
+    world.capture_snapshot(snapshot)
+    expected = world_state(world)
+    checksum = snapshot.checksum()
+
+    for buttons in inputs[150:]:
+        world.update(*buttons)
+    later = world_state(world)
+    assert later != expected
+
+    world.restore_snapshot(snapshot)
+    assert world_state(world) == expected
+    world.capture_snapshot(snapshot)
+    assert snapshot.checksum() == checksum
+
+    # The same buttons from the restored state end in the same state
+    for buttons in inputs[150:]:
+        world.update(*buttons)
+    assert world_state(world) == later
+
+
+def test_ring_keeps_the_last_ticks():
+    world = new_world(1)
+    ring = SnapshotRing(4)
+    states = {}
+    for buttons in scripted_buttons(10):
+        world.update(*buttons)
+        ring.capture(world)
+        states[world.tick] = world_state(world)
+
+    assert ring.get(world.tick - 4) is None
+    with pytest.raises(KeyError):
+        ring.restore(world, world.tick - 4)
+    for tick in range(world.tick - 3, world.tick + 1):
+        ring.restore(world, tick)
+        assert world_state(world) == states[tick]
+
+
+def test_restore_across_levels():
+    world = new_world(1)
+    world.fire_trigger(0)
+    snapshot = Snapshot()
+    world.capture_snapshot(snapshot)
+    expected = world_state(world)
+
+    world.current_level = 2
+    world.setup_level(2)
+    sounds = []
+    world.sound_handler = lambda *sound: sounds.append(sound)
+    world.restore_snapshot(snapshot)
+
+    assert world.current_level == 1
+    assert world_state(world) == expected
+    # Restoring is not playing: the level's music does not start again
+    assert sounds == []
@@ -0,0 +1,43 @@
+import pytest
+
+from bench import new_world
+from rules import LEVEL_RULES
+from tilegrid import TileGrid
+
+
+def small_grid():
+    # 3 x 2 cells of 10 pixels, rows counted from the bottom
+    return TileGrid(3, 2, {"a": bytearray([1, 0, 0, 0, 0, 1]), "b": bytearray([1, 1, 0, 0, 0, 0])}, cell_size=10)
+
+
+def test_cells():
+    grid = small_grid()
+    assert grid.cell(25, 5) == (2, 0)
+    assert grid.cell(9.9, 10) == (0, 1)
+    assert grid.has_tile("a", 0, 0) and grid.has_tile("a", 2, 1)
+    assert not grid.has_tile("a", 1, 0)
+    assert grid.cells("a") == [(0, 0), (2, 1)]
+
+
+def test_outside_the_map_is_empty():
+    grid = small_grid()
+    for col, row in ((-1, 0), (3, 0), (0, -1), (0, 2)):
+        assert not grid.has_tile("a", col, row)
+
+
+def test_union():
+    assert small_grid().union(["a", "b"]) == bytearray([1, 1, 0, 0, 0, 1])
+    assert small_grid().union([]) == bytearray(6)
+
+
+@pytest.mark.parametrize("level", sorted(LEVEL_RULES))
+def test_layers_match_the_level(level):
+    grid = TileGrid.from_map(LEVEL_RULES[level]["map"])
+    world = new_world(level)
+    tile_map = world.level.tile_map
+    assert (grid.width, grid.height) == (tile_map.width, tile_map.height)
+    for name in world.level.layer_names:
+        # A tile's image is drawn up and to the right from the corner of its cell
+        cells = {grid.cell(sprite.center_x - sprite.width / 2 + 1, sprite.center_y - sprite.height / 2 + 1)
+                 for sprite in world.scene[name]}
+        assert set(grid.cells(name)) == cells, name
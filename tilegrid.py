@@ -0,0 +1,74 @@
+"""
+Tile layers of a level as flat grids, read straight from the Tiled map file.
+
+Building a Level creates a sprite for every tile, which is what drawing and
+the physics engine need. Code that only asks "which layers have a tile in
+this cell" (agents, path finding, level checks) can use a TileGrid instead,
+which loads in a few milliseconds and needs no arcade at all.
+
+Rows count from the bottom of the map like world coordinates do, so the
+cell of a point is (x // cell_size, y // cell_size).
+"""
+import json
+
+from assetpack import open_file
+from constants import GRID_PIXEL_SIZE
+
+
+class TileGrid:
+    """Which cells of a map each tile layer covers, one byte per cell and layer."""
+
+    def __init__(self, width, height, layers, cell_size=GRID_PIXEL_SIZE):
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        # Layer name -> bytearray of width * height, 1 where the layer has a tile
+        self.layers = layers
+        self.layer_names = list(layers)
+
+    @classmethod
+    def from_map(cls, map_name, cell_size=GRID_PIXEL_SIZE):
+        with open_file(map_name) as file:
+            tiled_map = json.load(file)
+        width, height = tiled_map["width"], tiled_map["height"]
+
+        layers = {}
+        for layer in tiled_map["layers"]:
+            if layer["type"] != "tilelayer":
+                continue
+            data = layer["data"]
+            if not isinstance(data, list):
+                raise ValueError(f"layer {layer['name']!r} of {map_name} is not stored as a plain list of tiles")
+            cells = bytearray(width * height)
+            for tiled_row in range(height):
+                row = height - 1 - tiled_row
+                for col, gid in enumerate(data[tiled_row * width:(tiled_row + 1) * width]):
+                    if gid:
+                        cells[row * width + col] = 1
+            layers[layer["name"]] = cells
+        return cls(width, height, layers, cell_size)
+
+    def cell(self, x, y):
+        """The (col, row) of the cell containing a point in world coordinates."""
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def has_tile(self, name, col, row):
+        """Whether a layer has a tile in a cell. Cells outside the map are empty."""
+        if 0 <= col < self.width and 0 <= row < self.height:
+            return self.layers[name][row * self.width + col] == 1
+        return False
+
+    def cells(self, name):
+        """The (col, row) of every cell a layer has a tile in."""
+        layer = self.layers[name]
+        return [(index % self.width, index // self.width) for index, value in enumerate(layer) if value]
+
+    def union(self, names):
+        """One grid with the cells covered by any of the layers."""
+        cells = bytearray(self.width * self.height)
+        for name in names:
+            layer = self.layers[name]
+            for index, value in enumerate(layer):
+                if value:
+                    cells[index] = 1
+        return cells
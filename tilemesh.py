@@ -0,0 +1,706 @@
+"""
+Tile layers drawn as static meshes.
+
+Drawing a level from its Scene means a full arcade.Sprite per tile, with
+its own position, scale, hit box and spatial hash entry, even for the
+background layers that never move or change. A LevelRenderer builds one
+buffer per tile layer straight from the Tiled map's tile ids instead: a
+point per tile with its corner, its texture's slot in the atlas and its
+alpha, 12 bytes in all. A geometry shader turns each point into the tile's
+scaled quad, so a layer is drawn with a single call.
+
+Only the part of a layer near the camera is drawn. A mesh's tiles are
+sorted into square chunks of CHUNK_CELLS cells, a column of chunks after
+the other, so the chunks in view are one range of the buffer per column of
+chunks, or a single range when the view is as tall as the map. Finding
+them takes the same time however wide the map is.
+
+Background layers with a "parallax" property are not drawn tile by tile.
+Their mesh is drawn once into a texture at the art's resolution, and the
+layer is then a single quad over the view, repeating horizontally, that
+scrolls at the property's fraction of the camera's speed. The texture holds
+premultiplied colors and is drawn with premultiplied alpha blending: with
+straight alpha, the tiles' soft edges would be blended once into the
+texture's transparent black and once more onto the screen, and show dark
+fringes.
+
+Zooming out shows more tiles at once. Past LOD_ZOOM, the dense decoration
+layers without animated tiles are drawn the same way, from a texture of
+the whole layer composed up front with mipmaps, instead of tile by tile.
+Sparse layers stay meshes: a quad over the view would blend more empty
+pixels than their tiles cost. A zoomed out view can also be taller than
+the map, the farthest parallax layer then stretches its top row up to the
+top of the view.
+
+Animated tiles are animated on the GPU as well. A tile's slot is then
+negative and points to a row of a small float texture holding the atlas
+slot and end time of every frame, and the shader picks the frame from a
+time uniform. Animations come from Tiled tile animations and from the
+manifest's frame image sequences (rules.TILE_ANIMATIONS), so the fire
+columns and waterfalls move without any Python work per frame.
+
+The World only creates sprites for the layers its logic looks at (see
+rules.py). Those layers are drawn from meshes too: when a layer of the
+Level changes, the alpha of its mesh's tiles is rewritten from the Level's
+membership and alpha buffers, which hides collected coins and cleared
+walls and shows tiles moved into the layer.
+"""
+import copy
+import struct
+import time
+from array import array
+
+import arcade
+import attr
+import pytiled_parser
+from arcade.gl import ONE, ONE_MINUS_SRC_ALPHA, BufferDescription
+
+from constants import TILE_SCALING
+from level import HIDDEN_ALPHA
+from rules import TILE_ANIMATIONS
+
+# Side of a chunk of tiles, in cells
+CHUNK_CELLS = 8
+
+# Zoom, in world pixels per window pixel, past which static decoration layers are drawn from their textures
+LOD_ZOOM = 1.2
+# Part of its band a decoration layer's tiles have to cover for its texture to be drawn when zoomed out
+LOD_COVERAGE = 0.4
+
+# Texture unit of the parallax layers' textures, after the tiles' three
+PARALLAX_TEXTURE_UNIT = 3
+# Blend function of colors already multiplied by their alpha
+BLEND_PREMULTIPLIED = ONE, ONE_MINUS_SRC_ALPHA
+
+# One tile: x and y of its lower left corner in pixels, atlas slot (or -1 - animation), alpha, padding.
+# Corners are 32 bit, a map can be far more than 32767 pixels wide.
+TILE = struct.Struct("<iihBx")
+ALPHA_OFFSET = 10
+
+# Versions a level layer's mesh starts at, before its first sync
+UNSYNCED = 2 ** 64 - 1
+
+VERTEX_SHADER = """
+#version 330
+
+in vec2 in_pos;
+in float in_slot;
+in float in_alpha;
+
+out float v_slot;
+out float v_alpha;
+
+void main() {
+    gl_Position = vec4(in_pos, 0.0, 1.0);
+    v_slot = in_slot;
+    v_alpha = in_alpha;
+}
+"""
+
+GEOMETRY_SHADER = """
+#version 330
+layout (points) in;
+layout (triangle_strip, max_vertices = 4) out;
+
+uniform Projection {
+    uniform mat4 matrix;
+} proj;
+
+uniform sampler2D sprite_texture;
+uniform sampler2D uv_texture;
+// Row per animation: (frame count, duration) then (atlas slot, end time) of every frame
+uniform sampler2D animations;
+uniform float time;
+uniform float scaling;
+
+in float v_slot[];
+in float v_alpha[];
+
+out vec2 gs_uv;
+out float gs_alpha;
+
+void main() {
+    // Hidden tiles are skipped here rather than removed from the buffer
+    if (v_alpha[0] == 0.0) {
+        return;
+    }
+
+    float slot = v_slot[0];
+    if (slot < 0.0) {
+        int row = int(-slot) - 1;
+        vec2 animation = texelFetch(animations, ivec2(0, row), 0).xy;
+        int count = int(animation.x);
+        float now = mod(time, animation.y);
+        slot = texelFetch(animations, ivec2(count, row), 0).x;
+        for (int frame = 1; frame < count; frame++) {
+            vec2 frame_data = texelFetch(animations, ivec2(frame, row), 0).xy;
+            if (now < frame_data.y) {
+                slot = frame_data.x;
+                break;
+            }
+        }
+    }
+
+    // Texture coordinates and size of the tile's image, the same way arcade's sprite shader reads them
+    vec4 uv_data = texelFetch(uv_texture, ivec2(slot, 0), 0);
+    vec2 tex_offset = uv_data.xy;
+    vec2 tex_size = uv_data.zw;
+    vec2 size = tex_size * textureSize(sprite_texture, 0) * scaling;
+    vec2 corner = gl_in[0].gl_Position.xy;
+
+    // Upper left
+    gl_Position = proj.matrix * vec4(corner + vec2(0.0, size.y), 0.0, 1.0);
+    gs_uv = (vec2(0.0, tex_size.y) + tex_offset) * vec2(1.0, -1.0);
+    gs_alpha = v_alpha[0];
+    EmitVertex();
+
+    // Lower left
+    gl_Position = proj.matrix * vec4(corner, 0.0, 1.0);
+    gs_uv = tex_offset * vec2(1.0, -1.0);
+    gs_alpha = v_alpha[0];
+    EmitVertex();
+
+    // Upper right
+    gl_Position = proj.matrix * vec4(corner + size, 0.0, 1.0);
+    gs_uv = (tex_size + tex_offset) * vec2(1.0, -1.0);
+    gs_alpha = v_alpha[0];
+    EmitVertex();
+
+    // Lower right
+    gl_Position = proj.matrix * vec4(corner + vec2(size.x, 0.0), 0.0, 1.0);
+    gs_uv = (vec2(tex_size.x, 0.0) + tex_offset) * vec2(1.0, -1.0);
+    gs_alpha = v_alpha[0];
+    EmitVertex();
+
+    EndPrimitive();
+}
+"""
+
+FRAGMENT_SHADER = """
+#version 330
+
+uniform sampler2D sprite_texture;
+// Composing a parallax layer's texture, which holds premultiplied colors
+uniform bool premultiply;
+
+in vec2 gs_uv;
+in float gs_alpha;
+
+out vec4 f_color;
+
+void main() {
+    vec4 color = texture(sprite_texture, gs_uv);
+    color.a *= gs_alpha;
+    if (color.a == 0.0) {
+        discard;
+    }
+    if (premultiply) {
+        color.rgb *= color.a;
+    }
+    f_color = color;
+}
+"""
+
+
+class TileMesh:
+    """The tiles of one layer in a single buffer, sorted into chunks of `chunk_size` pixels."""
+
+    def __init__(self, ctx, program, tiles, chunk_size, visible=True):
+        self.program = program
+        self.count = len(tiles) // TILE.size
+        self.visible = visible
+        self.chunk_size = chunk_size
+
+        # Chunk of every tile, and the tiles sorted by chunk: order[i] is the index in `tiles` of the i-th tile
+        chunks = [(x // chunk_size, y // chunk_size) for x, y, _, _ in TILE.iter_unpack(tiles)]
+        self.order = sorted(range(self.count), key=chunks.__getitem__)
+        self.tiles = bytearray().join(tiles[index * TILE.size:(index + 1) * TILE.size] for index in self.order)
+
+        # starts[column][row] is the first tile of a chunk, starts[column][rows] the end of the column
+        self.columns = max((column for column, _ in chunks), default=-1) + 1
+        self.rows = max((row for _, row in chunks), default=-1) + 1
+        counts = {}
+        for chunk in chunks:
+            counts[chunk] = counts.get(chunk, 0) + 1
+        self.starts = []
+        start = 0
+        for column in range(self.columns):
+            column_starts = []
+            for row in range(self.rows):
+                column_starts.append(start)
+                start += counts.get((column, row), 0)
+            column_starts.append(start)
+            self.starts.append(column_starts)
+
+        self.buffer = ctx.buffer(data=bytes(self.tiles))
+        self.geometry = ctx.geometry([
+            BufferDescription(self.buffer, "2i4 1i2 1f1 1x1", ["in_pos", "in_slot", "in_alpha"], normalized=["in_alpha"]),
+        ])
+
+    def set_alpha(self, index, alpha):
+        """Change the alpha of one tile, by its index in the sorted tiles. 0 hides it."""
+        offset = index * TILE.size
+        self.tiles[offset + ALPHA_OFFSET] = alpha
+        self.buffer.write(bytes(self.tiles[offset:offset + TILE.size]), offset=offset)
+
+    def set_alphas(self, alphas):
+        """Change the alpha of every tile at once, in the sorted order."""
+        self.tiles[ALPHA_OFFSET::TILE.size] = alphas
+        self.buffer.write(bytes(self.tiles))
+
+    def ranges(self, left, right, bottom, top):
+        """The (first, stop) ranges of the tiles whose chunk overlaps the area, touching ones merged."""
+        size = self.chunk_size
+        first_column, last_column = max(int(left // size), 0), min(int(right // size), self.columns - 1)
+        first_row, last_row = max(int(bottom // size), 0), min(int(top // size), self.rows - 1)
+        ranges = []
+        if first_row > last_row:
+            return ranges
+        for column in range(first_column, last_column + 1):
+            start = self.starts[column][first_row]
+            stop = self.starts[column][last_row + 1]
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], stop)
+            elif start < stop:
+                ranges.append((start, stop))
+        return ranges
+
+    def draw(self, view=None, margin=0):
+        """
+        Draw the tiles whose chunk overlaps view = (left, bottom, width, height)
+        grown by `margin` on the left and bottom, all of them if view is None.
+        Returns the number of tiles drawn.
+        """
+        if not (self.visible and self.count):
+            return 0
+        if view is None:
+            ranges = [(0, self.count)]
+        else:
+            left, bottom, width, height = view
+            ranges = self.ranges(left - margin, left + width, bottom - margin, bottom + height)
+        for start, stop in ranges:
+            self.geometry.render(self.program, mode=self.program.ctx.POINTS, first=start, vertices=stop - start)
+        return sum(stop - start for start, stop in ranges)
+
+
+PARALLAX_VERTEX_SHADER = """
+#version 330
+
+uniform Projection {
+    uniform mat4 matrix;
+} proj;
+
+// x, y, width and height of the quad, and its texture coordinates (left, bottom, right, top)
+uniform vec4 rect;
+uniform vec4 uv_rect;
+
+in vec2 in_vert;
+
+out vec2 v_uv;
+
+void main() {
+    gl_Position = proj.matrix * vec4(rect.xy + in_vert * rect.zw, 0.0, 1.0);
+    v_uv = mix(uv_rect.xy, uv_rect.zw, in_vert);
+}
+"""
+
+PARALLAX_FRAGMENT_SHADER = """
+#version 330
+
+uniform sampler2D image;
+
+in vec2 v_uv;
+
+out vec4 f_color;
+
+void main() {
+    f_color = texture(image, v_uv);
+}
+"""
+
+
+class ParallaxLayer:
+    """
+    A background layer drawn once into a texture, then as one quad scrolling at
+    `factor` of the camera's speed. The texture only holds the band of the layer
+    between `bottom` and `top`, where its tiles are. With a factor of 1 it is a
+    decoration layer's stand-in when zoomed out. A backdrop reaches up to the
+    top of the view, repeating its top row.
+    """
+
+    def __init__(self, ctx, program, mesh, factor, width, bottom, top, scaling, backdrop=False):
+        self.program = program
+        self.count = mesh.count
+        self.visible = mesh.visible
+        self.factor = factor
+        self.backdrop = backdrop
+        self.width = width
+        self.bottom = bottom
+        self.top = top
+        texture = ctx.texture((int(width // scaling), int((top - bottom) // scaling)), components=4)
+        texture.filter = ctx.NEAREST, ctx.NEAREST
+        texture.wrap_x = ctx.REPEAT
+        texture.wrap_y = ctx.CLAMP_TO_EDGE
+        self.texture = texture
+        self.framebuffer = ctx.framebuffer(color_attachments=[texture])
+        self.mesh = mesh
+        self.geometry = ctx.geometry([BufferDescription(ctx.buffer(data=array("f", [0, 0, 1, 0, 0, 1, 1, 1])), "2f", ["in_vert"])],
+                                     mode=ctx.TRIANGLE_STRIP)
+
+    def compose(self):
+        """Draw the layer's tiles into the texture, with the tile program's textures bound."""
+        ctx = self.framebuffer.ctx
+        projection = ctx.projection_2d
+        with self.framebuffer.activate():
+            self.framebuffer.clear()
+            ctx.projection_2d = (0, self.width, self.bottom, self.top)
+            self.mesh.draw()
+        ctx.projection_2d = projection
+        # Smaller copies to read from when zoomed out
+        self.texture.build_mipmaps()
+        self.texture.filter = ctx.NEAREST_MIPMAP_NEAREST, ctx.NEAREST
+        # The tiles are only needed again to compose
+        self.mesh = None
+
+    def draw(self, view=None, margin=0):
+        """Draw the quad over the view, all of the layer in place if view is None."""
+        if not (self.visible and self.count):
+            return 0
+        left, bottom, width, height = (0, 0, self.width, 0) if view is None else view
+        # The part of the layer the camera sees when it has moved `factor` as far
+        u = left * self.factor / self.width
+        band_bottom = bottom * (1 - self.factor) + self.bottom
+        band_height = self.top - self.bottom
+        if self.backdrop:
+            band_height = max(band_height, bottom + height - band_bottom)
+        self.program["rect"] = (left, band_bottom, width, band_height)
+        self.program["uv_rect"] = (u, 0, u + width / self.width, band_height / (self.top - self.bottom))
+        self.texture.use(PARALLAX_TEXTURE_UNIT)
+        ctx = self.program.ctx
+        ctx.blend_func = BLEND_PREMULTIPLIED
+        self.geometry.render(self.program)
+        ctx.blend_func = ctx.BLEND_DEFAULT
+        return self.count
+
+
+def tile_layers(layers):
+    """Every tile layer of a list of Tiled layers, those in groups too."""
+    for layer in layers:
+        if isinstance(layer, pytiled_parser.TileLayer):
+            yield layer
+        elif isinstance(layer, pytiled_parser.LayerGroup):
+            yield from tile_layers(layer.layers)
+
+
+class TileSource:
+    """Turns the tile ids of a Tiled map into tiles and sprites the way arcade does, with their animations."""
+
+    def __init__(self, tiled_map, scaling=TILE_SCALING):
+        self.tiled_map = tiled_map
+        self.scaling = scaling
+        # A TileMap without layers, to turn tile ids into textures the way arcade does
+        self.tile_map = arcade.TileMap(tiled_map=attr.evolve(tiled_map, layers=[]), scaling=scaling)
+
+    def tile(self, gid):
+        tile = self.tile_map._get_tile_by_gid(gid)
+        if tile is None:
+            raise ValueError(f"couldn't find tile {gid} in {self.tiled_map.map_file}")
+        # arcade leaves out the animation of a tile from a tileset image, like the ones of packed maps
+        if not tile.animation and tile.tileset.image is not None:
+            tile.animation = getattr((tile.tileset.tiles or {}).get(tile.id), "animation", None)
+        return tile
+
+    def sprite(self, tile):
+        return self.tile_map._create_sprite_from_tile(tile, scaling=self.scaling, hit_box_algorithm="None")
+
+    def frames(self, tile):
+        """The frames of an animated tile as (tile, milliseconds), None if it is not animated."""
+        if tile.animation:
+            frames = []
+            for frame in tile.animation:
+                # Frames are other tiles of the same tileset, with the flips of the animated one
+                frame_tile = copy.copy((tile.tileset.tiles or {}).get(frame.tile_id) or tile)
+                frame_tile.id = frame.tile_id
+                frame_tile.animation = None
+                frame_tile.tileset = tile.tileset
+                for flip in ("flipped_horizontally", "flipped_vertically", "flipped_diagonally"):
+                    setattr(frame_tile, flip, getattr(tile, flip))
+                frames.append((frame_tile, frame.duration))
+            return frames
+
+        image = tile.image or tile.tileset.image
+        for images, duration in TILE_ANIMATIONS:
+            if image is not None and image.resolve() in images:
+                # The same part of every frame image, starting at the tileset's own image
+                start = images.index(image.resolve())
+                frames = []
+                for frame_image in images[start:] + images[:start]:
+                    frame_tile = copy.copy(tile)
+                    frame_tile.image = frame_image
+                    frames.append((frame_tile, duration))
+                return frames
+        return None
+
+    def textures(self):
+        """
+        The textures of every tile of the map's tile layers, animation frames
+        included, the ones a LevelRenderer adds to the atlas as it is built.
+        """
+        textures = {}
+        gids = {gid for layer in tile_layers(self.tiled_map.layers) for row in layer.data for gid in row if gid}
+        for gid in sorted(gids):
+            tile = self.tile(gid)
+            frames = self.frames(tile)
+            for frame in [tile] if frames is None else [frame for frame, _ in frames]:
+                texture = self.sprite(frame).texture
+                textures[texture.name] = texture
+        return list(textures.values())
+
+
+class LevelRenderer:
+    """Draws every tile layer of a Level's map from meshes, in the map's order."""
+
+    def __init__(self, level, rules, scaling=TILE_SCALING):
+        self.level = level
+        self.ctx = arcade.get_window().ctx
+        self.atlas = self.ctx.default_atlas
+        self.program = self.ctx.program(
+            vertex_shader=VERTEX_SHADER, geometry_shader=GEOMETRY_SHADER, fragment_shader=FRAGMENT_SHADER,
+        )
+        self.program["sprite_texture"] = 0
+        self.program["uv_texture"] = 1
+        self.program["animations"] = 2
+        self.program["scaling"] = scaling
+        self.parallax_program = self.ctx.program(vertex_shader=PARALLAX_VERTEX_SHADER, fragment_shader=PARALLAX_FRAGMENT_SHADER)
+        self.parallax_program["image"] = PARALLAX_TEXTURE_UNIT
+        self.start_time = time.perf_counter()
+
+        tiled_map = level.tiled_map
+        self.tiles = TileSource(tiled_map, scaling)
+        self.scaling = scaling
+        self.slots = {}
+        # Frames of every animation as (atlas slot, milliseconds), and the animation index of each
+        self.animations = []
+        self.animation_index = {}
+        # Width or height of the biggest tile, a tile can show this far from its corner
+        cell_size = tiled_map.tile_size.width * scaling
+        self.margin = cell_size
+        chunk_size = CHUNK_CELLS * cell_size
+
+        # Tiles drawn and left out in the last frame, over all its views
+        self.drawn = 0
+        self.culled = 0
+
+        # Layers moved into each layer by triggers, their tiles are in that layer's mesh too
+        sources = {}
+        for _, _, _, _, moves, _ in rules["effects"]:
+            for name, destination in moves:
+                sources.setdefault(destination, []).append(name)
+
+        # (mesh, level layer index or None for decoration) in drawing order
+        self.meshes = []
+        # Textures drawn instead of the static decoration meshes when zoomed out, by index in meshes
+        self.lods = {}
+        # For the meshes of level layers: sprite index of every tile, the layers their tiles come from
+        # and the versions they were synced at: the layer's, then the alpha version of each of those
+        self.sprite_indices = {}
+        self.origins = {}
+        self.synced = {}
+        layers = {layer.name: layer for layer in tile_layers(tiled_map.layers)}
+        for name, layer in layers.items():
+            tiles = self._layer_tiles(layer)
+            layer_index = level.layer_by_name.get(name)
+            if layer_index is None:
+                # Decoration: the alpha Tiled gave the layer, or a hidden layer of opaque tiles like Level does
+                alpha = int(layer.opacity * 255) if layer.opacity else 255
+                visible = layer.visible and alpha >= HIDDEN_ALPHA
+                tiles[ALPHA_OFFSET::TILE.size] = bytes([255 if alpha < HIDDEN_ALPHA else alpha]) * (len(tiles) // TILE.size)
+                mesh = TileMesh(self.ctx, self.program, tiles, chunk_size, visible)
+                animated = any(slot < 0 for _, _, slot, _ in TILE.iter_unpack(tiles))
+                factor = (layer.properties or {}).get("parallax")
+                if factor is not None:
+                    if animated:
+                        raise ValueError(f"parallax layer {name!r} of {tiled_map.map_file} has animated tiles")
+                    mesh = self._composed(mesh, tiles, float(factor), backdrop=not self.meshes)
+                elif not animated and mesh.visible and mesh.count:
+                    bottom, top = self._band(tiles)
+                    if mesh.count * cell_size ** 2 >= LOD_COVERAGE * tiled_map.map_size.width * cell_size * (top - bottom):
+                        self.lods[len(self.meshes)] = self._composed(mesh, tiles, 1.0)
+                self.meshes.append((mesh, None))
+                continue
+
+            start, stop = level.origin_ranges[layer_index]
+            indices = array("I", range(start, stop))
+            origins = [layer_index]
+            for source in sources.get(name, ()):
+                tiles += self._layer_tiles(layers[source])
+                origins.append(level.layer_by_name[source])
+                indices.extend(range(*level.origin_ranges[origins[-1]]))
+            mesh = TileMesh(self.ctx, self.program, tiles, chunk_size)
+            self.sprite_indices[layer_index] = array("I", (indices[index] for index in mesh.order))
+            self.origins[layer_index] = origins
+            self.synced[layer_index] = array("Q", [UNSYNCED] * (len(origins) + 1))
+            self.meshes.append((mesh, layer_index))
+
+        self.animation_texture = self._animation_texture()
+        self._compose()
+
+    def _band(self, tiles):
+        """Bottom and top of the rows a layer's tiles use."""
+        tiled_map = self.level.tiled_map
+        rows = [y for _, y, _, _ in TILE.iter_unpack(tiles)] or [0]
+        height = tiled_map.map_size.height * tiled_map.tile_size.height * self.scaling
+        return min(rows), min(max(rows) + self.margin, height)
+
+    def _composed(self, mesh, tiles, factor, backdrop=False):
+        """A ParallaxLayer for a decoration layer's mesh, over the rows its tiles use."""
+        tiled_map = self.level.tiled_map
+        return ParallaxLayer(self.ctx, self.parallax_program, mesh, factor, tiled_map.map_size.width * tiled_map.tile_size.width * self.scaling,
+                             *self._band(tiles), self.scaling, backdrop)
+
+    def _compose(self):
+        """Draw the parallax layers' and the stand-ins' tiles into their textures, premultiplied."""
+        self._bind_textures(pixelated=True)
+        self.program["time"] = 0
+        self.program["premultiply"] = True
+        self.ctx.blend_func = BLEND_PREMULTIPLIED
+        for mesh, _ in self.meshes:
+            if isinstance(mesh, ParallaxLayer):
+                mesh.compose()
+        for lod in self.lods.values():
+            lod.compose()
+        self.program["premultiply"] = False
+        self.ctx.blend_func = self.ctx.BLEND_DEFAULT
+
+    def _bind_textures(self, pixelated):
+        ctx = self.ctx
+        ctx.enable(ctx.BLEND)
+        ctx.blend_func = ctx.BLEND_DEFAULT
+        texture_filter = ctx.NEAREST if pixelated else ctx.LINEAR
+        self.atlas.texture.filter = texture_filter, texture_filter
+        self.atlas.texture.use(0)
+        self.atlas.use_uv_texture(1)
+        self.animation_texture.use(2)
+
+    def _slot(self, gid):
+        """
+        Atlas slot of a tile id's texture, adding the texture the first time.
+        For animated tiles this is -1 - the index of the animation.
+        """
+        slot = self.slots.get(gid)
+        if slot is None:
+            tile = self.tiles.tile(gid)
+            frames = self.tiles.frames(tile)
+            if frames is None:
+                slot = self._texture_slot(tile)
+            else:
+                frames = tuple((self._texture_slot(frame), duration) for frame, duration in frames)
+                if frames not in self.animation_index:
+                    self.animation_index[frames] = len(self.animations)
+                    self.animations.append(frames)
+                slot = -1 - self.animation_index[frames]
+            self.slots[gid] = slot
+        return slot
+
+    def _texture_slot(self, tile):
+        sprite = self.tiles.sprite(tile)
+        slot, _ = self.atlas.add(sprite.texture)
+        self.margin = max(self.margin, sprite.width, sprite.height)
+        return slot
+
+    def _animation_texture(self):
+        """The animation table the shader reads, one row per animation."""
+        width = max((len(frames) for frames in self.animations), default=0) + 1
+        data = array("f", [0.0] * (width * 2 * max(len(self.animations), 1)))
+        for row, frames in enumerate(self.animations):
+            offset = row * width * 2
+            end = 0
+            for column, (slot, duration) in enumerate(frames, 1):
+                end += duration
+                data[offset + column * 2] = slot
+                data[offset + column * 2 + 1] = end
+            data[offset] = len(frames)
+            data[offset + 1] = end
+        texture = self.ctx.texture((width, max(len(self.animations), 1)), components=2, dtype="f4", data=data.tobytes())
+        texture.filter = self.ctx.NEAREST, self.ctx.NEAREST
+        return texture
+
+    def _layer_tiles(self, layer):
+        """The tiles of a layer, in the order arcade creates their sprites."""
+        tiled_map = self.level.tiled_map
+        cell_width = tiled_map.tile_size.width * self.scaling
+        cell_height = tiled_map.tile_size.height * self.scaling
+        height = tiled_map.map_size.height
+        tiles = bytearray()
+        for row_index, row in enumerate(layer.data):
+            y = int((height - row_index - 1) * cell_height)
+            for column_index, gid in enumerate(row):
+                if gid:
+                    tiles += TILE.pack(int(column_index * cell_width), y, self._slot(gid), 255)
+        return tiles
+
+    def sync(self):
+        """Bring the meshes of the level's layers up to date with the level's buffers."""
+        level = self.level
+        for mesh, layer_index in self.meshes:
+            if layer_index is None:
+                continue
+            mesh.visible = bool(level.visible[layer_index])
+            # Only the alpha of the layers the mesh's tiles come from shows in it
+            synced = self.synced[layer_index]
+            changed = synced[0] != level.layer_versions[layer_index]
+            synced[0] = level.layer_versions[layer_index]
+            for position, origin in enumerate(self.origins[layer_index], 1):
+                if synced[position] != level.alpha_versions[origin]:
+                    synced[position] = level.alpha_versions[origin]
+                    changed = True
+            if not changed:
+                continue
+
+            offset = layer_index * level.stride
+            membership = level.membership
+            alpha = level.alpha
+            mesh.set_alphas(bytes(
+                alpha[index] if membership[offset + (index >> 3)] & (1 << (index & 7)) else 0
+                for index in self.sprite_indices[layer_index]
+            ))
+
+    def draw(self, scene=None, pixelated=True, now=None, view=None):
+        """
+        Draw the map, then the scene's sprite lists that are not tile layers (players).
+        Animations are at `now` seconds, by default the time since the renderer was built.
+        With view = (left, bottom, width, height), only the tiles near it are drawn
+        and the parallax layers scroll with it.
+        """
+        self.update(now)
+        self.draw_view(scene, pixelated, view)
+
+    def update(self, now=None):
+        """
+        Bring the meshes and the enemies' sprites up to date for a new frame,
+        once however many views of it are drawn with draw_view.
+        """
+        self.sync()
+        self.level.enemies.sync()
+        self.program["time"] = ((time.perf_counter() - self.start_time) if now is None else now) * 1000
+        self.drawn = 0
+        self.culled = 0
+
+    def draw_view(self, scene=None, pixelated=True, view=None, zoom=1.0):
+        """
+        Draw one view of the frame prepared by update, into the current viewport,
+        `zoom` world pixels per window pixel. The drawn and culled counts add up
+        over the views of a frame.
+        """
+        self._bind_textures(pixelated)
+        for index, (mesh, _) in enumerate(self.meshes):
+            if zoom > LOD_ZOOM:
+                mesh = self.lods.get(index, mesh)
+            drawn = mesh.draw(view, self.margin)
+            self.drawn += drawn
+            self.culled += (mesh.count if mesh.visible else 0) - drawn
+
+        if scene is not None:
+            for name, sprite_list in scene.name_mapping.items():
+                if name not in self.level.layer_by_name:
+                    sprite_list.draw(pixelated=pixelated)
@@ -0,0 +1,618 @@
+import arcade
+
+import hitboxes
+from constants import (
+    BUTTON_ATTACK, BUTTON_CONTINUE, BUTTON_JUMP, BUTTON_LEFT, BUTTON_RIGHT, CHARACTER_BUFFER, CHARACTER_SCALING,
+    GRAVITY, GRID_PIXEL_SIZE, PLAYER_JUMP_SPEED, PLAYER_MOVEMENT_SPEED, PLAYER_STATES,
+    SCREEN_WIDTH, TILE_SCALING,
+)
+from level import Level
+from player import Player, load_textures
+from projectiles import Projectiles
+from rules import FIRST_LEVEL, LEVEL_RULES, PLAYER_BOXES, PLAYER_DIRECTORIES, SURFACE_SOUNDS, SURFERS, wall_layers
+from snapshot import PLAYER_FLOATS, PLAYER_INTS
+
+# World flags, in the order of their bits in snapshots
+WORLD_FLAGS = ("between_levels", "game_end", "paused", "end_sound_played")
+# Snapshots keep the triggers_fired bitset in the bits above the world flags
+TRIGGER_SHIFT = 8
+PLAYER_FLAGS = ("facing_right", "can_update_state", "hit_object", "on_special_surface")
+
+
+class World:
+    """
+    The game logic: levels, players, physics, score and progress.
+
+    The World does not need a window. It advances one tick per update() call
+    from the buttons held by each player, and reports sounds through
+    sound_handler instead of playing them.
+    """
+
+    def __init__(self, tiled_maps=None):
+        # Levels that were already built, by level number
+        self.levels = {}
+
+        # Parsed Tiled maps by level number, to build levels from instead of reading the map files
+        self.tiled_maps = tiled_maps or {}
+        self.level = None
+
+        # Compiled rules of the current level, see rules.py
+        self.rules = None
+
+        # Our TileMap Object
+        self.tile_map = None
+
+        # Our Scene Object
+        self.scene = None
+
+        # Separate variable that holds the player sprite
+        self.player_sprite_1 = None
+        self.player_sprite_2 = None
+
+        # Our physics engine
+        self.physics_engine_1 = None
+        self.physics_engine_2 = None
+
+        # Keep track of the score
+        self.score = 0
+
+        # Number of updates since setup
+        self.tick = 0
+
+        # Buttons held by each player during the last update
+        self.buttons_1 = 0
+        self.buttons_2 = 0
+
+        # Players' positions - to add constraints
+        self.player_initial_position = None
+
+        self.end_of_map = 0
+        self.top_of_map = 0
+
+        # Left edge and width of the view both players have to stay in
+        self.camera_x = 0
+        self.view_width = SCREEN_WIDTH
+
+        # With split screen the players are free to move apart, the view is split in two when they do
+        self.split_screen = False
+
+        # Current level
+        self.current_level = 0
+
+        # Between levels
+        self.between_levels = True
+
+        # Game end
+        self.game_end = False
+
+        # Game state variable
+        self.game_state = "RUNNING"
+
+        # Bitset of the current level's triggers that fired at least once
+        self.triggers_fired = 0
+
+        # Wall layers of the current level, by (player or None for enemies, triggers_fired)
+        self.wall_names = {}
+
+        # Projectiles of the special attacks, a pool that lives as long as the World
+        self.projectiles = Projectiles()
+
+        # Sounds
+        self.end_sound_played = False
+
+        # Called with (sound file, volume, loop) for every sound the game plays
+        self.sound_handler = None
+
+    @property
+    def paused(self):
+        return self.game_state == "PAUSED"
+
+    @paused.setter
+    def paused(self, value):
+        self.game_state = "PAUSED" if value else "RUNNING"
+
+    def play_sound(self, name, volume=1.0, loop=False):
+        if self.sound_handler is not None:
+            self.sound_handler(name, volume, loop)
+
+    def setup(self):
+        """Set up the game here. Call this function to restart the game."""
+
+        # Keep track of the score
+        self.score = 0
+        self.tick = 0
+
+        # Set up the players, specifically placing it at these coordinates.
+        textures_1 = load_textures(PLAYER_DIRECTORIES[0])
+        self.player_sprite_1 = Player(textures_1, scale=CHARACTER_SCALING)
+
+        textures_2 = load_textures(PLAYER_DIRECTORIES[1])
+        self.player_sprite_2 = Player(textures_2, scale=CHARACTER_SCALING)
+
+        # Set initial state for each character
+        self.player_sprite_1.state = "idle"
+        self.player_sprite_2.state = "idle"
+
+        # Store characters' initial positions
+        self.player_initial_position = min(self.player_sprite_1.left, self.player_sprite_2.left)
+
+        # Set up the level
+        self.current_level = FIRST_LEVEL
+        self.setup_level(self.current_level)
+
+    def load_level(self, level):
+        """Return the built Level for a level number, building it on first use."""
+        if level not in self.levels:
+            rules = LEVEL_RULES[level]
+            # Layers of rectangular tiles skip arcade's hit box scan
+            layer_options = {name: {"hit_box_algorithm": "None"} for name in rules["bounding_boxes"]}
+            # Every layer uses spatial hashing for collision detection. Besides being
+            # cheaper than the GPU collision check for layers this small, it keeps
+            # the World independent from a window and its OpenGL context.
+            self.levels[level] = Level(
+                level, rules["map"], TILE_SCALING, layer_options=layer_options, use_spatial_hash=True,
+                tiled_map=self.tiled_maps.get(level), surface_layers=rules["surfaces"], layers=rules["layers"],
+            )
+            # Keep the hit boxes computed for the level (and the players, loaded before the first level) for the next start
+            hitboxes.save()
+        return self.levels[level]
+
+    def unload_level(self, level):
+        """Tear down a built level other than the current one, setup_level builds it again when it is needed."""
+        built = self.levels.get(level)
+        if built is None:
+            return
+        if built is self.level:
+            raise ValueError(f"level {level} is the current level")
+        del self.levels[level]
+        built.unload()
+
+    def unload(self, textures=True):
+        """Tear down every built level, when the World is not used anymore. See Level.unload for `textures`."""
+        if self.scene is not None:
+            self.player_sprite_1.remove_from_sprite_lists()
+            self.player_sprite_2.remove_from_sprite_lists()
+        for built in self.levels.values():
+            built.unload(textures)
+        self.levels = {}
+        self.level = self.scene = None
+
+    def setup_level(self, level):
+        # Take the players out of the previous level's scene, the level itself stays cached
+        if self.scene is not None:
+            self.player_sprite_1.remove_from_sprite_lists()
+            self.player_sprite_2.remove_from_sprite_lists()
+
+        # Levels are only built once, after that they are reset to their original state
+        self.level = self.load_level(level)
+        self.level.reset()
+        self.tile_map = self.level.tile_map
+        self.scene = self.level.scene
+
+        # Calculate the right edge of the my_map in pixels
+        self.end_of_map = self.tile_map.width * GRID_PIXEL_SIZE
+        self.top_of_map = self.tile_map.height * GRID_PIXEL_SIZE
+
+        self.rules = LEVEL_RULES[level]
+        self.triggers_fired = 0
+        self.wall_names = {}
+        self.projectiles.clear()
+        if self.rules["music"] is not None:
+            sound, volume = self.rules["music"]
+            self.play_sound(sound, volume=volume, loop=True)
+
+        (self.player_sprite_1.center_x, self.player_sprite_1.center_y), \
+            (self.player_sprite_2.center_x, self.player_sprite_2.center_y) = self.rules["spawns"]
+
+        walls_1, walls_2 = self.rules["walls"]
+        self.physics_engine_1 = arcade.PhysicsEnginePlatformer(
+            self.player_sprite_1, gravity_constant=GRAVITY, walls=[self.scene[name] for name in walls_1]
+        )
+        self.physics_engine_2 = arcade.PhysicsEnginePlatformer(
+            self.player_sprite_2, gravity_constant=GRAVITY, walls=[self.scene[name] for name in walls_2]
+        )
+
+        self.scene.add_sprite("Player", self.player_sprite_1)
+        self.scene.add_sprite("Player", self.player_sprite_2)
+        # The same pool in every level's scene
+        if "Projectiles" not in self.scene.name_mapping:
+            self.scene.add_sprite_list("Projectiles", sprite_list=self.projectiles.sprite_list)
+
+        self.player_sprite_1.physics_engine = self.physics_engine_1
+        self.player_sprite_2.physics_engine = self.physics_engine_2
+
+    def update_player_speed(self):
+        # Calculate speed based on the buttons held
+        self.player_sprite_1.change_x = 0
+        self.player_sprite_2.change_x = 0
+
+        direction_1 = self.buttons_1 & (BUTTON_LEFT | BUTTON_RIGHT)
+        if direction_1 == BUTTON_LEFT:
+            self.player_sprite_1.change_x = -PLAYER_MOVEMENT_SPEED
+        elif direction_1 == BUTTON_RIGHT:
+            self.player_sprite_1.change_x = PLAYER_MOVEMENT_SPEED
+
+        direction_2 = self.buttons_2 & (BUTTON_LEFT | BUTTON_RIGHT)
+        if direction_2 == BUTTON_LEFT:
+            self.player_sprite_2.change_x = -PLAYER_MOVEMENT_SPEED
+        elif direction_2 == BUTTON_RIGHT:
+            self.player_sprite_2.change_x = PLAYER_MOVEMENT_SPEED
+
+        # Check if players are on the ground and not moving, then set their state to idle
+        if self.physics_engine_1.can_jump() and self.player_sprite_1.change_x == 0:
+            self.player_sprite_1.update_state("idle")
+        if self.physics_engine_2.can_jump() and self.player_sprite_2.change_x == 0:
+            self.player_sprite_2.update_state("idle")
+
+    def apply_buttons(self, player, physics_engine, previous, buttons, attack_sound):
+        """React to the buttons one player pressed and released since the last update."""
+        pressed = buttons & ~previous
+        released = previous & ~buttons
+
+        if pressed & BUTTON_CONTINUE:
+            self.between_levels = False
+
+        # Jump
+        if pressed & BUTTON_JUMP:
+            if physics_engine.can_jump():
+                player.change_y = PLAYER_JUMP_SPEED
+                player.update_state("jump")
+                self.play_sound("sounds/jump.wav")
+        # Left / Right
+        if pressed & (BUTTON_LEFT | BUTTON_RIGHT):
+            player.facing_right = not pressed & BUTTON_LEFT
+        if (pressed | released) & (BUTTON_LEFT | BUTTON_RIGHT):
+            self.update_player_speed()
+        if pressed & (BUTTON_LEFT | BUTTON_RIGHT):
+            if physics_engine.can_jump():  # Check if the player is not on the ground
+                if player.on_special_surface:
+                    player.update_state("surf")
+                    self.play_sound(SURFACE_SOUNDS[self.surface_under(player)])
+                else:
+                    player.update_state("walk")
+        # Attack
+        if pressed & BUTTON_ATTACK and self.rules["attacks"]:
+            # Only an attack that starts shoots, not pressing again during one
+            if player.can_update_state:
+                left, right, bottom, top = PLAYER_BOXES[player is self.player_sprite_2]
+                self.projectiles.fire(
+                    int(player is self.player_sprite_2), player.center_x + (left + right) / 2,
+                    player.center_y + (bottom + top) / 2, 1 if player.facing_right else -1,
+                )
+            player.update_state("attack")
+            player.can_update_state = False  # Set to False when attack is initiated
+            self.play_sound(attack_sound)
+        if released & (BUTTON_LEFT | BUTTON_RIGHT):
+            player.update_state("idle")
+
+    def surface_under(self, player):
+        """The surface type under a player's feet, see Level.surface_under."""
+        left, right, bottom, _ = PLAYER_BOXES[player is self.player_sprite_2]
+        return self.level.surface_under(player.center_x + (left + right) / 2, player.center_y + bottom)
+
+    def center_camera_to_player(self):
+        # Calculate the distance between the two characters
+        distance = abs(self.player_sprite_1.center_x - self.player_sprite_2.center_x)
+
+        # Only update the camera position if the distance is less than the window width
+        if distance < self.view_width - CHARACTER_BUFFER or self.split_screen:
+            # Find where both players are, then calculate lower left corner from the average position
+            screen_center_x = (self.player_sprite_1.center_x + self.player_sprite_2.center_x) / 2 - (self.view_width / 2)
+
+            # Set some limits on how far we scroll
+            if screen_center_x < 0:
+                screen_center_x = 0
+
+            # Add a condition to limit the camera's position based on the map width
+            elif screen_center_x > self.end_of_map - self.view_width:
+                screen_center_x = self.end_of_map - self.view_width
+
+            # Here's our center, move to it
+            self.camera_x = screen_center_x
+
+        else:
+            # Constrain character movement to the camera view
+            screen_left = self.camera_x
+            screen_right = self.camera_x + self.view_width
+            # Character 1 constraints
+            if self.player_sprite_1.left < screen_left:
+                self.player_sprite_1.left = screen_left
+            if self.player_sprite_1.right > screen_right:
+                self.player_sprite_1.right = screen_right
+
+            # Character 2 constraints
+            if self.player_sprite_2.left < screen_left:
+                self.player_sprite_2.left = screen_left
+            if self.player_sprite_2.right > screen_right:
+                self.player_sprite_2.right = screen_right
+
+    @property
+    def split(self):
+        """Whether the view is split in two, with split screen on and the players too far apart for one view."""
+        distance = abs(self.player_sprite_1.center_x - self.player_sprite_2.center_x)
+        return self.split_screen and distance >= self.view_width - CHARACTER_BUFFER
+
+    def update(self, buttons_1=0, buttons_2=0):
+        """Advance the game by one tick with the buttons each player holds."""
+        if self.game_state == "PAUSED":
+            return
+
+        self.tick += 1
+
+        previous_1, self.buttons_1 = self.buttons_1, buttons_1
+        previous_2, self.buttons_2 = self.buttons_2, buttons_2
+        self.apply_buttons(self.player_sprite_1, self.physics_engine_1, previous_1, buttons_1, "sounds/fire-attack.wav")
+        self.apply_buttons(self.player_sprite_2, self.physics_engine_2, previous_2, buttons_2, "sounds/water-attack.wav")
+
+        """Movement and game logic"""
+
+        # Check if the characters are within the borders and adjust their position if necessary
+        if self.player_sprite_1.left < self.player_initial_position:
+            self.player_sprite_1.left = self.player_initial_position
+        if self.player_sprite_1.right > self.end_of_map:
+            self.player_sprite_1.right = self.end_of_map
+
+        if self.player_sprite_2.left < self.player_initial_position:
+            self.player_sprite_2.left = self.player_initial_position
+        if self.player_sprite_2.right > self.end_of_map:
+            self.player_sprite_2.right = self.end_of_map
+
+        # Update the players
+        self.player_sprite_1.update()
+        self.player_sprite_2.update()
+
+        # Move the player with the physics engine
+        self.physics_engine_1.update()
+        self.physics_engine_2.update()
+
+        # Move the projectiles, a hit on a character's attack target counts when its attack is over
+        hits = self.projectiles.update(
+            [None if trigger is None else self.level.cell_grid((self.rules["triggers"][trigger][1],), border=0)
+             for trigger in self.rules["attack_triggers"]],
+            [self.level.cell_grid(self.wall_layers(player)) for player in (0, 1)],
+            self.level.cell_size,
+        )
+
+        for index, player in enumerate((self.player_sprite_1, self.player_sprite_2)):
+            # See if player is on a surface it surfs on, from the tile under its feet
+            player.on_special_surface = bool(SURFERS[index] & (1 << self.surface_under(player)))
+
+            # Levers fire as long as the player touches them
+            for trigger in self.rules["touch_triggers"][index]:
+                if arcade.check_for_collision_with_list(player, self.scene[self.rules["triggers"][trigger][1]]):
+                    self.fire_trigger(trigger)
+
+            # Special attacks fire when the attack animation is over and its projectile hit the target
+            trigger = self.rules["attack_triggers"][index]
+            if trigger is not None:
+                if hits & (1 << index):
+                    player.hit_object = True
+
+                if player.can_update_state and player.hit_object:
+                    self.fire_trigger(trigger)
+                    player.hit_object = False
+
+        # Move the enemies
+        if len(self.level.enemies):
+            self.level.enemies.update(self.level.cell_grid(self.wall_layers()), self.level.cell_size)
+
+        # See if we hit any coins
+        coin_hit_list_1 = arcade.check_for_collision_with_list(
+            self.player_sprite_1, self.scene["Coins"]
+        )
+
+        # Loop through each coin we hit (if any) and remove it
+        for coin in coin_hit_list_1:
+            # Remove the coin
+            self.level.remove_sprite(coin)
+            # Add one to the score
+            self.score += 1
+            self.play_sound('sounds/coin.wav', volume=0.25)
+
+        coin_hit_list_2 = arcade.check_for_collision_with_list(
+            self.player_sprite_2, self.scene["Coins"]
+        )
+
+        for coin in coin_hit_list_2:
+            self.level.remove_sprite(coin)
+            self.score += 1
+            self.play_sound('sounds/coin.wav', volume=0.25)
+
+        # See if we characters reach the exit
+        exit_hit_list_1 = arcade.check_for_collision_with_list(
+            self.player_sprite_1, self.scene["Exit"]
+        )
+        exit_hit_list_2 = arcade.check_for_collision_with_list(
+            self.player_sprite_2, self.scene["Exit"]
+        )
+        if exit_hit_list_1 and exit_hit_list_2:
+            if not self.end_sound_played:
+                self.play_sound(':resources:sounds/upgrade5.wav')
+            if self.rules["next"] is None:
+                self.end_sound_played = True
+                self.game_end = True
+            else:
+                self.current_level = self.rules["next"]
+                self.between_levels = True
+                self.setup_level(self.current_level)
+
+        # Position the camera
+        self.center_camera_to_player()
+
+    def wall_layers(self, player=None):
+        """
+        The layers that are walls for a player as the fired triggers left them.
+        Without a player, the layers that are walls for both, enemies walk on those.
+        """
+        names = self.wall_names.get((player, self.triggers_fired))
+        if names is None:
+            if player is None:
+                names = set(wall_layers(self.current_level, 0, self.triggers_fired))
+                names.intersection_update(wall_layers(self.current_level, 1, self.triggers_fired))
+            else:
+                names = wall_layers(self.current_level, player, self.triggers_fired)
+            names = self.wall_names[(player, self.triggers_fired)] = tuple(sorted(names))
+        return names
+
+    def fire_trigger(self, index):
+        """Apply the effects of one of the current level's triggers."""
+        sound, sound_once, shown, hidden, moves, clear = self.rules["effects"][index]
+        if sound is not None and not (sound_once and self.triggers_fired & (1 << index)):
+            self.play_sound(sound)
+        self.triggers_fired |= 1 << index
+
+        for name in shown:
+            self.level.set_layer_visible(name, True)
+        for name in hidden:
+            self.level.set_layer_visible(name, False)
+        for name, destination in moves:
+            self.level.move_layer(name, destination)
+        for name in clear:
+            self.level.clear_layer(name)
+
+    # --- Saving and snapshots
+
+    def save_data(self):
+        """Return the state to write into a save file, see savegame.encode_save."""
+        game_data = {
+            'current_level': self.current_level,
+            'score': self.score,
+            'player_initial_position': self.player_initial_position,
+            'players': [self.player_data(self.player_sprite_1), self.player_data(self.player_sprite_2)],
+            'signature': self.level.signature,
+            'sprite_count': len(self.level.sprites),
+            'level_state': self.level.capture_state(),
+            'triggers_fired': self.triggers_fired,
+            'projectiles': self.projectiles.state_bytes(),
+        }
+        for name in WORLD_FLAGS:
+            game_data[name] = getattr(self, name)
+        return game_data
+
+    def load_data(self, game_data):
+        """
+        Restore a state returned by save_data. Raises ValueError if it is from another map,
+        before anything is changed, so the world stays as it was.
+        """
+        if game_data['current_level'] not in LEVEL_RULES:
+            raise ValueError(f"there is no level {game_data['current_level']}")
+        # Check the save against the level it is from before switching to it
+        level = self.load_level(game_data['current_level'])
+        if game_data['signature'] != level.signature or game_data['sprite_count'] != len(level.sprites):
+            raise ValueError("the saved state was made with a different version of the map")
+        level.check_state(game_data['level_state'])
+        projectiles = game_data['projectiles']
+        if projectiles is not None and len(projectiles) != self.projectiles.nbytes:
+            raise ValueError("the projectiles state has the wrong size")
+
+        # Only switch levels if the save is from another one, the current level is restored in place
+        if self.level is not level:
+            self.current_level = game_data['current_level']
+            self.setup_level(self.current_level)
+        self.level.apply_state(game_data['level_state'])
+
+        self.score = game_data['score']
+        self.player_initial_position = game_data['player_initial_position']
+        self.triggers_fired = game_data['triggers_fired']
+        # Saves from before the projectiles have none in flight
+        if projectiles is None:
+            self.projectiles.clear()
+        else:
+            self.projectiles.apply_bytes(projectiles)
+        for name in WORLD_FLAGS:
+            setattr(self, name, game_data[name])
+
+        self.restore_player(self.player_sprite_1, game_data['players'][0])
+        self.restore_player(self.player_sprite_2, game_data['players'][1])
+
+    def player_data(self, player):
+        data = {
+            'center_x': player.center_x,
+            'center_y': player.center_y,
+            'change_x': player.change_x,
+            'change_y': player.change_y,
+            'state': PLAYER_STATES.index(player.state),
+            'current_frame': player.current_frame,
+            'texture_change_tick': player.texture_change_tick,
+        }
+        for name in PLAYER_FLAGS:
+            data[name] = getattr(player, name)
+        return data
+
+    def restore_player(self, player, data):
+        player.center_x = data['center_x']
+        player.center_y = data['center_y']
+        player.change_x = data['change_x']
+        player.change_y = data['change_y']
+        for name in PLAYER_FLAGS:
+            setattr(player, name, data[name])
+        player.restore_state(PLAYER_STATES[data['state']], data['current_frame'], data['texture_change_tick'])
+
+    def capture_snapshot(self, snapshot):
+        """Copy the whole world state into a snapshot's preallocated buffers."""
+        snapshot.tick = self.tick
+        snapshot.level = self.current_level
+        snapshot.score = self.score
+        snapshot.camera_x = self.camera_x
+        snapshot.flags = sum(1 << bit for bit, name in enumerate(WORLD_FLAGS) if getattr(self, name))
+        snapshot.flags |= self.triggers_fired << TRIGGER_SHIFT
+
+        players = snapshot.players
+        player_ints = snapshot.player_ints
+        for index, (player, buttons) in enumerate(((self.player_sprite_1, self.buttons_1), (self.player_sprite_2, self.buttons_2))):
+            offset = index * PLAYER_FLOATS
+            players[offset] = player.center_x
+            players[offset + 1] = player.center_y
+            players[offset + 2] = player.change_x
+            players[offset + 3] = player.change_y
+            offset = index * PLAYER_INTS
+            player_ints[offset] = PLAYER_STATES.index(player.state)
+            player_ints[offset + 1] = player.current_frame
+            player_ints[offset + 2] = player.texture_change_tick
+            player_ints[offset + 3] = sum(1 << bit for bit, name in enumerate(PLAYER_FLAGS) if getattr(player, name))
+            player_ints[offset + 4] = buttons
+
+        self.level.capture_into(snapshot)
+        if len(snapshot.projectiles) != self.projectiles.floats.nbytes + self.projectiles.ints.nbytes:
+            snapshot.projectiles = bytearray(self.projectiles.floats.nbytes + self.projectiles.ints.nbytes)
+        self.projectiles.capture_into(snapshot.projectiles)
+
+    def restore_snapshot(self, snapshot):
+        """Bring the world back to the state captured in a snapshot."""
+        if snapshot.level != self.current_level:
+            self.current_level = snapshot.level
+            # Restoring a state does not replay it, setup_level must not start the level's music again
+            sound_handler, self.sound_handler = self.sound_handler, None
+            try:
+                self.setup_level(self.current_level)
+            finally:
+                self.sound_handler = sound_handler
+        self.level.restore_from(snapshot)
+        self.projectiles.restore_from(snapshot.projectiles)
+
+        self.tick = snapshot.tick
+        self.score = snapshot.score
+        self.camera_x = snapshot.camera_x
+        for bit, name in enumerate(WORLD_FLAGS):
+            setattr(self, name, bool(snapshot.flags & (1 << bit)))
+        self.triggers_fired = snapshot.flags >> TRIGGER_SHIFT
+
+        players = snapshot.players
+        player_ints = snapshot.player_ints
+        for index, player in enumerate((self.player_sprite_1, self.player_sprite_2)):
+            offset = index * PLAYER_FLOATS
+            player.center_x = players[offset]
+            player.center_y = players[offset + 1]
+            player.change_x = players[offset + 2]
+            player.change_y = players[offset + 3]
+            offset = index * PLAYER_INTS
+            for bit, name in enumerate(PLAYER_FLAGS):
+                setattr(player, name, bool(player_ints[offset + 3] & (1 << bit)))
+            state = PLAYER_STATES[player_ints[offset]]
+            if state != player.state or player_ints[offset + 1] != player.current_frame:
+                player.restore_state(state, player_ints[offset + 1], player_ints[offset + 2])
+            else:
+                player.texture_change_tick = player_ints[offset + 2]
+                player.texture = player.textures[player.current_frame] if player.facing_right else player.textures_mirrored[player.current_frame]
+        self.buttons_1 = player_ints[4]
+        self.buttons_2 = player_ints[PLAYER_INTS + 4]